@@ -1,9 +1,29 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List
+import time
+_startup_started = time.perf_counter()
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Path, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, StrictInt, StrictStr, TypeAdapter, ValidationError, model_validator
+from typing import Any, List, Literal, Optional, Tuple, Union
 import numpy as np
-from utils.helpers import load_model_artifacts, map_symptoms_to_vector
+from utils.helpers import (
+    MODELS_DIR, SYMPTOM_IDS, bitmasks_to_matrix, prediction_message, single_toggle_matrix, risk_level_for,
+    symptom_mapping
+)
+from utils.audit import AuditLog, feature_bitmasks
+from utils.admission import AdmissionController, AdmissionMiddleware, TokenBuckets
+from utils.micro_batching import MicroBatcher
+from utils.model_registry import ModelBundle, ModelRegistry, ModelVersionMiddleware, mark_serving_version
+from utils.http_cache import HttpCachePolicy, etag_matches
+from utils.prediction_cache import PredictionCache
+from utils import admission, audit, bulk, cohort, metrics, prefork, profiling, readiness
+from utils.prediction_table import TABLE_DTYPE
+import hmac
+import json
 import logging
+import os
+import tempfile
 from fastapi.middleware.cors import CORSMiddleware
 
 # Set up logging
@@ -24,23 +44,388 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(ModelVersionMiddleware)
+
+# Sampled cProfile/tracemalloc windows opened through /admin/profile (utils/profiling.py). Off by
+# default; when off, nothing is installed on the request path.
+profiler = None
+if os.getenv("ENDODX_PROFILING", "0") == "1":
+    profiler = profiling.Profiler(
+        os.getenv("ENDODX_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "endodx-profiles")),
+        max_seconds=float(os.getenv("ENDODX_PROFILE_MAX_SECONDS", "300"))
+    )
+    app.add_middleware(profiling.ProfilingMiddleware, profiler=profiler)
 
-# Load model artifacts once at startup
+# Admission control for /predict*: ENDODX_MAX_IN_FLIGHT concurrent requests plus a bounded wait
+# queue, and an optional per-client token bucket. Both are off by default (utils/admission.py).
+MAX_IN_FLIGHT = int(os.getenv("ENDODX_MAX_IN_FLIGHT", "0"))
+RATE_LIMIT = float(os.getenv("ENDODX_RATE_LIMIT", "0"))
+admission_controller = None
+if MAX_IN_FLIGHT > 0:
+    admission_controller = AdmissionController(
+        MAX_IN_FLIGHT,
+        max_queue=int(os.getenv("ENDODX_MAX_QUEUE", "100")),
+        queue_timeout_ms=float(os.getenv("ENDODX_QUEUE_TIMEOUT_MS", "1000"))
+    )
+rate_limiter = None
+if RATE_LIMIT > 0:
+    rate_limiter = TokenBuckets(RATE_LIMIT, burst=float(os.getenv("ENDODX_RATE_BURST", str(max(1.0, RATE_LIMIT)))))
+if admission_controller is not None or rate_limiter is not None:
+    # Added last so it runs first and refused requests cost as little as possible
+    app.add_middleware(
+        AdmissionMiddleware,
+        controller=admission_controller,
+        rate_limiter=rate_limiter,
+        client_header=os.getenv("ENDODX_RATE_LIMIT_HEADER"),
+        retry_after=int(os.getenv("ENDODX_RETRY_AFTER", "1"))
+    )
+    metrics.registry.collectors.append(lambda: admission.render_metrics(admission_controller, rate_limiter))
+
+# Versioned artifacts (utils/model_registry.py). The wanted version is loaded, validated and
+# warmed up before the server starts; a watcher thread then swaps in new versions as they appear.
+# Within a version the fast-start file is preferred, then joblib plus the compiled evaluator,
+# and a matching precomputed table (python -m utils.prediction_table) replaces the live model.
+model_registry = ModelRegistry(
+    model_dir=os.getenv("ENDODX_MODEL_DIR", MODELS_DIR),
+    poll_interval=float(os.getenv("ENDODX_MODEL_POLL_SECONDS", "5")),
+    use_fast_artifacts=os.getenv("ENDODX_FAST_ARTIFACTS", "1") != "0",
+    use_prediction_table=os.getenv("ENDODX_PREDICTION_TABLE", "1") != "0",
+    use_fast_model=os.getenv("ENDODX_FAST_MODEL", "1") != "0",
+)
+
+def _publish_model_info(bundle: ModelBundle) -> None:
+    metrics.registry.info.update(
+        version=bundle.version,
+        fingerprint=bundle.fingerprint,
+        artifact_format=bundle.artifact_format,
+        scorer=bundle.scorer
+    )
+
+model_registry.listeners.append(_publish_model_info)
 try:
-    model, scaler, features = load_model_artifacts()
-    logger.info("Model artifacts loaded successfully")
+    load_started = time.perf_counter()
+    initial_bundle = model_registry.load_initial()
+    logger.info(f"Model {initial_bundle.version} loaded successfully ({initial_bundle.artifact_format}, "
+                f"{initial_bundle.scorer}, {(time.perf_counter() - load_started) * 1000:.1f} ms)")
 except Exception as e:
     logger.error(f"Failed to load model artifacts: {str(e)}")
     raise e
 
+# Readiness self-check (utils/readiness.py): each worker warms up and times synthetic single and
+# batch requests before /health/ready reports it ready. p99 budgets of 0 are reported but not enforced.
+self_check = None
+if os.getenv("ENDODX_SELF_CHECK", "1") != "0":
+    self_check = readiness.SelfCheck(
+        single_p99_budget_ms=float(os.getenv("ENDODX_READY_SINGLE_P99_MS", "0")),
+        batch_p99_budget_ms=float(os.getenv("ENDODX_READY_BATCH_P99_MS", "0")),
+        batch_size=int(os.getenv("ENDODX_READY_BATCH_SIZE", "100")),
+        recheck_interval=float(os.getenv("ENDODX_READY_RECHECK_SECONDS", "30"))
+    )
+
+# Default for the ?mode= parameter: "fast" scores with the distilled model (python -m utils.fast_model)
+# where one is available, rescoring rows near the risk thresholds exactly
+ScoringMode = Literal["exact", "fast"]
+SCORING_MODE = os.getenv("ENDODX_SCORING_MODE", "exact")
+if SCORING_MODE not in ("exact", "fast"):
+    raise ValueError(f"ENDODX_SCORING_MODE must be 'exact' or 'fast', not {SCORING_MODE!r}")
+
+def use_fast(mode: Optional[str]) -> bool:
+    return (mode or SCORING_MODE) == "fast"
+
+# LRU cache of /predict results by symptom bitmask; ENDODX_CACHE_SIZE=0 disables it
+CACHE_SIZE = int(os.getenv("ENDODX_CACHE_SIZE", "4096"))
+prediction_cache = PredictionCache(CACHE_SIZE) if CACHE_SIZE > 0 else None
+
+# HTTP caching (utils/http_cache.py): ETags keyed by artifacts and symptom set, Cache-Control for
+# proxies, 304s on GET /predict/bitmask/{bitmask}, and gzip for batch responses over a size threshold
+http_cache = HttpCachePolicy(
+    max_age=int(os.getenv("ENDODX_HTTP_CACHE_SECONDS", "300")),
+    compress_min_bytes=int(os.getenv("ENDODX_COMPRESS_MIN_BYTES", "4096")),
+    compress_level=int(os.getenv("ENDODX_COMPRESS_LEVEL", "1"))
+)
+
+# Row layout of /predict/batch/packed responses
+PACKED_RESULT_DTYPE = TABLE_DTYPE
+
+# Upper bound on rows accepted by /predict/batch
+MAX_BATCH_SIZE = int(os.getenv("ENDODX_MAX_BATCH_SIZE", "10000"))
+
 class SymptomsRequest(BaseModel):
-    symptoms: List[str]
+    # Exactly one of: display names, stable IDs (GET /symptoms), or an integer with bit <id> set per symptom
+    symptoms: Optional[List[str]] = None
+    symptom_ids: Optional[List[int]] = None
+    bitmask: Optional[int] = Field(None, ge=0)
+
+    @model_validator(mode="after")
+    def check_one_format(self):
+        if sum(v is not None for v in (self.symptoms, self.symptom_ids, self.bitmask)) != 1:
+            raise ValueError("Provide exactly one of symptoms, symptom_ids or bitmask")
+        return self
 
 class PredictionResponse(BaseModel):
     prediction: int
     probability: float
     risk_level: str
     message: str
+    # Names or IDs in the request that matched no known symptom and were ignored
+    unknown_symptoms: List[Union[str, int]] = []
+
+class SymptomInfo(BaseModel):
+    id: int
+    name: str
+    feature: str
+    used_by_model: bool
+
+class BatchSymptomsRequest(BaseModel):
+    # Rows are validated individually so one bad row doesn't fail the batch
+    items: List[Any]
+
+class BatchPredictionItem(BaseModel):
+    index: int
+    result: Optional[PredictionResponse] = None
+    error: Optional[str] = None
+
+class BatchPredictionResponse(BaseModel):
+    results: List[BatchPredictionItem]
+
+class SymptomToggle(BaseModel):
+    symptom: str
+    feature: str
+    selected: bool
+    probability: float
+    risk_level: str
+    delta: float
+
+class TogglePredictionResponse(BaseModel):
+    current: PredictionResponse
+    toggles: List[SymptomToggle]
+
+class SymptomContribution(BaseModel):
+    symptom: str
+    feature: str
+    contribution: float
+
+class ExplanationResponse(TogglePredictionResponse):
+    # Selected symptoms by leave-one-out contribution, largest first
+    ranking: Optional[List[SymptomContribution]] = None
+
+# A batch row is a list of names, a list of IDs or an ID bitmask
+_batch_row_adapter = TypeAdapter(Union[List[StrictStr], List[StrictInt], StrictInt])
+
+NO_SYMPTOMS_RESPONSE = PredictionResponse(
+    prediction=0,
+    probability=0.0,
+    risk_level="unknown",
+    message="No symptoms selected. Please select at least one symptom for prediction."
+)
+
+def build_prediction_response(pred: int, proba: float) -> PredictionResponse:
+    return PredictionResponse(
+        prediction=int(pred),
+        probability=float(proba),
+        risk_level=risk_level_for(proba),
+        message=prediction_message(proba)
+    )
+
+def serving_bundle(http_request: Request) -> ModelBundle:
+    """The version this request uses from start to finish, even if a swap happens meanwhile"""
+    bundle = model_registry.active
+    mark_serving_version(http_request.scope, bundle)
+    return bundle
+
+def score_bitmasks(items: List[Tuple[ModelBundle, int]]):
+    """Score (bundle, feature bitmask) pairs, one model pass per bundle, returning (prediction, probability) each"""
+    results = [None] * len(items)
+    groups = {}
+    for i, (bundle, bitmask) in enumerate(items):
+        groups.setdefault(id(bundle), (bundle, [], []))
+        groups[id(bundle)][1].append(i)
+        groups[id(bundle)][2].append(bitmask)
+    for bundle, indices, bitmasks in groups.values():
+        preds, probas = bundle.score_matrix(
+            bitmasks_to_matrix(np.array(bitmasks, dtype=np.int64), len(bundle.features)))
+        for i, pred, proba in zip(indices, preds, probas):
+            results[i] = (pred, proba)
+    return results
+
+def decode_symptoms(bundle: ModelBundle, request: SymptomsRequest):
+    """Return (feature bitmask, unknown inputs, whether the request named any symptom)"""
+    if request.symptoms is not None:
+        bitmask, unknown = bundle.codec.from_names(request.symptoms)
+        return bitmask, unknown, bool(request.symptoms)
+    if request.symptom_ids is not None:
+        bitmask, unknown = bundle.codec.from_ids(request.symptom_ids)
+        return bitmask, unknown, bool(request.symptom_ids)
+    bitmask, unknown = bundle.codec.from_id_bitmask(request.bitmask)
+    return bitmask, unknown, request.bitmask != 0
+
+def with_unknown(response: PredictionResponse, unknown: List[Union[str, int]]) -> PredictionResponse:
+    # Responses can be shared (NO_SYMPTOMS_RESPONSE), so report unknowns on a copy
+    return response.model_copy(update={"unknown_symptoms": unknown}) if unknown else response
+
+# Optional audit trail of every scoring, written off the request path (utils/audit.py)
+audit_log = None
+if os.getenv("ENDODX_AUDIT_DIR"):
+    audit_log = AuditLog(
+        os.getenv("ENDODX_AUDIT_DIR"),
+        max_queue=int(os.getenv("ENDODX_AUDIT_QUEUE", "100000")),
+        batch_size=int(os.getenv("ENDODX_AUDIT_BATCH", "1000")),
+        flush_interval=float(os.getenv("ENDODX_AUDIT_FLUSH_SECONDS", "1")),
+        rotate_bytes=int(float(os.getenv("ENDODX_AUDIT_ROTATE_MB", "64")) * 2**20),
+        compress=os.getenv("ENDODX_AUDIT_COMPRESS", "1") != "0",
+        policy=os.getenv("ENDODX_AUDIT_POLICY", "drop"),
+        block_timeout=float(os.getenv("ENDODX_AUDIT_BLOCK_SECONDS", "1"))
+    )
+
+def audit_response(endpoint: str, bundle: ModelBundle, bitmask: int, response: PredictionResponse,
+                   started: float) -> None:
+    if audit_log is not None:
+        audit_log.record(endpoint, bundle.version, bitmask, response.prediction, response.probability,
+                         response.risk_level, time.perf_counter() - started)
+
+def audit_rows(endpoint: str, bundle: ModelBundle, bitmasks, preds, probas, started: float) -> None:
+    if audit_log is not None:
+        audit_log.record_many(endpoint, bundle.version, bitmasks, preds, probas, time.perf_counter() - started)
+
+# Optional coalescing of concurrent /predict calls into one scoring call off the event loop
+micro_batcher = None
+if os.getenv("ENDODX_MICROBATCH", "0") == "1":
+    micro_batcher = MicroBatcher(
+        score_bitmasks,
+        max_batch_size=int(os.getenv("ENDODX_MICROBATCH_MAX_SIZE", "64")),
+        max_wait_ms=float(os.getenv("ENDODX_MICROBATCH_MAX_WAIT_MS", "2"))
+    )
+
+def _component_metrics():
+    if prediction_cache is not None:
+        stats = prediction_cache.stats()
+        for name in ("hits", "misses", "evictions", "invalidations"):
+            yield f"# TYPE endodx_cache_{name}_total counter"
+            yield f"endodx_cache_{name}_total {stats[name]}"
+        yield "# TYPE endodx_cache_size gauge"
+        yield f"endodx_cache_size {stats['size']}"
+    if micro_batcher is not None:
+        stats = micro_batcher.stats.snapshot()
+        yield "# TYPE endodx_microbatch_batches_total counter"
+        yield f"endodx_microbatch_batches_total {stats['batches']}"
+        yield "# TYPE endodx_microbatch_items_total counter"
+        yield f"endodx_microbatch_items_total {stats['items']}"
+        yield "# TYPE endodx_microbatch_queue_delay_max_seconds gauge"
+        yield f"endodx_microbatch_queue_delay_max_seconds {stats['max_queue_delay_ms'] / 1000}"
+    if audit_log is not None:
+        stats = audit_log.stats()
+        yield "# HELP endodx_audit_records_total Audit records by outcome"
+        yield "# TYPE endodx_audit_records_total counter"
+        for outcome in ("enqueued", "written", "dropped"):
+            yield f'endodx_audit_records_total{{outcome="{outcome}"}} {stats[outcome]}'
+        yield "# TYPE endodx_audit_write_errors_total counter"
+        yield f"endodx_audit_write_errors_total {stats['write_errors']}"
+        yield "# TYPE endodx_audit_queue_depth gauge"
+        yield f"endodx_audit_queue_depth {stats['queue_depth']}"
+    stats = http_cache.stats()
+    yield "# TYPE endodx_http_not_modified_total counter"
+    yield f"endodx_http_not_modified_total {stats['not_modified']}"
+    yield "# TYPE endodx_http_compressed_responses_total counter"
+    yield f"endodx_http_compressed_responses_total {stats['compressed_responses']}"
+    yield "# HELP endodx_http_compressed_bytes_total Response bytes before and after gzip"
+    yield "# TYPE endodx_http_compressed_bytes_total counter"
+    yield f'endodx_http_compressed_bytes_total{{stage="in"}} {stats["compressed_bytes_in"]}'
+    yield f'endodx_http_compressed_bytes_total{{stage="out"}} {stats["compressed_bytes_out"]}'
+    fast_model = model_registry.active.fast_model
+    if fast_model is not None:
+        yield "# HELP endodx_fast_scoring_rows_total Rows scored in fast mode, by whether they fell back to exact"
+        yield "# TYPE endodx_fast_scoring_rows_total counter"
+        yield f'endodx_fast_scoring_rows_total{{result="fast"}} {fast_model.fast_rows}'
+        yield f'endodx_fast_scoring_rows_total{{result="fallback"}} {fast_model.fallback_rows}'
+
+metrics.registry.collectors.append(_component_metrics)
+
+@app.on_event("startup")
+async def calibrate_metrics():
+    if metrics.ENABLED:
+        overhead = metrics.measure_overhead()
+        logger.info(f"Metrics enabled, {overhead * 1e9:.0f} ns per stage mark")
+
+@app.on_event("startup")
+async def log_startup_time():
+    if prefork.worker_slot is not None:
+        logger.info(f"Worker {prefork.worker_slot} (pid {os.getpid()}) ready")
+    else:
+        logger.info(f"API started in {(time.perf_counter() - _startup_started) * 1000:.1f} ms")
+
+@app.on_event("startup")
+async def start_micro_batcher():
+    if micro_batcher is not None:
+        micro_batcher.start()
+        logger.info(f"Micro-batching enabled (max {micro_batcher.max_batch_size} requests, "
+                    f"{micro_batcher.max_wait * 1000:g} ms window)")
+
+@app.on_event("shutdown")
+async def stop_micro_batcher():
+    if micro_batcher is not None:
+        await micro_batcher.stop()
+
+@app.on_event("startup")
+async def start_audit_log():
+    if audit_log is not None:
+        audit_log.start()
+        overhead = audit.measure_overhead(audit_log)
+        logger.info(f"Audit log enabled in {audit_log.directory} ({audit_log.policy} when full), "
+                    f"{overhead * 1e9:.0f} ns per record")
+
+@app.on_event("shutdown")
+async def stop_audit_log():
+    if audit_log is not None:
+        await run_in_threadpool(audit_log.close)
+
+@app.on_event("startup")
+async def start_model_watcher():
+    # Started per process, so in pre-fork mode every worker watches for new versions itself
+    model_registry.start_watcher()
+
+@app.on_event("shutdown")
+async def stop_model_watcher():
+    model_registry.stop_watcher()
+
+@app.on_event("startup")
+async def start_profiler():
+    if profiler is not None:
+        profiler.start()
+        logger.info(f"Profiling available through /admin/profile, results in {profiler.directory}")
+
+@app.on_event("shutdown")
+async def stop_profiler():
+    if profiler is not None:
+        await profiler.stop()
+
+@app.on_event("startup")
+async def run_self_check():
+    # Registered after the other startup work, so the worker is measured as it will serve
+    if self_check is None:
+        return
+    passed = await self_check.run(model_registry.active, self_check_single, self_check_batch)
+    report = self_check.payload()
+    logger.info(f"Self-check: single p50 {report['single']['p50_ms']:.2f} ms, p99 {report['single']['p99_ms']:.2f} ms; "
+                f"batch of {report['batch']['batch_size']} p50 {report['batch']['p50_ms']:.2f} ms, "
+                f"p99 {report['batch']['p99_ms']:.2f} ms; warm-up {report['warm_up_ms']:.0f} ms")
+    if not passed:
+        logger.warning(f"Not ready: {'; '.join(self_check.failures)}")
+        self_check.start_rechecks(lambda: model_registry.active, self_check_single, self_check_batch,
+                                  on_ready=lambda: prefork.mark_worker("ready"))
+
+@app.on_event("shutdown")
+async def stop_self_check():
+    if self_check is not None:
+        self_check.stop()
+
+@app.on_event("startup")
+async def mark_worker_ready():
+    prefork.mark_worker("ready" if self_check is None or self_check.ready else "unready")
+
+@app.on_event("shutdown")
+async def mark_worker_stopping():
+    prefork.mark_worker("stopping")
 
 @app.get("/")
 async def root():
@@ -48,49 +433,585 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    status = {"status": "healthy", "model_version": model_registry.active.version,
+              "ready": self_check is None or self_check.ready}
+    workers = prefork.worker_health()
+    if workers is None:
+        return status
+    return {**status, **workers}
 
-@app.post("/predict", response_model=PredictionResponse)
-async def predict_endometriosis(request: SymptomsRequest):
+@app.get("/health/live")
+async def liveness():
+    """The process is up and its event loop is responding"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_probe():
+    """200 once this worker has warmed up within its latency budgets, else 503"""
+    status = self_check.payload() if self_check is not None else {"ready": True, "state": readiness.READY}
+    status["model_version"] = model_registry.active.version
+    # The other slots are listed for information only: gating on them would take the whole host out of
+    # rotation during every rolling recycle, or whenever one worker misses its budget
+    workers = prefork.worker_health()
+    if workers is not None:
+        status.update(workers)
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+# Admin endpoints need ENDODX_ADMIN_TOKEN to be set and sent back in X-Admin-Token
+ADMIN_TOKEN = os.getenv("ENDODX_ADMIN_TOKEN")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ENDODX_ADMIN_TOKEN).")
+    if not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
+
+@app.get("/admin/models", dependencies=[Depends(require_admin)])
+async def model_status():
+    return model_registry.status()
+
+@app.post("/admin/models/reload", dependencies=[Depends(require_admin)])
+async def reload_models():
+    """Check for a new or changed version now instead of waiting for the watcher"""
+    await run_in_threadpool(model_registry.check)
+    return model_registry.status()
+
+@app.post("/admin/models/rollback", dependencies=[Depends(require_admin)])
+async def rollback_model(version: Optional[str] = None):
+    """Serve the given (default: previous) version and pin it in ACTIVE for every worker"""
     try:
-        if not request.symptoms:
-            return PredictionResponse(
-                prediction=0,
-                probability=0.0,
-                risk_level="unknown",
-                message="No symptoms selected. Please select at least one symptom for prediction."
-            )
+        await run_in_threadpool(model_registry.rollback, version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except Exception as e:
+        logger.error(f"Rollback failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Rollback failed: {str(e)}")
+    return model_registry.status()
 
-        # Build input vector
-        feature_vec = map_symptoms_to_vector(request.symptoms, features)
-        scaled = scaler.transform(feature_vec)
+@app.post("/admin/models/unpin", dependencies=[Depends(require_admin)])
+async def unpin_model():
+    """Remove the ACTIVE pin so the most recently modified version is served again"""
+    model_registry.unpin()
+    await run_in_threadpool(model_registry.check)
+    return model_registry.status()
+
+def require_profiler() -> profiling.Profiler:
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (set ENDODX_PROFILING=1).")
+    return profiler
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_status(profiler: profiling.Profiler = Depends(require_profiler)):
+    return profiler.status()
+
+@app.post("/admin/profile/start", dependencies=[Depends(require_admin)])
+async def start_profile_window(seconds: float = 30, fraction: float = 0.1, trace_memory: bool = False,
+                               profiler: profiling.Profiler = Depends(require_profiler)):
+    """Profile ``fraction`` of /predict requests in every worker for ``seconds``"""
+    try:
+        return profiler.start_window(seconds, fraction, trace_memory)
+    except ValueError as e:
+        raise HTTPException(status_code=409 if "still open" in str(e) else 400, detail=str(e))
 
+@app.post("/admin/profile/stop", dependencies=[Depends(require_admin)])
+async def stop_profile_window(profiler: profiling.Profiler = Depends(require_profiler)):
+    """Close the open window early; other workers write their results within a second"""
+    window = profiler.stop_window()
+    if window is None:
+        raise HTTPException(status_code=409, detail="No profiling window is open.")
+    return window
+
+@app.get("/admin/profile/stats", dependencies=[Depends(require_admin)])
+async def profile_stats(window: Optional[str] = None, format: Literal["json", "pstats"] = "json",
+                        top: int = 30, sort: Literal["cumulative", "tottime", "calls"] = "cumulative",
+                        profiler: profiling.Profiler = Depends(require_profiler)):
+    """Merged results of a closed window (default: the latest), as JSON or a pstats file"""
+    try:
+        if format == "json":
+            return await run_in_threadpool(profiler.report, window, max(1, min(top, 1000)), sort)
+        data = await run_in_threadpool(profiler.pstats_bytes, window)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    if data is None:
+        raise HTTPException(status_code=404, detail="No requests were sampled in this window.")
+    filename = f"endodx-{window or profiler.windows()[-1]}.pstats"
+    return Response(data, media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/symptoms", response_model=List[SymptomInfo])
+async def list_symptoms():
+    """Stable symptom IDs for the symptom_ids and bitmask request formats"""
+    used = set(model_registry.active.features)
+    return [
+        SymptomInfo(id=symptom_id, name=name, feature=symptom_mapping[name], used_by_model=symptom_mapping[name] in used)
+        for name, symptom_id in SYMPTOM_IDS.items()
+    ]
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/batching")
+async def batching_metrics():
+    if micro_batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **micro_batcher.stats.snapshot()}
+
+@app.get("/metrics/admission")
+async def admission_metrics():
+    if admission_controller is None and rate_limiter is None:
+        return {"enabled": False}
+    stats = {"enabled": True}
+    if admission_controller is not None:
+        stats.update(
+            max_in_flight=admission_controller.max_in_flight,
+            max_queue=admission_controller.max_queue,
+            in_flight=admission_controller.in_flight,
+            queue_depth=admission_controller.queue_depth,
+            **admission_controller.stats.snapshot()
+        )
+    if rate_limiter is not None:
+        stats.update(rate_limit=rate_limiter.rate, rate_burst=rate_limiter.burst, rate_limited=rate_limiter.rejected)
+    return stats
+
+@app.get("/metrics/audit")
+async def audit_metrics():
+    if audit_log is None:
+        return {"enabled": False}
+    return {"enabled": True, **audit_log.stats()}
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    if prediction_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **prediction_cache.stats()}
+
+@app.get("/metrics/http")
+async def http_cache_metrics():
+    return http_cache.stats()
+
+async def score_bitmask(bundle: ModelBundle, bitmask: int, timer, fast: bool = False, cached: bool = True):
+    """Score one feature bitmask, marking each stage on the timer"""
+    if bundle.prediction_table is not None:
+        pred, proba = bundle.prediction_table.lookup(bitmask)
+        timer.mark("table_lookup")
+        return pred, proba
+
+    # Approximate results are not cached; rows near a threshold fall through to exact scoring
+    if fast and bundle.fast_model is not None:
+        scored = bundle.fast_model.predict_indices(bundle.codec.indices(bitmask))
+        timer.mark("fast_predict")
+        if scored is not None:
+            return scored
+
+    # Keyed by fingerprint, so swapping in another version invalidates the cache
+    if prediction_cache is not None and cached:
+        hit = prediction_cache.get(bundle.fingerprint, bitmask)
+        timer.mark("cache_lookup")
+        if hit is not None:
+            return hit
+
+    if micro_batcher is not None:
+        pred, proba = await micro_batcher.submit((bundle, bitmask))
+        timer.mark("batch_wait")
+    elif bundle.compiled is not None:
+        compiled = bundle.compiled
+        active = bundle.codec.indices(bitmask)
+        timer.mark("vectorize")
+        decision = compiled.decision_indices(active)
+        pred = compiled.label(decision)
+        timer.mark("predict")
+        proba = compiled.probability_scalar(decision)
+        timer.mark("predict_proba")
+    else:
+        # Build input vector
+        model = bundle.model
+        feature_vec = bitmasks_to_matrix(np.array([bitmask]), len(bundle.features))
+        timer.mark("vectorize")
+        scaled = bundle.scaler.transform(feature_vec)
+        timer.mark("scale")
         pred = model.predict(scaled)[0]
+        timer.mark("predict")
         proba = (model.predict_proba(scaled)[0][1]
                  if hasattr(model, "predict_proba")
                  else float(model.decision_function(scaled)[0]))
+        timer.mark("predict_proba")
+
+    if prediction_cache is not None and cached:
+        prediction_cache.put(bundle.fingerprint, bitmask, (int(pred), float(proba)))
+    return pred, proba
+
+async def self_check_single(bundle: ModelBundle, bitmask: int) -> str:
+    """What /predict does for one symptom set, bypassing the cache so every call does the full work"""
+    pred, proba = await score_bitmask(bundle, bitmask, metrics.NULL_TIMER, use_fast(None), cached=False)
+    return build_prediction_response(pred, proba).model_dump_json()
 
-        # Risk levels
-        if proba >= 0.7:
-            risk_level = "high"
-        elif proba >= 0.4:
-            risk_level = "moderate"
+def self_check_batch(bundle: ModelBundle, bitmasks: np.ndarray) -> str:
+    """What /predict/batch does after validation"""
+    preds, probas = bundle.score_matrix(bitmasks_to_matrix(bitmasks, len(bundle.features)), fast=use_fast(None))
+    return BatchPredictionResponse(results=[
+        BatchPredictionItem(index=i, result=build_prediction_response(pred, proba))
+        for i, (pred, proba) in enumerate(zip(preds, probas))
+    ]).model_dump_json()
+
+def prediction_etag(bundle: ModelBundle, bitmask: int, named: bool, fast: bool,
+                    unknown: List[Union[str, int]] = ()) -> Optional[str]:
+    # Fast mode only changes results when a distilled model is loaded and no exact table replaces it
+    fast = fast and bundle.fast_model is not None and bundle.prediction_table is None
+    return http_cache.etag(bundle.fingerprint, bitmask if named else None, fast, unknown)
+
+async def predict_one(endpoint: str, bundle: ModelBundle, bitmask: int, unknown: List[Union[str, int]],
+                      named: bool, fast: bool, timer, started: float) -> PredictionResponse:
+    try:
+        if not named:
+            response = NO_SYMPTOMS_RESPONSE
         else:
-            risk_level = "low"
+            pred, proba = await score_bitmask(bundle, bitmask, timer, fast)
+            response = build_prediction_response(pred, proba)
+            timer.mark("build_response")
+        response = with_unknown(response, unknown)
+        audit_response(endpoint, bundle, bitmask, response, started)
 
-        message = f"Based on your symptoms, there is a {proba:.1%} likelihood of endometriosis association."
+    except Exception as e:
+        metrics.registry.count_error(endpoint)
+        logger.error(f"Prediction error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+    metrics.registry.count_prediction(endpoint, response.risk_level)
+    return response
+
+@app.post("/predict", response_model=PredictionResponse)
+async def predict_endometriosis(request: SymptomsRequest, http_request: Request, http_response: Response,
+                                mode: Optional[ScoringMode] = None):
+    started = time.perf_counter()
+    timer = metrics.request_timer(http_request.scope, "predict")
+    bundle = serving_bundle(http_request)
+    bitmask, unknown, named = decode_symptoms(bundle, request)
+    timer.mark("bitmask")
+    response = await predict_one("predict", bundle, bitmask, unknown, named, use_fast(mode), timer, started)
+    # Only the tag: a POST carries symptom data in its body, so caches get no freshness to store it by.
+    # The cacheable form is GET /predict/bitmask, which clients can revalidate with this tag
+    etag = prediction_etag(bundle, bitmask, named, use_fast(mode), unknown)
+    if etag is not None:
+        http_response.headers["ETag"] = etag
+    timer.finish()
+    return response
 
-        return PredictionResponse(
-            prediction=int(pred),
-            probability=float(proba),
-            risk_level=risk_level,
-            message=message
+@app.get("/predict/bitmask/{bitmask}", response_model=PredictionResponse)
+async def predict_endometriosis_cacheable(http_request: Request, bitmask: int = Path(..., ge=0),
+                                          mode: Optional[ScoringMode] = None):
+    """/predict for an ID bitmask (bit <id> set per symptom, IDs from GET /symptoms), cacheable over HTTP.
+
+    Responses carry an ETag and Cache-Control. A matching If-None-Match is
+    answered with 304 without scoring. Unlike POST /predict, bits outside the
+    symptom registry reject the request, so every URL has one representation.
+    """
+    started = time.perf_counter()
+    timer = metrics.request_timer(http_request.scope, "predict_get")
+    bundle = serving_bundle(http_request)
+    feature_bitmask, unknown = bundle.codec.from_id_bitmask(bitmask)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown symptom IDs: {unknown[:10]}")
+    named = bitmask != 0
+    headers = http_cache.headers(prediction_etag(bundle, feature_bitmask, named, use_fast(mode)))
+    timer.mark("bitmask")
+    if "ETag" in headers and etag_matches(http_request.headers.get("if-none-match"), headers["ETag"]):
+        http_cache.count_not_modified()
+        timer.finish()
+        return Response(status_code=304, headers=headers)
+
+    response = await predict_one("predict_get", bundle, feature_bitmask, [], named, use_fast(mode), timer, started)
+    timer.finish()
+    return Response(response.model_dump_json(), media_type="application/json", headers=headers)
+
+@app.post("/predict/batch", response_model=BatchPredictionResponse)
+async def predict_endometriosis_batch(request: BatchSymptomsRequest, http_request: Request,
+                                      mode: Optional[ScoringMode] = None):
+    started = time.perf_counter()
+    timer = metrics.request_timer(http_request.scope, "predict_batch")
+    bundle = serving_bundle(http_request)
+    if len(request.items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(request.items)} items (maximum {MAX_BATCH_SIZE})."
         )
 
+    results = [BatchPredictionItem(index=i) for i in range(len(request.items))]
+    rows, row_indices, row_unknown = [], [], []
+    for i, item in enumerate(request.items):
+        try:
+            item = _batch_row_adapter.validate_python(item)
+            if isinstance(item, int):
+                bitmask, unknown = bundle.codec.from_id_bitmask(item)
+            elif item and isinstance(item[0], int):
+                bitmask, unknown = bundle.codec.from_ids(item)
+            else:
+                bitmask, unknown = bundle.codec.from_names(item)
+        except (ValidationError, ValueError) as e:
+            msg = e.errors()[0]["msg"] if isinstance(e, ValidationError) else str(e)
+            results[i].error = f"Invalid symptom list: {msg}"
+            continue
+        if not item:
+            results[i].result = with_unknown(NO_SYMPTOMS_RESPONSE, unknown)
+            continue
+        rows.append(bitmask)
+        row_indices.append(i)
+        row_unknown.append(unknown)
+    timer.mark("validate")
+
+    if rows:
+        try:
+            feature_matrix = bitmasks_to_matrix(np.array(rows, dtype=np.int64), len(bundle.features))
+            timer.mark("vectorize")
+            preds, probas = bundle.score_matrix(feature_matrix, fast=use_fast(mode))
+            timer.mark("score")
+        except Exception as e:
+            metrics.registry.count_error("predict_batch")
+            logger.error(f"Batch prediction error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+        for i, pred, proba, unknown in zip(row_indices, preds, probas, row_unknown):
+            results[i].result = with_unknown(build_prediction_response(pred, proba), unknown)
+            metrics.registry.count_prediction("predict_batch", results[i].result.risk_level)
+        timer.mark("build_response")
+        audit_rows("predict_batch", bundle, np.array(rows, dtype=np.int64), preds, probas, started)
+
+    # Serialized here rather than by FastAPI so large bodies can be gzipped
+    body, headers = http_cache.compress(BatchPredictionResponse(results=results).model_dump_json().encode(),
+                                        http_request.headers.get("accept-encoding"))
+    timer.mark("encode")
+    timer.finish()
+    return Response(body, media_type="application/json", headers=headers)
+
+def score_toggles(bundle: ModelBundle, request: SymptomsRequest, timer):
+    """Score a symptom set and each single-symptom flip of it in one model pass"""
+    bitmask, unknown, _ = decode_symptoms(bundle, request)
+    vector = bitmasks_to_matrix(np.array([bitmask]), len(bundle.features))
+    feature_matrix = single_toggle_matrix(vector)
+    timer.mark("vectorize")
+    preds, probas = bundle.score_matrix(feature_matrix)
+    timer.mark("score")
+
+    # Deltas are relative to the model's score for the current set, even when it is empty
+    base = float(probas[0])
+    current = build_prediction_response(preds[0], base) if vector.any() else NO_SYMPTOMS_RESPONSE
+    current = with_unknown(current, unknown)
+    toggles = [
+        SymptomToggle(
+            symptom=name,
+            feature=feature,
+            selected=bool(vector[0, i]),
+            probability=float(probas[i + 1]),
+            risk_level=risk_level_for(probas[i + 1]),
+            delta=float(probas[i + 1]) - base
+        )
+        for i, (name, feature) in enumerate(zip(bundle.feature_names, bundle.features))
+    ]
+    return bitmask, current, toggles
+
+@app.post("/predict/batch/packed")
+async def predict_endometriosis_batch_packed(http_request: Request, mode: Optional[ScoringMode] = None):
+    """Score a body of little-endian uint64 symptom ID bitmasks, one per row.
+
+    The response body holds one 5-byte record per row: float32 probability
+    then uint8 prediction, little-endian. Rows with no symptoms score 0/0.0,
+    like /predict. Bits outside the symptom registry reject the request.
+    """
+    started = time.perf_counter()
+    timer = metrics.request_timer(http_request.scope, "predict_batch_packed")
+    bundle = serving_bundle(http_request)
+    body = await http_request.body()
+    if len(body) % 8:
+        raise HTTPException(status_code=422, detail="Body length must be a multiple of 8 bytes (uint64 bitmasks).")
+    n_rows = len(body) // 8
+    if n_rows > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {n_rows} items (maximum {MAX_BATCH_SIZE})."
+        )
+
+    id_bitmasks = np.frombuffer(body, dtype="<u8")
+    bitmasks, has_unknown = bundle.codec.from_id_bitmasks(id_bitmasks)
+    if has_unknown.any():
+        bad_rows = np.flatnonzero(has_unknown)
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unknown symptom IDs in {len(bad_rows)} row(s), first rows: {bad_rows[:10].tolist()}"
+        )
+    timer.mark("validate")
+
+    out = np.zeros(n_rows, dtype=PACKED_RESULT_DTYPE)
+    nonempty = np.flatnonzero(id_bitmasks)
+    if len(nonempty):
+        try:
+            feature_matrix = bitmasks_to_matrix(bitmasks[nonempty], len(bundle.features))
+            timer.mark("vectorize")
+            preds, probas = bundle.score_matrix(feature_matrix, fast=use_fast(mode))
+            timer.mark("score")
+        except Exception as e:
+            metrics.registry.count_error("predict_batch_packed")
+            logger.error(f"Packed batch prediction error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+        out["prediction"][nonempty] = preds
+        out["probability"][nonempty] = probas
+        audit_rows("predict_batch_packed", bundle, bitmasks[nonempty], preds, probas, started)
+    timer.mark("build_response")
+    body, headers = http_cache.compress(out.tobytes(), http_request.headers.get("accept-encoding"))
+    timer.mark("encode")
+    timer.finish()
+    return Response(content=body, media_type="application/octet-stream", headers=headers)
+
+@app.post("/predict/toggles", response_model=TogglePredictionResponse)
+async def predict_endometriosis_toggles(request: SymptomsRequest, http_request: Request):
+    """Score the current symptoms and every set that adds or removes exactly one symptom"""
+    started = time.perf_counter()
+    timer = metrics.request_timer(http_request.scope, "predict_toggles")
+    bundle = serving_bundle(http_request)
+    try:
+        bitmask, current, toggles = score_toggles(bundle, request, timer)
     except Exception as e:
-        logger.error(f"Prediction error: {str(e)}")
+        metrics.registry.count_error("predict_toggles")
+        logger.error(f"Toggle prediction error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+    audit_response("predict_toggles", bundle, bitmask, current, started)
+    timer.mark("build_response")
+    timer.finish()
+    return TogglePredictionResponse(current=current, toggles=toggles)
+
+@app.post("/predict/explain", response_model=ExplanationResponse)
+async def explain_prediction(request: SymptomsRequest, http_request: Request, ranking: bool = False):
+    """What-if deltas for every feature, plus an optional leave-one-out ranking of the selected symptoms"""
+    started = time.perf_counter()
+    timer = metrics.request_timer(http_request.scope, "predict_explain")
+    bundle = serving_bundle(http_request)
+    try:
+        bitmask, current, toggles = score_toggles(bundle, request, timer)
+    except Exception as e:
+        metrics.registry.count_error("predict_explain")
+        logger.error(f"Explanation error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+    audit_response("predict_explain", bundle, bitmask, current, started)
+
+    contributions = None
+    if ranking:
+        # Removing a symptom moves the score by delta, so it contributed -delta
+        contributions = sorted(
+            (SymptomContribution(symptom=t.symptom, feature=t.feature, contribution=-t.delta)
+             for t in toggles if t.selected),
+            key=lambda c: c.contribution,
+            reverse=True
+        )
+    timer.mark("build_response")
+    timer.finish()
+    return ExplanationResponse(current=current, toggles=toggles, ranking=contributions)
+
+class RequestBodyStreamingResponse(StreamingResponse):
+    """StreamingResponse that doesn't listen for disconnects while streaming.
+
+    Starlette's version reads ``receive`` concurrently to spot disconnects,
+    which would swallow request body chunks the generator is still reading.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+@app.post("/predict/stream")
+async def predict_endometriosis_stream(http_request: Request, chunk_size: int = bulk.DEFAULT_CHUNK_SIZE):
+    """Score an NDJSON or CSV body (by Content-Type) and stream NDJSON results back per chunk"""
+    fmt = "csv" if "csv" in http_request.headers.get("content-type", "") else "ndjson"
+    chunk_size = max(1, min(chunk_size, MAX_BATCH_SIZE))
+    bundle = serving_bundle(http_request)
+
+    def score_matrix(feature_matrix):
+        started = time.perf_counter()
+        preds, probas = bundle.score_matrix(feature_matrix)
+        audit_rows("predict_stream", bundle, feature_bitmasks(feature_matrix), preds, probas, started)
+        return preds, probas
+
+    def score_lines(lines, chunk):
+        return bulk.score_chunk(lines.parse(chunk), bundle.features, score_matrix)
+
+    lines = bulk.LineChunkStream(fmt, chunk_size)
+    body = http_request.stream()
+    pending = []
+    if fmt == "csv":
+        # Read up to the header before the 200 goes out, so an unusable one is a 400 as on /predict/cohort
+        try:
+            async for data in body:
+                pending.extend(lines.feed(data))
+                if lines.header is not None:
+                    break
+            else:
+                pending.extend(lines.close())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def generate():
+        try:
+            for chunk in pending:
+                yield await run_in_threadpool(score_lines, lines, chunk)
+            async for data in body:
+                for chunk in lines.feed(data):
+                    yield await run_in_threadpool(score_lines, lines, chunk)
+            for chunk in lines.close():
+                yield await run_in_threadpool(score_lines, lines, chunk)
+        except Exception as e:
+            metrics.registry.count_error("predict_stream")
+            logger.error(f"Stream prediction error: {str(e)}")
+            yield (json.dumps({"error": f"Prediction error: {str(e)}"}) + "\n").encode()
+
+    return RequestBodyStreamingResponse(bulk.spooled(generate()), media_type="application/x-ndjson")
+
+@app.post("/predict/cohort")
+async def predict_cohort_aggregates(http_request: Request, chunk_size: int = bulk.DEFAULT_CHUNK_SIZE,
+                                    bins: int = cohort.DEFAULT_BINS, top: int = cohort.DEFAULT_TOP):
+    """Risk distribution, probability histogram, symptom prevalence and top combinations of an NDJSON or CSV cohort"""
+    fmt = "csv" if "csv" in http_request.headers.get("content-type", "") else "ndjson"
+    chunk_size = max(1, min(chunk_size, MAX_BATCH_SIZE))
+    bundle = serving_bundle(http_request)
+    try:
+        aggregator = cohort.CohortAggregator(bundle.features, bins=min(bins, 1000), top=min(top, 1000))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def aggregate(lines, chunk):
+        started = time.perf_counter()
+        scored = aggregator.add_records(lines.parse(chunk), bundle.score_matrix)
+        if scored is not None:
+            audit_rows("predict_cohort", bundle, *scored, started)
+
+    lines = bulk.LineChunkStream(fmt, chunk_size)
+    try:
+        async for data in http_request.stream():
+            for chunk in lines.feed(data):
+                await run_in_threadpool(aggregate, lines, chunk)
+        for chunk in lines.close():
+            await run_in_threadpool(aggregate, lines, chunk)
+    except ValueError as e:
+        # An unusable CSV header
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        metrics.registry.count_error("predict_cohort")
+        logger.error(f"Cohort aggregation error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+    return aggregator.report()
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="Run the EndoDx prediction API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("ENDODX_WORKERS", "1")),
+                        help="number of pre-forked worker processes sharing the loaded model")
+    parser.add_argument("--max-requests", type=int, default=None,
+                        help="recycle a worker after it has served this many requests")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        prefork.serve(app, host=args.host, port=args.port, workers=args.workers,
+                      max_requests=args.max_requests)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port, limit_max_requests=args.max_requests)
\ No newline at end of file
@@ -1,9 +1,23 @@
+import time
+_rerun_started = time.perf_counter()
+
 import streamlit as st
-import requests
 from theme import apply_custom_theme
-from utils.helpers import get_educational_resources
+from utils.client import PredictionServiceError, predictor_from_env
+from utils.helpers import SYMPTOM_GROUPS, get_educational_resources
 from PIL import Image
+from collections import deque
+import io
 import os
+import threading
+
+# ENDODX_APP_DEBUG=1 shows how long the server spent rendering each rerun
+DEBUG = os.getenv("ENDODX_APP_DEBUG", "0") == "1"
+
+# Live preview: default state of the toggle, and how long to wait for further clicks before scoring
+LIVE_PREVIEW_DEFAULT = os.getenv("ENDODX_LIVE_PREVIEW", "0") == "1"
+PREVIEW_DEBOUNCE_SECONDS = float(os.getenv("ENDODX_PREVIEW_DEBOUNCE_MS", "150")) / 1000
+PREVIEW_CACHE_SIZE = 256
 
 # Apply custom theme
 apply_custom_theme()
@@ -12,6 +26,57 @@ apply_custom_theme()
 if 'selected_symptoms' not in st.session_state:
     st.session_state.selected_symptoms = []
 
+# One predictor per server process, shared by all sessions and reruns (pooled HTTP or in-process)
+@st.cache_resource
+def get_predictor():
+    return predictor_from_env()
+
+# Decoded and resized to display size once per process instead of on every rerun
+@st.cache_resource
+def load_header_image(path: str, width: int) -> bytes:
+    image = Image.open(path)
+    image.thumbnail((width, width))
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+class RenderTimes:
+    """Rerun render times across all sessions, kept for the debug readout"""
+
+    def __init__(self, maxlen: int = 1000):
+        self.samples = deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+            ordered = sorted(self.samples)
+        return len(ordered), ordered[len(ordered) // 2], ordered[int(0.95 * (len(ordered) - 1))]
+
+@st.cache_resource
+def get_render_times() -> RenderTimes:
+    return RenderTimes()
+
+def fetch_preview(symptoms, status_slot):
+    """Current risk and every single-toggle risk for this set, memoized per session.
+
+    Streamlit stops a script run at its next element update once a newer
+    click is queued. The update after the debounce sleep therefore drops runs
+    superseded by rapid toggles before they call the API. A result that
+    arrives after a newer click is never shown, because the render that
+    follows it is abandoned too.
+    """
+    key = frozenset(symptoms)
+    cache = st.session_state.setdefault("preview_cache", {})
+    if key not in cache:
+        time.sleep(PREVIEW_DEBOUNCE_SECONDS)
+        status_slot.caption("Updating risk preview...")
+        result = get_predictor().toggles(list(symptoms))
+        if len(cache) >= PREVIEW_CACHE_SIZE:
+            cache.clear()
+        cache[key] = result
+    return cache[key]
+
 # Styled separator helper
 def add_separator():
     st.markdown("<div class='custom-separator'></div>", unsafe_allow_html=True)
@@ -28,8 +93,7 @@ with col2:
     try:
         image_path = "assets/united1.jpg"
         if os.path.exists(image_path):
-            image = Image.open(image_path)
-            st.image(image, width=200)
+            st.image(load_header_image(image_path, 200), width=200)
         else:
             st.warning("Image not found at: " + image_path)
     except Exception as e:
@@ -53,41 +117,6 @@ causing pain, infertility, and other symptoms. It affects approximately 1 in 10
 If you're experiencing these symptoms, it's important to consult with a healthcare provider for proper diagnosis and treatment.
 """)
 add_separator()
-# Define the symptoms grouped by severity
-symptom_groups = {
-    "Common symptoms you may notice but often consider low impact": [
-        "Headaches",
-        "Nausea",
-        "Loss of appetite",
-        "Malaise/sickness",
-        "Decreased energy/exhaustion",
-        "Chronic fatigue"
-    ],
-    "Noticeable symptoms that are worth paying attention to": [
-        "Menstrual pain (Dysmenorrhea)",
-        "Painful period cramps",
-        "Painful ovulation",
-        "Chronic pain",
-        "Pelvic (or related) Pains",
-        "IBS-like symptoms",
-        "Abdominal cramps during intercourse",
-        "Cysts (unspecified)",
-        "Fever",
-        "Bowel pain"
-    ],
-    "Symptoms that are more serious and shouldn't be ignored": [
-        "Painful bowel movements",
-        "Infertility",
-        "Fertility issues",
-        "Severe pain",
-        "Ovarian cysts",
-        "Painful urination",
-        "Bleeding",
-        "Abnormal uterine bleeding",
-        "Irregular or missed periods"
-    ]
-}
-
 st.subheader("Select symptoms you're experiencing:")
 
 # Disclaimer
@@ -101,81 +130,102 @@ questions you may have regarding a medical condition.
 </div>
 """, unsafe_allow_html=True)
 
+live_preview = st.toggle("Live risk preview", value=LIVE_PREVIEW_DEFAULT,
+                         help="Update the risk estimate as you tick symptoms, and show how each one changes it")
+preview_slot = st.empty()
+delta_slots = {}
+
 # Display symptoms with clickable buttons
-for group_name, symptoms in symptom_groups.items():
+for group_name, symptoms in SYMPTOM_GROUPS.items():
     st.markdown(f'<div class="symptom-group"><h3 class="header">{group_name}</h3>', unsafe_allow_html=True)
 
     cols = st.columns(2)
     for i, symptom in enumerate(symptoms):
         col_idx = i % 2
         with cols[col_idx]:
-            checked = symptom in st.session_state.selected_symptoms
-            if st.checkbox(symptom, value=checked, key=symptom):
-                if not checked:
-                    st.session_state.selected_symptoms.append(symptom)
-            else:
-                if checked:
-                    st.session_state.selected_symptoms.remove(symptom)
+            # The widget key holds the state; passing value= as well would change the
+            # widget's identity after each toggle and drop the next click
+            st.checkbox(symptom, key=symptom)
+            if live_preview:
+                delta_slots[symptom] = st.empty()
 
     st.markdown('</div>', unsafe_allow_html=True)
 
+st.session_state.selected_symptoms = [
+    symptom for symptoms in SYMPTOM_GROUPS.values() for symptom in symptoms if st.session_state.get(symptom)
+]
+
+if live_preview:
+    try:
+        preview = fetch_preview(st.session_state.selected_symptoms, preview_slot)
+        current = preview["current"]
+        with preview_slot.container():
+            if current["risk_level"] == "unknown":
+                st.caption("Tick symptoms to see a live risk estimate.")
+            else:
+                st.progress(min(max(current["probability"], 0.0), 1.0))
+                st.caption(f"Live risk estimate: {current['probability']:.1%} ({current['risk_level']})")
+        for toggle in preview["toggles"]:
+            slot = delta_slots.get(toggle["symptom"])
+            if slot is not None:
+                action = "Removing" if toggle["selected"] else "Adding"
+                slot.caption(f"{action} this changes risk by {toggle['delta']:+.1%}")
+    except PredictionServiceError as e:
+        preview_slot.warning(str(e))
+
 add_separator()
 
-# The button now just triggers the API call based on the updated session state
+# The button now just triggers the prediction based on the updated session state
 if st.button("Assess Endometriosis Risk", type="primary"):
     if not st.session_state.selected_symptoms:
         st.warning("Please select at least one symptom to assess your risk.")
     else:
         with st.spinner("Analyzing your symptoms..."):
             try:
-                api_url = "http://localhost:8000/predict"
-                payload = {"symptoms": st.session_state.selected_symptoms}
-                response = requests.post(api_url, json=payload)
-
-                if response.status_code == 200:
-                    result = response.json()
-                    st.subheader("Assessment Results")
-
-                    risk_level = result.get("risk_level", "unknown")
-                    probability = result.get("probability", 0.0)
-                    message = result.get("message", "No message available.")
-                    resources = get_educational_resources(probability)
-
-                    if risk_level == "high":
-                        st.markdown(f'<div class="prediction-box">🔴 {message}</div>', unsafe_allow_html=True)
-                    elif risk_level == "moderate":
-                        st.markdown(f'<div class="prediction-box">🟡 {message}</div>', unsafe_allow_html=True)
-                    else:
-                        st.markdown(f'<div class="prediction-box">🟢 {message}</div>', unsafe_allow_html=True)
+                result = get_predictor().predict(st.session_state.selected_symptoms)
+                st.subheader("Assessment Results")
+
+                risk_level = result.get("risk_level", "unknown")
+                probability = result.get("probability", 0.0)
+                message = result.get("message", "No message available.")
+                resources = get_educational_resources(probability)
+
+                if risk_level == "high":
+                    st.markdown(f'<div class="prediction-box">🔴 {message}</div>', unsafe_allow_html=True)
+                elif risk_level == "moderate":
+                    st.markdown(f'<div class="prediction-box">🟡 {message}</div>', unsafe_allow_html=True)
+                else:
+                    st.markdown(f'<div class="prediction-box">🟢 {message}</div>', unsafe_allow_html=True)
 
-                    st.markdown("<div style='height: 20px;'></div>", unsafe_allow_html=True)
+                st.markdown("<div style='height: 20px;'></div>", unsafe_allow_html=True)
 
-                    st.progress(min(max(probability, 0.0), 1.0))
-                    st.caption(f"Risk probability: {probability:.1%}")
+                st.progress(min(max(probability, 0.0), 1.0))
+                st.caption(f"Risk probability: {probability:.1%}")
 
-                    st.markdown("<div style='height: 30px;'></div>", unsafe_allow_html=True)
+                st.markdown("<div style='height: 30px;'></div>", unsafe_allow_html=True)
 
-                    st.subheader("Recommended Next Steps")
-                    st.markdown(f"""
-                    <div class="recommendation-box">
-                        {resources["recommendation"]}
-                    </div>
-                    """, unsafe_allow_html=True)
+                st.subheader("Recommended Next Steps")
+                st.markdown(f"""
+                <div class="recommendation-box">
+                    {resources["recommendation"]}
+                </div>
+                """, unsafe_allow_html=True)
 
-                    st.subheader("Educational Resources")
-                    for link in resources["links"]:
-                        st.markdown(f"- [{link['name']}]({link['url']})")
+                st.subheader("Educational Resources")
+                for link in resources["links"]:
+                    st.markdown(f"- [{link['name']}]({link['url']})")
 
-                else:
-                    try:
-                        st.error(response.json().get("detail", "An error occurred."))
-                    except Exception:
-                        st.error(f"An error occurred. Raw response: {response.text}")
-            except requests.exceptions.ConnectionError:
-                st.error("Could not connect to the prediction service. Please ensure the API is running.")
+            except PredictionServiceError as e:
+                st.error(str(e))
             except Exception as e:
                 st.error(f"An unexpected error occurred: {str(e)}")
 
 # Footer
 add_separator()
-st.caption("EndoDx - This tool is for educational purposes only and does not provide medical diagnosis.")
\ No newline at end of file
+st.caption("EndoDx - This tool is for educational purposes only and does not provide medical diagnosis.")
+
+if DEBUG:
+    elapsed = time.perf_counter() - _rerun_started
+    count, median, p95 = get_render_times().record(elapsed)
+    st.caption(f"Rerun rendered in {elapsed * 1000:.1f} ms · median {median * 1000:.1f} ms, "
+               f"p95 {p95 * 1000:.1f} ms over the last {count} reruns (all sessions)")
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""Shared result format and baseline comparison for the benchmark scripts.
+
+Every run is written as JSON:
+
+    {"kind": "micro" | "load", "timestamp": ..., "git_commit": ..., "python": ...,
+     "results": [{"name": ..., "param": ..., <metrics>}, ...]}
+
+``param`` is the batch size (micro) or concurrency level (load). Rows are
+matched against a baseline run by (name, param) and each metric in
+``LOWER_IS_BETTER`` / ``HIGHER_IS_BETTER`` is flagged when it is worse by
+more than the threshold.
+"""
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from utils.helpers import symptom_mapping
+
+LOWER_IS_BETTER = ("per_row_us", "p50_ms", "p95_ms", "p99_ms", "peak_mb")
+HIGHER_IS_BETTER = ("rows_per_s", "throughput_rps")
+
+
+def synthetic_symptom_lists(n: int, seed: int = 0, prevalence: float = 0.3) -> List[List[str]]:
+    """Random non-empty symptom lists where each symptom is present with ``prevalence``"""
+    rng = random.Random(seed)
+    names = list(symptom_mapping)
+    rows = []
+    for _ in range(n):
+        row = [name for name in names if rng.random() < prevalence]
+        rows.append(row or [rng.choice(names)])
+    return rows
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(kind: str, results: List[Dict[str, Any]], path: str) -> Dict[str, Any]:
+    run = {
+        "kind": kind,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(run, f, indent=2)
+    return run
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.10) -> List[str]:
+    """Return a description of every metric that regressed by more than ``threshold``"""
+    base_rows = {(row["name"], row["param"]): row for row in baseline["results"]}
+    regressions = []
+    for row in current["results"]:
+        base = base_rows.get((row["name"], row["param"]))
+        if base is None:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            old, new = base.get(metric), row.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+            if worse:
+                regressions.append(f"{row['name']} [{row['param']}] {metric}: {old:.4g} -> {new:.4g} ({change:+.1%})")
+    return regressions
+
+
+def report_regressions(baseline_path: str, current: Dict[str, Any], threshold: float) -> int:
+    """Print the comparison against a baseline file and return a process exit code"""
+    regressions = compare_results(load_results(baseline_path), current, threshold)
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%} against {baseline_path}")
+        return 0
+    print(f"{len(regressions)} regression(s) beyond {threshold:.0%} against {baseline_path}:")
+    for line in regressions:
+        print(f"  {line}")
+    return 1
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare a benchmark run against a baseline")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+    sys.exit(report_regressions(args.baseline, load_results(args.current), args.threshold))
@@ -0,0 +1,187 @@
+"""Async HTTP load generator for a running prediction API.
+
+    python api.py &
+    python -m benchmarks.load --concurrency 1 8 32 128 --duration 10
+    python -m benchmarks.load --payloads cohort.jsonl --baseline benchmarks/results/load.json
+
+Each concurrency level runs that many keep-alive connections in a closed
+loop for ``--duration`` seconds and reports throughput and p50/p95/p99
+latency. Requests refused with 429/503 are counted as shed rather than
+errors, and the client backs off for the ``Retry-After`` the server asked
+for, as a well-behaved caller would. Payloads are replayed from an NDJSON file with one
+``{"symptoms": [...]}`` object per line, or generated synthetically. The
+client speaks HTTP/1.1 directly over asyncio streams, so it needs no extra
+dependencies and adds little overhead of its own.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from benchmarks.common import report_regressions, synthetic_symptom_lists, write_results
+
+
+def load_payloads(path: Optional[str], n_synthetic: int, seed: int = 0) -> List[bytes]:
+    if path is None:
+        return [json.dumps({"symptoms": row}).encode() for row in synthetic_symptom_lists(n_synthetic, seed)]
+    payloads = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                payloads.append(json.dumps({"symptoms": record["symptoms"]}).encode())
+    return payloads
+
+
+class Connection:
+    """Minimal keep-alive HTTP/1.1 client for Content-Length responses"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.retry_after = 0.0
+
+    async def request(self, method: str, path: str, body: bytes) -> Tuple[int, bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n")
+        self.writer.write(head.encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            await self.close()
+            raise ConnectionError("Server closed the connection")
+        status = int(status_line.split()[1])
+        length, keep_alive = 0, True
+        self.retry_after = 0.0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "retry-after":
+                self.retry_after = float(value)
+            elif name == "connection" and value.strip().lower() == "close":
+                keep_alive = False
+        payload = await self.reader.readexactly(length)
+        if not keep_alive:
+            await self.close()
+        return status, payload
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        self.reader = self.writer = None
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def run_level(url: str, payloads: List[bytes], concurrency: int, duration: float,
+                    warmup: float) -> Dict[str, float]:
+    parts = urlsplit(url)
+    host, port, path = parts.hostname, parts.port or 80, parts.path or "/predict"
+    latencies: List[float] = []
+    errors = shed = 0
+    recording = False
+    deadline = time.perf_counter() + warmup + duration
+
+    async def client(worker: int) -> None:
+        nonlocal errors, shed
+        rng = random.Random(worker)
+        connection = Connection(host, port)
+        try:
+            while time.perf_counter() < deadline:
+                body = payloads[rng.randrange(len(payloads))]
+                started = time.perf_counter()
+                try:
+                    status, _ = await connection.request("POST", path, body)
+                except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                    status = 0
+                    await connection.close()
+                elapsed = time.perf_counter() - started
+                if recording:
+                    if status == 200:
+                        latencies.append(elapsed)
+                    elif status in (429, 503):
+                        shed += 1
+                    else:
+                        errors += 1
+                if status in (429, 503) and connection.retry_after:
+                    await asyncio.sleep(min(connection.retry_after, max(0.0, deadline - time.perf_counter())))
+        finally:
+            await connection.close()
+
+    tasks = [asyncio.create_task(client(i)) for i in range(concurrency)]
+    await asyncio.sleep(warmup)
+    recording = True
+    measured_from = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - measured_from
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "shed": shed,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": 1000 * _percentile(latencies, 0.50),
+        "p95_ms": 1000 * _percentile(latencies, 0.95),
+        "p99_ms": 1000 * _percentile(latencies, 0.99),
+        "max_ms": 1000 * (latencies[-1] if latencies else 0.0),
+    }
+
+
+async def run(url: str, payloads: List[bytes], levels: List[int], duration: float,
+              warmup: float) -> List[Dict[str, object]]:
+    results = []
+    for concurrency in levels:
+        stats = await run_level(url, payloads, concurrency, duration, warmup)
+        results.append({"name": urlsplit(url).path or "/predict", "param": concurrency, **stats})
+        print(f"concurrency={concurrency:<5} {stats['throughput_rps']:>10,.0f} req/s  "
+              f"p50={stats['p50_ms']:.2f}ms p95={stats['p95_ms']:.2f}ms p99={stats['p99_ms']:.2f}ms "
+              f"errors={stats['errors']} shed={stats['shed']}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test a running EndoDx API")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/predict")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per level")
+    parser.add_argument("--warmup", type=float, default=1.0, help="unmeasured seconds before each level")
+    parser.add_argument("--payloads", help="NDJSON file of recorded {\"symptoms\": [...]} requests")
+    parser.add_argument("--synthetic", type=int, default=10000, help="number of synthetic payloads")
+    parser.add_argument("--output", default=f"benchmarks/results/load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    parser.add_argument("--baseline", help="earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.payloads, args.synthetic)
+    results = asyncio.run(run(args.url, payloads, args.concurrency, args.duration, args.warmup))
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    run_data = write_results("load", results, args.output)
+    print(f"Wrote {args.output}")
+    if args.baseline:
+        sys.exit(report_regressions(args.baseline, run_data, args.threshold))
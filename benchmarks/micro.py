@@ -0,0 +1,115 @@
+"""Micro-benchmarks of the scoring pipeline stages at increasing batch sizes.
+
+    python -m benchmarks.micro --output benchmarks/results/micro.json
+    python -m benchmarks.micro --baseline benchmarks/results/micro.json
+
+Each case reports the median wall time per call, per-row cost, rows per
+second and the peak traced allocation (numpy allocations included) for one
+call. Per-row cases such as ``map_symptoms_to_vector`` are looped over the
+batch, which is what serving a batch through /predict costs today.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.common import report_regressions, synthetic_symptom_lists, write_results
+from utils.compiled_model import compile_model_artifacts
+from utils.helpers import (
+    load_model_artifacts, map_symptom_lists_to_matrix, map_symptoms_to_vector, symptoms_to_indices
+)
+from utils.vectorizer import score_chunks, vectorizer_for
+
+DEFAULT_BATCH_SIZES = (1, 10, 100, 1000, 10000, 100000)
+
+# Cases that loop in Python per row are skipped above this size to keep runs short
+MAX_LOOPED_ROWS = 10000
+
+
+def _measure(fn: Callable[[], object], min_seconds: float) -> Dict[str, float]:
+    fn()  # warm-up
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < 3 or time.perf_counter() - started < min_seconds:
+        t = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": statistics.median(timings), "peak_mb": peak / 2**20}
+
+
+def build_cases(n: int, model, scaler, features, compiled):
+    """Return (name, callable, looped) for every stage at batch size n"""
+    rows = synthetic_symptom_lists(n, seed=n)
+    matrix = map_symptom_lists_to_matrix(rows, features)
+    scaled = scaler.transform(matrix)
+    vectorizer = vectorizer_for(features)
+    masks = vectorizer.to_bitmasks(rows)
+
+    return [
+        ("map_symptoms_to_vector", lambda: [map_symptoms_to_vector(r, features) for r in rows], True),
+        ("map_symptom_lists_to_matrix", lambda: map_symptom_lists_to_matrix(rows, features), False),
+        ("vectorizer.to_dense", lambda: vectorizer.to_dense(rows), False),
+        ("vectorizer.to_bitmasks", lambda: vectorizer.to_bitmasks(rows), False),
+        ("vectorizer.to_csr", lambda: vectorizer.to_csr(rows), False),
+        ("scaler.transform", lambda: scaler.transform(matrix), False),
+        ("model.predict", lambda: model.predict(scaled), False),
+        ("model.predict_proba", lambda: model.predict_proba(scaled), False),
+        ("sklearn_pipeline", lambda: (model.predict(scaler.transform(matrix)),
+                                      model.predict_proba(scaler.transform(matrix))), False),
+        ("compiled.predict_matrix", lambda: compiled.predict_matrix(matrix), False),
+        ("compiled.predict_chunked_bitmasks",
+         lambda: score_chunks(compiled.predict_matrix, vectorizer.iter_dense(masks)), False),
+        ("compiled.predict_indices", lambda: [compiled.predict_indices(symptoms_to_indices(r, compiled.feature_index))
+                                              for r in rows], True),
+    ]
+
+
+def run(batch_sizes: List[int], min_seconds: float, cases: Optional[List[str]] = None) -> List[Dict[str, object]]:
+    model, scaler, features = load_model_artifacts()
+    compiled = compile_model_artifacts(model, scaler, features)
+    results = []
+    for n in batch_sizes:
+        for name, fn, looped in build_cases(n, model, scaler, features, compiled):
+            if looped and n > MAX_LOOPED_ROWS or cases and not any(c in name for c in cases):
+                continue
+            measured = _measure(fn, min_seconds)
+            seconds = measured["seconds"]
+            row = {
+                "name": name,
+                "param": n,
+                "seconds": seconds,
+                "per_row_us": seconds / n * 1e6,
+                "rows_per_s": n / seconds,
+                "peak_mb": measured["peak_mb"],
+            }
+            results.append(row)
+            print(f"{name:<30} n={n:<7} {row['per_row_us']:>10.3f} us/row "
+                  f"{row['rows_per_s']:>14,.0f} rows/s {row['peak_mb']:>9.2f} MB peak")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark the scoring stages")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=list(DEFAULT_BATCH_SIZES))
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds to spend timing each case")
+    parser.add_argument("--output", default=f"benchmarks/results/micro-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    parser.add_argument("--cases", nargs="+", help="only run cases whose name contains one of these")
+    parser.add_argument("--baseline", help="earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    run_data = write_results("micro", run(args.batch_sizes, args.min_time, args.cases), args.output)
+    print(f"Wrote {args.output}")
+    if args.baseline:
+        sys.exit(report_regressions(args.baseline, run_data, args.threshold))
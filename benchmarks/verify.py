@@ -0,0 +1,186 @@
+"""Correctness checks for the fast serving paths, run on synthetic models.
+
+    python -m benchmarks.verify
+    python -m benchmarks.verify --checks compile registry
+
+The benchmarks time these paths but don't check what they return:
+
+- ``compile``: fits a binary SVC for every kernel the compiler supports, with
+  and without ``probability``, and compiles it with ``compile_model_artifacts``,
+  which raises unless the evaluator reproduces sklearn. Models the compiler
+  can't handle must be refused with ``ValueError``.
+- ``registry``: builds a model directory with a base and two version
+  directories, then checks discovery, swapping, rollback and the ``ACTIVE``
+  pin, and that a broken version is skipped while the active one keeps serving.
+- ``admission``: fills an ``AdmissionController`` and checks that it admits,
+  queues and sheds (queue full, queue timeout, cancelled waiter) as documented.
+
+Each check prints ``ok`` or the reason it failed; the exit status is 1 if any failed.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+from typing import Callable, Dict, Tuple
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from utils.admission import SHED_QUEUE_FULL, SHED_QUEUE_TIMEOUT, AdmissionController
+from utils.compiled_model import SUPPORTED_KERNELS, compile_model_artifacts
+from utils.helpers import artifact_paths, symptom_mapping
+from utils.model_registry import ACTIVE_FILE, VERSIONS_DIR, ModelRegistry
+
+FEATURES = list(symptom_mapping.values())
+
+
+def _synthetic_data(n_rows: int = 400, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Binary symptom vectors with a label driven by a few of them, plus noise"""
+    rng = np.random.default_rng(seed)
+    X = (rng.random((n_rows, len(FEATURES))) < 0.3).astype(float)
+    score = X[:, :5] @ np.array([1.5, 1.0, 1.0, 0.5, 0.5]) + rng.normal(0, 0.5, n_rows)
+    return X, (score > 1.2).astype(int)
+
+
+def _fit(model, seed: int = 0):
+    X, y = _synthetic_data(seed=seed)
+    scaler = StandardScaler().fit(X)
+    return model.fit(scaler.transform(X), y), scaler
+
+
+def check_compile() -> None:
+    for kernel in SUPPORTED_KERNELS:
+        for probability in (True, False):
+            model, scaler = _fit(SVC(kernel=kernel, probability=probability, random_state=0))
+            try:
+                compiled = compile_model_artifacts(model, scaler, FEATURES)
+            except ValueError as e:
+                raise AssertionError(f"{kernel} SVC (probability={probability}): {str(e)}")
+            if compiled.has_probability != probability:
+                raise AssertionError(f"{kernel} SVC (probability={probability}): "
+                                     f"compiled has_probability is {compiled.has_probability}")
+
+    model, scaler = _fit(RandomForestClassifier(n_estimators=10, random_state=0))
+    try:
+        compile_model_artifacts(model, scaler, FEATURES)
+    except ValueError:
+        return
+    raise AssertionError("a random forest was compiled instead of being refused")
+
+
+def _write_version(path: str, kernel: str, seed: int, mtime: float) -> None:
+    os.makedirs(path, exist_ok=True)
+    model, scaler = _fit(SVC(kernel=kernel, probability=True, random_state=0), seed=seed)
+    for artifact, obj in zip(artifact_paths(path), (model, scaler, FEATURES)):
+        joblib.dump(obj, artifact)
+        os.utime(artifact, (mtime, mtime))
+
+
+def check_registry() -> None:
+    with tempfile.TemporaryDirectory() as model_dir:
+        now = time.time()
+        _write_version(model_dir, "linear", seed=0, mtime=now - 300)
+        _write_version(os.path.join(model_dir, VERSIONS_DIR, "v1"), "rbf", seed=1, mtime=now - 200)
+        _write_version(os.path.join(model_dir, VERSIONS_DIR, "v2"), "poly", seed=2, mtime=now - 100)
+        registry = ModelRegistry(model_dir, poll_interval=0, use_prediction_table=False,
+                                 use_fast_model=False, warm_up_requests=10)
+
+        def expect(condition: bool, message: str) -> None:
+            if not condition:
+                raise AssertionError(f"{message} (status: {registry.status()})")
+
+        expect(set(registry.versions()) == {"base", "v1", "v2"}, "versions not discovered")
+        expect(registry.load_initial().version == "v2", "the newest version should be served first")
+        v2 = registry.active
+
+        registry.activate("v1")
+        expect(registry.active.version == "v1" and registry.history[0] is v2, "swap to v1 failed")
+        expect(registry.pinned_version() is None, "a plain swap should not pin")
+
+        registry.rollback()
+        expect(registry.active is v2, "rollback should reuse the loaded v2 bundle")
+        expect(registry.pinned_version() == "v2", f"rollback should pin v2 in {ACTIVE_FILE}")
+
+        registry.rollback("base")
+        expect(registry.active.version == "base" and registry.wanted_version() == "base", "rollback to base failed")
+        expect(registry.check() is None, "check() should keep the pinned version")
+
+        registry.unpin()
+        expect(registry.check() is v2, "unpinning should serve the newest version again")
+
+        broken = os.path.join(model_dir, VERSIONS_DIR, "v3")
+        _write_version(broken, "rbf", seed=3, mtime=now)
+        model_path = artifact_paths(broken)[0]
+        with open(model_path, "wb") as f:
+            f.write(b"not a pickle")
+        os.utime(model_path, (now, now))
+        expect(registry.check() is None and registry.active.version == "v2", "a broken version was swapped in")
+        expect(registry.last_error is not None and registry.last_error.startswith("v3"), "load error not recorded")
+
+        preds, probas = registry.active.score_matrix(np.eye(len(FEATURES)))
+        expect(len(preds) == len(FEATURES) and 0 <= probas.min() <= probas.max() <= 1, "active bundle scores badly")
+
+
+async def _check_admission() -> None:
+    controller = AdmissionController(max_in_flight=2, max_queue=2, queue_timeout_ms=50)
+    assert await controller.acquire() is None and await controller.acquire() is None, "free slots refused"
+
+    first = asyncio.ensure_future(controller.acquire())
+    second = asyncio.ensure_future(controller.acquire())
+    await asyncio.sleep(0)
+    assert controller.queue_depth == 2, f"expected 2 queued, got {controller.queue_depth}"
+    assert await controller.acquire() == SHED_QUEUE_FULL, "a full queue should shed"
+
+    controller.release()
+    assert await first is None, "the oldest waiter should get the released slot"
+    assert await second == SHED_QUEUE_TIMEOUT, "a waiter past the timeout should shed"
+
+    cancelled = asyncio.ensure_future(controller.acquire())
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.gather(cancelled, return_exceptions=True)
+    assert controller.queue_depth == 0, "a cancelled waiter stayed queued"
+
+    controller.release()
+    controller.release()
+    assert controller.in_flight == 0, f"{controller.in_flight} slots leaked"
+    stats = controller.stats.snapshot()
+    assert stats["admitted"] == 3, f"expected 3 admitted, got {stats['admitted']}"
+    assert stats["shed"] == {SHED_QUEUE_FULL: 1, SHED_QUEUE_TIMEOUT: 1}, f"unexpected shed counts {stats['shed']}"
+
+
+def check_admission() -> None:
+    asyncio.run(_check_admission())
+
+
+CHECKS: Dict[str, Callable[[], None]] = {
+    "compile": check_compile,
+    "registry": check_registry,
+    "admission": check_admission,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the compiled model, model registry and admission control")
+    parser.add_argument("--checks", nargs="+", choices=sorted(CHECKS), default=list(CHECKS))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+    failed = 0
+    for name in args.checks:
+        started = time.perf_counter()
+        try:
+            CHECKS[name]()
+            print(f"{name}: ok ({time.perf_counter() - started:.1f}s)")
+        except AssertionError as e:
+            failed += 1
+            print(f"{name}: FAIL: {str(e)}")
+    sys.exit(1 if failed else 0)
@@ -1,8 +1,8 @@
+import re
 import streamlit as st
 
 # Custom theme for Streamlit app with salmon pink colors
-def apply_custom_theme():
-    st.markdown("""
+CUSTOM_CSS = """
     <style>
     /* Target the main app container */
     .stApp {
@@ -261,4 +261,14 @@ def apply_custom_theme():
 
 
     </style>
-    """, unsafe_allow_html=True)
\ No newline at end of file
+    """
+
+@st.cache_resource
+def minified_css() -> str:
+    """Strip comments and redundant whitespace once, shrinking the block re-sent on every rerun"""
+    css = re.sub(r"/\*.*?\*/", "", CUSTOM_CSS, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};,>])\s*", r"\1", css).strip()
+
+def apply_custom_theme():
+    st.markdown(minified_css(), unsafe_allow_html=True)
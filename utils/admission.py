@@ -0,0 +1,233 @@
+"""Admission control and load shedding for the prediction endpoints.
+
+At most ``max_in_flight`` prediction requests run at once. Requests that
+arrive while every slot is busy wait in a FIFO queue for up to
+``queue_timeout_ms``. If the queue already holds ``max_queue`` requests, or
+the wait times out, the request gets an immediate 503 with ``Retry-After``
+instead of adding to everyone's latency. Optionally, each client has a token
+bucket of ``rate`` requests per second with bursts up to ``burst``; a client
+that runs out gets 429 with ``Retry-After`` set to when its next token is due.
+
+Only paths starting with one of ``paths`` (default ``/predict``) are
+controlled, so health checks, metrics and admin calls still get through when
+the service is shedding load. Limits are per process; in pre-fork mode each
+worker enforces its own.
+"""
+import asyncio
+import json
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence
+
+from utils.metrics import Histogram
+
+SHED_QUEUE_FULL = "queue_full"
+SHED_QUEUE_TIMEOUT = "queue_timeout"
+SHED_RATE_LIMITED = "rate_limited"
+
+QUEUE_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class AdmissionStats:
+    """Running totals of admitted and shed requests and time spent queued"""
+
+    def __init__(self):
+        self.admitted = 0
+        self.queued = 0
+        self.shed: Dict[str, int] = {SHED_QUEUE_FULL: 0, SHED_QUEUE_TIMEOUT: 0}
+        self.queue_wait = Histogram(QUEUE_WAIT_BUCKETS)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": dict(self.shed),
+            "shed_total": sum(self.shed.values()),
+            "mean_queue_wait_ms": 1000 * self.queue_wait.sum / self.queue_wait.count if self.queue_wait.count else 0.0,
+            "p99_queue_wait_ms": 1000 * self.queue_wait.quantile(0.99),
+        }
+
+
+class TokenBuckets:
+    """Per-client token buckets, keeping at most ``max_clients`` (least recently seen are dropped)"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.rejected = 0
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def take(self, client: str, now: Optional[float] = None) -> float:
+        """Spend one token; returns 0 if allowed, otherwise seconds until a token is available"""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = [self.burst, now]
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return 0.0
+        self.rejected += 1
+        return (1.0 - bucket[0]) / self.rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class AdmissionController:
+    """Concurrency limit with a bounded, time-limited wait queue"""
+
+    def __init__(self, max_in_flight: int, max_queue: int = 100, queue_timeout_ms: float = 1000.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout_ms / 1000
+        self.in_flight = 0
+        self.stats = AdmissionStats()
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> Optional[str]:
+        """Take a slot, waiting in the queue if needed; returns the shed reason if refused"""
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self.stats.admitted += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            self.stats.shed[SHED_QUEUE_FULL] += 1
+            return SHED_QUEUE_FULL
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats.queued += 1
+        enqueued = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # release() may have handed this waiter a slot just as the wait timed out
+            if not _granted(waiter):
+                self._discard(waiter)
+                self.stats.shed[SHED_QUEUE_TIMEOUT] += 1
+                return SHED_QUEUE_TIMEOUT
+        except BaseException:
+            # The client went away while queued
+            if _granted(waiter):
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+        self.stats.queue_wait.observe(time.perf_counter() - enqueued)
+        self.stats.admitted += 1
+        return None
+
+    def _discard(self, waiter: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self) -> None:
+        """Free a slot, handing it straight to the oldest waiter that is still waiting"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+def _granted(waiter: asyncio.Future) -> bool:
+    return waiter.done() and not waiter.cancelled()
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware applying the concurrency limit and per-client rate limit"""
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None,
+                 rate_limiter: Optional[TokenBuckets] = None, paths: Sequence[str] = ("/predict",),
+                 client_header: Optional[str] = None, retry_after: int = 1):
+        self.app = app
+        self.controller = controller
+        self.rate_limiter = rate_limiter
+        self.paths = tuple(paths)
+        self.client_header = client_header.lower().encode("latin-1") if client_header else None
+        self.retry_after = retry_after
+
+    def client_key(self, scope) -> str:
+        if self.client_header is not None:
+            for name, value in scope.get("headers", ()):
+                if name == self.client_header:
+                    # With X-Forwarded-For the first entry is the original client
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            return await self.app(scope, receive, send)
+
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.take(self.client_key(scope))
+            if wait > 0:
+                return await _reject(send, 429, "Rate limit exceeded. Please slow down.", math.ceil(wait))
+
+        if self.controller is None:
+            return await self.app(scope, receive, send)
+
+        reason = await self.controller.acquire()
+        if reason is not None:
+            return await _reject(send, 503, "The prediction service is overloaded. Please retry shortly.",
+                                 self.retry_after)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
+
+
+async def _reject(send, status: int, detail: str, retry_after: int) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, retry_after)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def render_metrics(controller: Optional[AdmissionController], rate_limiter: Optional[TokenBuckets]) -> Iterable[str]:
+    """Prometheus lines for the admission counters"""
+    shed = dict(controller.stats.shed) if controller is not None else {}
+    if rate_limiter is not None:
+        shed[SHED_RATE_LIMITED] = rate_limiter.rejected
+    yield "# HELP endodx_admission_shed_total Prediction requests refused, by reason"
+    yield "# TYPE endodx_admission_shed_total counter"
+    for reason, count in sorted(shed.items()):
+        yield f'endodx_admission_shed_total{{reason="{reason}"}} {count}'
+    if rate_limiter is not None:
+        yield "# TYPE endodx_admission_rate_limit_clients gauge"
+        yield f"endodx_admission_rate_limit_clients {len(rate_limiter)}"
+    if controller is None:
+        return
+    yield "# HELP endodx_admission_admitted_total Prediction requests admitted"
+    yield "# TYPE endodx_admission_admitted_total counter"
+    yield f"endodx_admission_admitted_total {controller.stats.admitted}"
+    yield "# TYPE endodx_admission_in_flight gauge"
+    yield f"endodx_admission_in_flight {controller.in_flight}"
+    yield "# TYPE endodx_admission_queue_depth gauge"
+    yield f"endodx_admission_queue_depth {controller.queue_depth}"
+    yield "# HELP endodx_admission_queue_wait_seconds Time admitted requests spent queued"
+    yield "# TYPE endodx_admission_queue_wait_seconds histogram"
+    yield from controller.stats.queue_wait.render("endodx_admission_queue_wait_seconds")
@@ -0,0 +1,254 @@
+"""Non-blocking audit log of every scoring.
+
+The request path only appends a tuple to an in-memory queue. A background
+thread drains the queue every ``flush_interval`` seconds, or as soon as
+``batch_size`` rows are pending. It formats the rows as JSON lines and appends them
+to the current file in ``directory``. Files are named
+``audit-<start time>-<pid>-<n>.jsonl`` (``.jsonl.gz`` when compressed) and
+rotate after ``rotate_bytes``. Compressed batches are written as separate
+gzip members, so a file stays readable with ``zcat`` even if the process
+dies mid-file. Each pre-fork worker writes its own files.
+
+One line per scored row:
+
+    {"ts": 1760000000.123, "ep": "predict", "v": "base", "mask": 37, "pred": 1, "p": 0.5401,
+     "risk": "moderate", "ms": 0.21}
+
+``mask`` is the feature bitmask in the order of that model version's
+``svm_features.pkl``, and ``ms`` is the handler latency (the whole request's,
+for batch rows).
+
+The queue holds at most ``max_queue`` rows. When it is full, the ``drop``
+policy discards new rows and counts them. The ``block`` policy makes the
+caller wait up to ``block_timeout`` seconds for the writer to catch up, and
+drops only after that. Blocking stalls the worker's event loop, so it trades
+latency for completeness.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+import numpy as np
+
+from utils.helpers import risk_level_for
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("drop", "block")
+
+_SINGLE = 0
+_MANY = 1
+
+
+class AuditLog:
+    def __init__(self, directory: str, max_queue: int = 100000, batch_size: int = 1000,
+                 flush_interval: float = 1.0, rotate_bytes: int = 64 << 20, compress: bool = True,
+                 policy: str = "drop", block_timeout: float = 1.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Audit policy must be one of {POLICIES}, not {policy!r}")
+        self.directory = directory
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.compress = compress
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.batches = 0
+        self.files = 0
+        self.write_errors = 0
+        self.current_file: Optional[str] = None
+
+        self._queue: Deque[tuple] = deque()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._drained = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._file_bytes = 0
+        # JSON-encoded endpoint and version strings, reused across rows
+        self._encoded: Dict[str, str] = {}
+
+    # Request path
+
+    def record(self, endpoint: str, version: str, bitmask: int, prediction: int, probability: float,
+               risk_level: str, latency: float) -> bool:
+        """Queue one scored request; returns False if it was dropped"""
+        return self._put((_SINGLE, time.time(), endpoint, version, bitmask, prediction, probability, risk_level,
+                          latency), 1)
+
+    def record_many(self, endpoint: str, version: str, bitmasks: np.ndarray, predictions: np.ndarray,
+                    probabilities: np.ndarray, latency: float) -> bool:
+        """Queue a scored batch as one entry; rows are expanded on the writer thread"""
+        n = len(bitmasks)
+        if not n:
+            return True
+        return self._put((_MANY, time.time(), endpoint, version, np.asarray(bitmasks), np.asarray(predictions),
+                          np.asarray(probabilities), None, latency), n)
+
+    def _put(self, entry: tuple, rows: int) -> bool:
+        with self._lock:
+            fits = self._pending + rows <= self.max_queue
+            if fits:
+                self._queue.append(entry)
+                self._pending += rows
+                self.enqueued += rows
+                pending = self._pending
+        if fits:
+            if pending >= self.batch_size and not self._wake.is_set():
+                self._wake.set()
+            return True
+        if self.policy == "block" and self._wait_for_space(rows):
+            return self._put(entry, rows)
+        with self._lock:
+            self.dropped += rows
+        return False
+
+    def _wait_for_space(self, rows: int) -> bool:
+        deadline = time.monotonic() + self.block_timeout
+        with self._lock:
+            self.blocked += 1
+        while self._pending + rows > self.max_queue:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._thread is None:
+                return False
+            self._drained.clear()
+            self._wake.set()
+            self._drained.wait(min(remaining, 0.01))
+        return True
+
+    # Writer thread
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Stop the writer after flushing everything queued so far"""
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self._drain()
+        self._close_file()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._drain()
+
+    def _drain(self) -> None:
+        with self._lock:
+            entries, self._queue = self._queue, deque()
+        if not entries:
+            self._drained.set()
+            return
+        rows = sum(1 if entry[0] == _SINGLE else len(entry[4]) for entry in entries)
+        data = "".join(self._format(entry) for entry in entries).encode()
+        try:
+            self._write(data)
+            self.written += rows
+            self.batches += 1
+        except OSError as e:
+            self.write_errors += 1
+            self.dropped += rows
+            logger.error(f"Failed to write {rows} audit records: {str(e)}")
+            self._close_file()
+        with self._lock:
+            self._pending -= rows
+        self._drained.set()
+
+    def _json(self, value: str) -> str:
+        encoded = self._encoded.get(value)
+        if encoded is None:
+            encoded = self._encoded[value] = json.dumps(value)
+        return encoded
+
+    def _format(self, entry: tuple) -> str:
+        kind, ts, endpoint, version, bitmask, prediction, probability, risk_level, latency = entry
+        prefix = f'{{"ts":{ts:.3f},"ep":{self._json(endpoint)},"v":{self._json(version)},"mask":'
+        suffix = f',"ms":{latency * 1000:.3f}}}\n'
+        if kind == _SINGLE:
+            return (f'{prefix}{bitmask},"pred":{int(prediction)},"p":{float(probability):.6g},'
+                    f'"risk":"{risk_level}"{suffix}')
+        return "".join(
+            f'{prefix}{mask},"pred":{pred},"p":{proba:.6g},"risk":"{risk_level_for(proba)}"{suffix}'
+            for mask, pred, proba in zip(bitmask.tolist(), prediction.astype(int).tolist(), probability.tolist())
+        )
+
+    def _write(self, data: bytes) -> None:
+        if self.compress:
+            data = gzip.compress(data, compresslevel=6)
+        if self._file is None or self._file_bytes >= self.rotate_bytes:
+            self._open_file()
+        self._file.write(data)
+        self._file.flush()
+        self._file_bytes += len(data)
+
+    def _open_file(self) -> None:
+        self._close_file()
+        os.makedirs(self.directory, exist_ok=True)
+        self.files += 1
+        name = f"audit-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.files}.jsonl"
+        if self.compress:
+            name += ".gz"
+        self.current_file = os.path.join(self.directory, name)
+        self._file = open(self.current_file, "ab")
+        self._file_bytes = 0
+
+    def _close_file(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError as e:
+                logger.error(f"Failed to close audit file {self.current_file}: {str(e)}")
+            self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "policy": self.policy,
+            "max_queue": self.max_queue,
+            "queue_depth": self._pending,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "batches": self.batches,
+            "files": self.files,
+            "write_errors": self.write_errors,
+            "current_file": self.current_file,
+        }
+
+
+def feature_bitmasks(feature_matrix: np.ndarray) -> np.ndarray:
+    """Feature bitmasks of the rows of a binary feature matrix"""
+    return np.asarray(feature_matrix).astype(np.int64) @ (1 << np.arange(feature_matrix.shape[1], dtype=np.int64))
+
+
+def measure_overhead(audit_log: "AuditLog", iterations: int = 20000) -> float:
+    """Seconds per ``record`` call on the request path, measured against a scratch queue"""
+    scratch = AuditLog(audit_log.directory, max_queue=iterations, batch_size=iterations + 1)
+    started = time.perf_counter()
+    for i in range(iterations):
+        scratch.record("_calibration", "_calibration", i, 1, 0.5, "moderate", 0.0)
+    return (time.perf_counter() - started) / iterations
+
@@ -0,0 +1,355 @@
+"""Streaming bulk scoring of cohort files (NDJSON or CSV) into NDJSON.
+
+Input formats:
+
+- NDJSON: one record per line, either ``{"symptoms": [...], "id": ...}`` or a
+  bare JSON list of symptom names.
+- CSV: a header row, then one record per line. Either a ``symptoms`` column
+  holding ``;``-separated symptom names, or one 0/1 column per symptom
+  (display names or internal feature names). An ``id`` column is passed
+  through when present. Quoted fields must not contain newlines.
+
+Input is split into lines incrementally from byte blocks, then parsed and
+scored in fixed-size chunks, so memory stays constant regardless of file
+size. Every input record
+produces one output line, in input order:
+
+    {"line": 3, "id": "p-17", "prediction": 1, "probability": 0.83, "risk_level": "high"}
+    {"line": 4, "error": "..."}
+
+The API's /predict/stream endpoint and the CLI below share this code:
+
+    python -m utils.bulk cohort.jsonl -o scored.jsonl --processes 4 [--model-dir models/versions/<version>]
+
+Without ``--model-dir`` the file is scored by the model version the API would
+serve (see ``utils.model_registry``).
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.helpers import MODELS_DIR, risk_level_for, symptom_mapping
+from utils.vectorizer import vectorizer_for
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# (line number, id, symptoms or None, error or None)
+Record = Tuple[int, object, Optional[List[str]], Optional[str]]
+ScoreFn = Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]
+
+_feature_to_display = {feature: display for display, feature in symptom_mapping.items()}
+
+
+def _parse_ndjson(line: str) -> Tuple[object, List[str]]:
+    record = json.loads(line)
+    record_id = None
+    if isinstance(record, dict):
+        record_id = record.get("id")
+        record = record.get("symptoms")
+    if not isinstance(record, list) or not all(isinstance(s, str) for s in record):
+        raise ValueError("expected a list of symptom names")
+    return record_id, record
+
+
+class _CsvLayout:
+    def __init__(self, header: List[str]):
+        columns = [c.strip() for c in header]
+        self.id_column = columns.index("id") if "id" in columns else None
+        self.symptoms_column = columns.index("symptoms") if "symptoms" in columns else None
+        self.indicator_columns = []
+        for i, column in enumerate(columns):
+            if column in symptom_mapping:
+                self.indicator_columns.append((i, column))
+            elif column in _feature_to_display:
+                self.indicator_columns.append((i, _feature_to_display[column]))
+        if self.symptoms_column is None and not self.indicator_columns:
+            raise ValueError("CSV header has neither a 'symptoms' column nor symptom indicator columns")
+
+    def parse(self, row: List[str]) -> Tuple[object, List[str]]:
+        record_id = row[self.id_column] if self.id_column is not None else None
+        if self.symptoms_column is not None:
+            cell = row[self.symptoms_column]
+            return record_id, [s.strip() for s in cell.split(";") if s.strip()]
+        return record_id, [name for i, name in self.indicator_columns if row[i].strip() in ("1", "1.0", "true", "True")]
+
+
+NumberedLine = Tuple[int, str]
+
+
+class LineChunker:
+    """Splits byte chunks into numbered non-empty lines, emitting fixed-size chunks"""
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._buffer = b""
+        self._line_no = 0
+        self._lines: List[NumberedLine] = []
+
+    def _add(self, raw: bytes) -> None:
+        line = raw.decode("utf-8", errors="replace").strip()
+        if line:
+            self._line_no += 1
+            self._lines.append((self._line_no, line))
+
+    def _take_full_chunks(self) -> List[List[NumberedLine]]:
+        chunks = []
+        while len(self._lines) >= self.chunk_size:
+            chunks.append(self._lines[:self.chunk_size])
+            self._lines = self._lines[self.chunk_size:]
+        return chunks
+
+    def feed(self, data: bytes) -> List[List[NumberedLine]]:
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for raw in lines:
+            self._add(raw)
+        return self._take_full_chunks()
+
+    def pop_first(self) -> Optional[NumberedLine]:
+        """Remove and return the first complete line not yet handed out in a chunk"""
+        return self._lines.pop(0) if self._lines else None
+
+    def close(self) -> List[List[NumberedLine]]:
+        if self._buffer:
+            self._add(self._buffer)
+            self._buffer = b""
+        chunks = self._take_full_chunks()
+        if self._lines:
+            chunks.append(self._lines)
+            self._lines = []
+        return chunks
+
+
+def parse_lines(lines: Sequence[NumberedLine], fmt: str, csv_header: Optional[str] = None) -> List[Record]:
+    """Parse numbered lines into records; bad lines become error records"""
+    layout = _CsvLayout(next(csv.reader([csv_header]))) if fmt == "csv" else None
+    records = []
+    for line_no, line in lines:
+        try:
+            if layout is not None:
+                record_id, symptoms = layout.parse(next(csv.reader([line])))
+            else:
+                record_id, symptoms = _parse_ndjson(line)
+            records.append((line_no, record_id, symptoms, None))
+        except (ValueError, IndexError) as e:
+            records.append((line_no, None, None, str(e)))
+    return records
+
+
+class LineChunkStream:
+    """Feeds bytes through a LineChunker, setting aside the CSV header line"""
+
+    def __init__(self, fmt: str = "ndjson", chunk_size: int = DEFAULT_CHUNK_SIZE):
+        if fmt not in ("ndjson", "csv"):
+            raise ValueError(f"Unsupported format: {fmt!r}")
+        self.fmt = fmt
+        self.header: Optional[str] = None
+        self._chunker = LineChunker(chunk_size)
+
+    def _strip_header(self, chunks: List[List[NumberedLine]]) -> List[List[NumberedLine]]:
+        # Taken as soon as its line is complete, so callers can reject a bad header before any output
+        if self.fmt == "csv" and self.header is None:
+            header = chunks[0].pop(0) if chunks else self._chunker.pop_first()
+            if header is not None:
+                self.header = header[1]
+                _CsvLayout(next(csv.reader([self.header])))  # fail fast on an unusable header
+        return [chunk for chunk in chunks if chunk]
+
+    def feed(self, data: bytes) -> List[List[NumberedLine]]:
+        return self._strip_header(self._chunker.feed(data))
+
+    def close(self) -> List[List[NumberedLine]]:
+        return self._strip_header(self._chunker.close())
+
+    def parse(self, lines: Sequence[NumberedLine]) -> List[Record]:
+        return parse_lines(lines, self.fmt, self.header)
+
+
+def iter_line_chunks(stream, lines: LineChunkStream, read_size: int = 1 << 20) -> Iterator[List[NumberedLine]]:
+    """Read a binary file object in blocks and yield chunks of numbered lines"""
+    while True:
+        data = stream.read(read_size)
+        if not data:
+            break
+        yield from lines.feed(data)
+    yield from lines.close()
+
+
+def score_chunk(records: Sequence[Record], features: List[str], score_fn: ScoreFn) -> bytes:
+    """Score one chunk of records with a single model call and render NDJSON"""
+    scored = [r for r in records if r[2]]
+    results = {}
+    if scored:
+        preds, probas = score_fn(vectorizer_for(features).to_dense([r[2] for r in scored]))
+        for record, pred, proba in zip(scored, preds, probas):
+            results[record[0]] = (int(pred), float(proba))
+
+    out = []
+    for line_no, record_id, symptoms, error in records:
+        row = {"line": line_no}
+        if record_id is not None:
+            row["id"] = record_id
+        if error is not None:
+            row["error"] = error
+        elif not symptoms:
+            row.update(prediction=0, probability=0.0, risk_level="unknown")
+        else:
+            pred, proba = results[line_no]
+            row.update(prediction=pred, probability=proba, risk_level=risk_level_for(proba))
+        out.append(json.dumps(row))
+    return ("\n".join(out) + "\n").encode()
+
+
+async def spooled(chunks: AsyncIterator[bytes], read_size: int = 1 << 16) -> AsyncIterator[bytes]:
+    """Drain ``chunks`` in a background task into a temporary file and stream from it.
+
+    Most HTTP clients upload the whole body before reading the response. If
+    output were only produced as fast as the client reads it, the server would
+    stop reading input and both sides would stall. Spooling to disk keeps
+    input flowing with constant memory, and the response still starts as soon
+    as the first chunk is scored.
+    """
+    spool = tempfile.TemporaryFile()
+    written = 0
+    done = False
+    ready = asyncio.Event()
+
+    async def produce():
+        nonlocal written, done
+        try:
+            async for data in chunks:
+                spool.seek(0, os.SEEK_END)
+                spool.write(data)
+                written += len(data)
+                ready.set()
+        finally:
+            done = True
+            ready.set()
+
+    producer = asyncio.get_running_loop().create_task(produce())
+    position = 0
+    try:
+        while True:
+            if position < written:
+                spool.seek(position)
+                data = spool.read(min(read_size, written - position))
+                position += len(data)
+                yield data
+            elif done:
+                break
+            else:
+                ready.clear()
+                await ready.wait()
+        await producer  # re-raise anything the producer hit
+    finally:
+        producer.cancel()
+        spool.close()
+
+
+def detect_format(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def load_scorer(model_dir: Optional[str] = None) -> Tuple[ScoreFn, List[str]]:
+    """Load the scorer for the version the API would serve, or for the pickles in ``model_dir``.
+
+    The version is resolved like the API's model registry does: the ``ACTIVE``
+    pin under ``ENDODX_MODEL_DIR`` if set, else the newest version. Scoring then
+    uses the same fallbacks as the API: prediction table, fast-start file,
+    compiled pickles, sklearn.
+    """
+    from utils.model_registry import ModelRegistry, load_bundle
+
+    if model_dir is None:
+        registry = ModelRegistry(os.getenv("ENDODX_MODEL_DIR", MODELS_DIR))
+        version = registry.wanted_version()
+        if version is None:
+            raise FileNotFoundError(f"No model version found under {registry.model_dir}")
+        model_dir = registry.versions()[version]
+    else:
+        version = os.path.basename(os.path.normpath(model_dir))
+    bundle = load_bundle(version, model_dir, use_fast_model=False)
+    logger.info(f"Scoring with model {bundle.version} ({bundle.scorer}) from {model_dir}")
+    return bundle.score_matrix, bundle.features
+
+
+_worker_scorer: Optional[Tuple[ScoreFn, List[str]]] = None
+
+
+def _init_worker(model_dir: Optional[str]) -> None:
+    global _worker_scorer
+    _worker_scorer = load_scorer(model_dir)
+
+
+def _parse_and_score_in_worker(lines: List[NumberedLine], fmt: str, csv_header: Optional[str]) -> bytes:
+    score_fn, features = _worker_scorer
+    return score_chunk(parse_lines(lines, fmt, csv_header), features, score_fn)
+
+
+def score_file(source, output, fmt: str, chunk_size: int = DEFAULT_CHUNK_SIZE, processes: int = 1,
+               model_dir: Optional[str] = None) -> int:
+    """Score a cohort file into ``output`` in input order; returns the number of records.
+
+    With several processes the parent only splits lines; parsing and scoring
+    happen in the pool, with at most two chunks per process in flight.
+    """
+    lines = LineChunkStream(fmt, chunk_size)
+    rows = 0
+    if processes <= 1:
+        score_fn, features = load_scorer(model_dir)
+        for chunk in iter_line_chunks(source, lines):
+            output.write(score_chunk(lines.parse(chunk), features, score_fn))
+            rows += len(chunk)
+        return rows
+
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(model_dir,)) as pool:
+        pending = deque()
+        for chunk in iter_line_chunks(source, lines):
+            pending.append((len(chunk), pool.submit(_parse_and_score_in_worker, chunk, fmt, lines.header)))
+            if len(pending) >= 2 * processes:
+                n, future = pending.popleft()
+                output.write(future.result())
+                rows += n
+        while pending:
+            n, future = pending.popleft()
+            output.write(future.result())
+            rows += n
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a cohort file (NDJSON or CSV) into NDJSON")
+    parser.add_argument("input", help="input file, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="output NDJSON file, or - for stdout")
+    parser.add_argument("--format", choices=["ndjson", "csv"], help="input format (default: from extension)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--processes", type=int, default=1, help="score chunks in a process pool")
+    parser.add_argument("--model-dir", help="directory holding the model pickles (default: the active version)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    fmt = args.format or ("ndjson" if args.input == "-" else detect_format(args.input))
+    source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    sink = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    started = time.perf_counter()
+    try:
+        n_rows = score_file(source, sink, fmt, args.chunk_size, args.processes, args.model_dir)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if sink is not sys.stdout.buffer:
+            sink.close()
+    logger.info(f"Scored {n_rows} records in {time.perf_counter() - started:.1f}s")
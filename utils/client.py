@@ -0,0 +1,222 @@
+"""Prediction clients used by the Streamlit app.
+
+``HttpPredictor`` talks to the API over one pooled keep-alive session with
+connect/read timeouts and bounded retries. ``LocalPredictor`` scores in the
+app's own process from the model artifacts, for single-box deployments that
+don't need a separate API. Both return the same dicts as ``POST /predict``
+and ``POST /predict/toggles``.
+
+``HttpPredictor.predict`` uses the cacheable ``GET /predict/bitmask/{bitmask}``
+when every symptom has a stable ID. It keeps the last ``cache_size`` responses
+with their ETags. A response still within its ``max-age`` is reused without a
+request. An expired one is revalidated with ``If-None-Match``, and the API
+answers ``304`` without scoring if the model hasn't changed.
+
+Configuration (environment):
+
+- ``ENDODX_PREDICTOR``: ``http`` (default) or ``local``
+- ``ENDODX_API_URL``: prediction endpoint (default ``http://localhost:8000/predict``)
+- ``ENDODX_API_CONNECT_TIMEOUT`` / ``ENDODX_API_READ_TIMEOUT``: seconds (default 2 / 10)
+- ``ENDODX_API_RETRIES``: retries on connection errors and 502/503/504 (default 2)
+- ``ENDODX_API_POOL_SIZE``: keep-alive connections kept per host (default 10)
+- ``ENDODX_API_CACHE_SIZE``: responses kept for revalidation (default 256, 0 always POSTs)
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.compiled_model import compile_model_artifacts
+from utils.helpers import (
+    SYMPTOM_IDS, feature_display_names, load_model_artifacts, map_symptoms_to_vector, prediction_message, risk_level_for,
+    single_toggle_matrix, symptoms_to_indices
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = "http://localhost:8000/predict"
+
+
+NO_SYMPTOMS_PREDICTION = {
+    "prediction": 0,
+    "probability": 0.0,
+    "risk_level": "unknown",
+    "message": "No symptoms selected. Please select at least one symptom for prediction.",
+}
+
+
+def _prediction(pred, proba) -> Dict[str, Any]:
+    return {
+        "prediction": int(pred),
+        "probability": float(proba),
+        "risk_level": risk_level_for(proba),
+        "message": prediction_message(proba),
+    }
+
+
+def _max_age(cache_control: Optional[str]) -> float:
+    """Seconds a response may be reused without revalidation (0 unless max-age is given)"""
+    match = re.search(r"max-age=(\d+)", cache_control or "")
+    if match is None or "no-cache" in cache_control or "no-store" in cache_control:
+        return 0.0
+    return float(match.group(1))
+
+
+class PredictionServiceError(Exception):
+    """The prediction could not be obtained; the message is safe to show to users"""
+
+
+class HttpPredictor:
+    def __init__(self, url: str = DEFAULT_API_URL, connect_timeout: float = 2.0, read_timeout: float = 10.0,
+                 retries: int = 2, pool_size: int = 10, cache_size: int = 256):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache_size = cache_size
+        # URL -> (ETag, monotonic expiry, response)
+        self._cache: "OrderedDict[str, Tuple[str, float, Dict[str, Any]]]" = OrderedDict()
+        # One predictor serves every Streamlit session thread
+        self._cache_lock = threading.Lock()
+        # Scoring has no side effects, so POST is safe to retry
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.1,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET", "POST"]),
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def predict(self, symptoms: List[str]) -> Dict[str, Any]:
+        if self.cache_size > 0 and all(name in SYMPTOM_IDS for name in symptoms):
+            bitmask = 0
+            for name in symptoms:
+                bitmask |= 1 << SYMPTOM_IDS[name]
+            return self._get_cached(f"{self.url.rstrip('/')}/bitmask/{bitmask}")
+        return self._post(self.url, symptoms)
+
+    def toggles(self, symptoms: List[str]) -> Dict[str, Any]:
+        return self._post(self.url.rstrip("/") + "/toggles", symptoms)
+
+    def _post(self, url: str, symptoms: List[str]) -> Dict[str, Any]:
+        return self._json(self._send("POST", url, json={"symptoms": symptoms}))
+
+    def _get_cached(self, url: str) -> Dict[str, Any]:
+        with self._cache_lock:
+            entry = self._cache.get(url)
+            if entry is not None:
+                self._cache.move_to_end(url)
+                if time.monotonic() < entry[1]:
+                    return entry[2]
+        # The request itself is made outside the lock, so sessions don't wait on each other's round trips
+        response = self._send("GET", url, headers={"If-None-Match": entry[0]} if entry is not None else None)
+        if response.status_code == 304 and entry is not None:
+            body = entry[2]
+        else:
+            body = self._json(response)
+        etag = response.headers.get("ETag")
+        if etag:
+            expires = time.monotonic() + _max_age(response.headers.get("Cache-Control"))
+            with self._cache_lock:
+                self._cache[url] = (etag, expires, body)
+                self._cache.move_to_end(url)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return body
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        try:
+            return self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.exceptions.ConnectionError:
+            raise PredictionServiceError(
+                "Could not connect to the prediction service. Please ensure the API is running.")
+        except requests.exceptions.Timeout:
+            raise PredictionServiceError("The prediction service took too long to respond. Please try again.")
+
+    @staticmethod
+    def _json(response: requests.Response) -> Dict[str, Any]:
+        if response.status_code != 200:
+            try:
+                detail = response.json().get("detail", "An error occurred.")
+            except ValueError:
+                detail = f"An error occurred. Raw response: {response.text}"
+            raise PredictionServiceError(str(detail))
+        return response.json()
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class LocalPredictor:
+    """Scores in-process with the compiled model, falling back to sklearn"""
+
+    def __init__(self):
+        self.model, self.scaler, self.features = load_model_artifacts()
+        try:
+            self.compiled = compile_model_artifacts(self.model, self.scaler, self.features)
+        except Exception as e:
+            logger.warning(f"Failed to compile model, using sklearn: {str(e)}")
+            self.compiled = None
+        self.feature_names = feature_display_names(self.features)
+
+    def predict(self, symptoms: List[str]) -> Dict[str, Any]:
+        if self.compiled is not None:
+            pred, proba = self.compiled.predict_indices(symptoms_to_indices(symptoms, self.compiled.feature_index))
+        else:
+            preds, probas = self._score_matrix(map_symptoms_to_vector(symptoms, self.features))
+            pred, proba = preds[0], probas[0]
+        return _prediction(pred, proba)
+
+    def toggles(self, symptoms: List[str]) -> Dict[str, Any]:
+        vector = map_symptoms_to_vector(symptoms, self.features)
+        preds, probas = self._score_matrix(single_toggle_matrix(vector))
+        base = float(probas[0])
+        current = _prediction(preds[0], base) if vector.any() else NO_SYMPTOMS_PREDICTION
+        toggles = [
+            {
+                "symptom": name,
+                "feature": feature,
+                "selected": bool(vector[0, i]),
+                "probability": float(probas[i + 1]),
+                "risk_level": risk_level_for(probas[i + 1]),
+                "delta": float(probas[i + 1]) - base,
+            }
+            for i, (name, feature) in enumerate(zip(self.feature_names, self.features))
+        ]
+        return {"current": current, "toggles": toggles}
+
+    def _score_matrix(self, feature_matrix):
+        if self.compiled is not None:
+            return self.compiled.predict_matrix(feature_matrix)
+        scaled = self.scaler.transform(feature_matrix)
+        return self.model.predict(scaled), self.model.predict_proba(scaled)[:, 1]
+
+    def close(self) -> None:
+        pass
+
+
+def predictor_from_env():
+    """Build the predictor selected by ``ENDODX_PREDICTOR``"""
+    mode = os.getenv("ENDODX_PREDICTOR", "http")
+    if mode == "local":
+        return LocalPredictor()
+    if mode != "http":
+        raise ValueError(f"ENDODX_PREDICTOR must be 'http' or 'local', not {mode!r}")
+    return HttpPredictor(
+        url=os.getenv("ENDODX_API_URL", DEFAULT_API_URL),
+        connect_timeout=float(os.getenv("ENDODX_API_CONNECT_TIMEOUT", "2")),
+        read_timeout=float(os.getenv("ENDODX_API_READ_TIMEOUT", "10")),
+        retries=int(os.getenv("ENDODX_API_RETRIES", "2")),
+        pool_size=int(os.getenv("ENDODX_API_POOL_SIZE", "10")),
+        cache_size=int(os.getenv("ENDODX_API_CACHE_SIZE", "256")),
+    )
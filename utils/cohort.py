@@ -0,0 +1,208 @@
+"""Cohort-level aggregates in one streaming pass, without per-patient output.
+
+Input is the same NDJSON or CSV that ``utils.bulk`` accepts. Each chunk of
+records is vectorized into feature bitmasks, scored in one model call and
+folded into running totals with NumPy reductions. Every total is sized by
+the number of features or bins, not by the cohort, so memory stays constant:
+
+- ``risk_levels``: count, share and mean probability per risk band, split at
+  the API's thresholds (``MODERATE_RISK_THRESHOLD`` 0.4, ``HIGH_RISK_THRESHOLD`` 0.7)
+- ``probability_histogram``: counts over ``bins`` equal-width bins on [0, 1]
+- ``symptom_prevalence``: share of rows reporting each symptom, overall and per band
+- ``top_combinations``: the most frequent exact symptom sets
+
+Combinations are counted with the Misra-Gries summary. At most
+``max_tracked`` distinct sets are kept, and each reported count is low by
+at most ``combination_max_error``; with fewer distinct sets than
+``max_tracked`` the counts are exact. Records that can't be scored
+meaningfully are counted apart and left out of every other total:
+
+- ``no_symptoms``: an empty symptom list, which ``/predict`` and
+  ``/predict/stream`` answer with risk level ``unknown``
+- ``unknown_only``: only names the model doesn't know. The per-row endpoints
+  score these as an empty symptom vector and list the names in
+  ``unknown_symptoms``, which says nothing about the cohort
+- ``errors``: malformed records
+
+    python -m utils.cohort cohort.csv -o aggregates.json --bins 20 --top 10
+
+The API serves the same report at ``POST /predict/cohort``.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from utils import bulk
+from utils.helpers import HIGH_RISK_THRESHOLD, MODERATE_RISK_THRESHOLD, feature_display_names
+from utils.vectorizer import vectorizer_for
+
+logger = logging.getLogger(__name__)
+
+RISK_BANDS = ("low", "moderate", "high")
+BAND_EDGES = np.array([MODERATE_RISK_THRESHOLD, HIGH_RISK_THRESHOLD])
+
+DEFAULT_BINS = 20
+DEFAULT_TOP = 10
+DEFAULT_MAX_TRACKED = 10000
+
+
+class CohortAggregator:
+    """Running cohort totals, updated one scored chunk at a time"""
+
+    def __init__(self, features: Sequence[str], bins: int = DEFAULT_BINS, top: int = DEFAULT_TOP,
+                 max_tracked: int = DEFAULT_MAX_TRACKED):
+        if bins < 1 or top < 0 or max_tracked < top:
+            raise ValueError("bins must be positive and max_tracked at least top")
+        self.features = list(features)
+        self.vectorizer = vectorizer_for(self.features)
+        self.bins = bins
+        self.top = top
+        self.max_tracked = max_tracked
+
+        self.rows = 0
+        self.no_symptoms = 0
+        self.unknown_only = 0
+        self.errors = 0
+        self.band_counts = np.zeros(len(RISK_BANDS), dtype=np.int64)
+        self.band_probability_sums = np.zeros(len(RISK_BANDS))
+        self.histogram = np.zeros(bins, dtype=np.int64)
+        # Rows reporting each feature, per band
+        self.feature_counts = np.zeros((len(RISK_BANDS), len(self.features)), dtype=np.int64)
+        self.combinations: Dict[int, int] = {}
+        self.combination_max_error = 0
+
+    def add_records(self, records: Sequence[bulk.Record], score_fn: bulk.ScoreFn) -> Optional[tuple]:
+        """Fold a chunk of parsed records in; returns (bitmasks, predictions, probabilities) of the scored rows"""
+        symptom_lists = [symptoms for _, _, symptoms, error in records if error is None]
+        self.errors += len(records) - len(symptom_lists)
+        self.rows += len(records)
+        if not symptom_lists:
+            return None
+        bitmasks = self.vectorizer.to_bitmasks(symptom_lists)
+        # Empty lists and lists of only unknown names both vectorize to 0; neither is scored
+        present = bitmasks != 0
+        empty = np.fromiter((not symptoms for symptoms in symptom_lists), dtype=bool, count=len(symptom_lists))
+        self.no_symptoms += int(empty.sum())
+        self.unknown_only += int((~present & ~empty).sum())
+        bitmasks = bitmasks[present]
+        if not len(bitmasks):
+            return None
+        feature_matrix = self.vectorizer.expand_bitmasks(bitmasks)
+        preds, probas = score_fn(feature_matrix)
+        self.add_scored(bitmasks, feature_matrix, np.asarray(probas, dtype=float))
+        return bitmasks, preds, probas
+
+    def add_scored(self, bitmasks: np.ndarray, feature_matrix: np.ndarray, probabilities: np.ndarray) -> None:
+        bands = np.searchsorted(BAND_EDGES, probabilities, side="right")
+        self.band_counts += np.bincount(bands, minlength=len(RISK_BANDS))
+        self.band_probability_sums += np.bincount(bands, weights=probabilities, minlength=len(RISK_BANDS))
+        bin_index = np.minimum((probabilities * self.bins).astype(np.int64), self.bins - 1)
+        self.histogram += np.bincount(bin_index, minlength=self.bins)
+        # One-hot bands (n x 3) against the 0/1 features (n x N) gives per-band symptom counts
+        one_hot = np.eye(len(RISK_BANDS))[bands]
+        self.feature_counts += np.rint(one_hot.T @ feature_matrix).astype(np.int64)
+        self._count_combinations(bitmasks)
+
+    def _count_combinations(self, bitmasks: np.ndarray) -> None:
+        values, counts = np.unique(bitmasks, return_counts=True)
+        tracked = self.combinations
+        for value, count in zip(values.tolist(), counts.tolist()):
+            tracked[value] = tracked.get(value, 0) + count
+        if len(tracked) > self.max_tracked:
+            # Misra-Gries: subtract the (max_tracked + 1)-th largest count from every entry, keep the positives
+            rank = len(tracked) - self.max_tracked - 1
+            cut = int(np.partition(np.fromiter(tracked.values(), dtype=np.int64, count=len(tracked)), rank)[rank])
+            self.combinations = {k: v - cut for k, v in tracked.items() if v > cut}
+            self.combination_max_error += cut
+
+    def report(self) -> Dict[str, Any]:
+        scored = int(self.band_counts.sum())
+        names = feature_display_names(self.features)
+
+        def share(count, total):
+            return float(count) / total if total else 0.0
+
+        prevalence = []
+        for i, (name, feature) in enumerate(zip(names, self.features)):
+            entry = {"symptom": name, "feature": feature, "overall": share(self.feature_counts[:, i].sum(), scored)}
+            for b, band in enumerate(RISK_BANDS):
+                entry[band] = share(self.feature_counts[b, i], self.band_counts[b])
+            prevalence.append(entry)
+
+        top = sorted(self.combinations.items(), key=lambda item: (-item[1], item[0]))[:self.top]
+        return {
+            "rows": self.rows,
+            "scored": scored,
+            "no_symptoms": self.no_symptoms,
+            "unknown_only": self.unknown_only,
+            "errors": self.errors,
+            "thresholds": {"moderate": MODERATE_RISK_THRESHOLD, "high": HIGH_RISK_THRESHOLD},
+            "mean_probability": share(self.band_probability_sums.sum(), scored),
+            "risk_levels": {
+                band: {
+                    "count": int(self.band_counts[b]),
+                    "share": share(self.band_counts[b], scored),
+                    "mean_probability": share(self.band_probability_sums[b], self.band_counts[b]),
+                }
+                for b, band in enumerate(RISK_BANDS)
+            },
+            "probability_histogram": {
+                "edges": np.linspace(0.0, 1.0, self.bins + 1).round(6).tolist(),
+                "counts": self.histogram.tolist(),
+            },
+            "symptom_prevalence": prevalence,
+            "top_combinations": [
+                {"symptoms": [names[i] for i in range(len(names)) if mask >> i & 1],
+                 "count": count, "share": share(count, scored)}
+                for mask, count in top
+            ],
+            "combination_max_error": self.combination_max_error,
+        }
+
+
+def aggregate_file(source, fmt: str, score_fn: bulk.ScoreFn, features: List[str],
+                   chunk_size: int = bulk.DEFAULT_CHUNK_SIZE, **options) -> Dict[str, Any]:
+    """Aggregate a binary file object in one pass"""
+    aggregator = CohortAggregator(features, **options)
+    lines = bulk.LineChunkStream(fmt, chunk_size)
+    for chunk in bulk.iter_line_chunks(source, lines):
+        aggregator.add_records(lines.parse(chunk), score_fn)
+    return aggregator.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate risk and symptom statistics over a cohort file")
+    parser.add_argument("input", help="input file (NDJSON or CSV, as for utils.bulk), or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="output JSON file, or - for stdout")
+    parser.add_argument("--format", choices=["ndjson", "csv"], help="input format (default: from extension)")
+    parser.add_argument("--chunk-size", type=int, default=bulk.DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--bins", type=int, default=DEFAULT_BINS, help="probability histogram bins")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="symptom combinations to report")
+    parser.add_argument("--max-tracked", type=int, default=DEFAULT_MAX_TRACKED,
+                        help="distinct combinations kept in memory")
+    parser.add_argument("--model-dir", help="directory holding the model pickles (default: the active version)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    fmt = args.format or ("ndjson" if args.input == "-" else bulk.detect_format(args.input))
+    score_fn, features = bulk.load_scorer(args.model_dir)
+    started = time.perf_counter()
+    source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    try:
+        report = aggregate_file(source, fmt, score_fn, features, args.chunk_size, bins=args.bins, top=args.top,
+                                max_tracked=args.max_tracked)
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    logger.info(f"Aggregated {report['rows']} records in {time.perf_counter() - started:.1f}s")
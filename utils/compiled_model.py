@@ -0,0 +1,247 @@
+"""Fused NumPy evaluator for the StandardScaler + binary SVC pipeline.
+
+The scaler's mean and scale are folded into the support vectors so a binary
+symptom vector goes straight to the kernel without a separate transform:
+
+    raw = x @ weights + offsets          (one column per support vector)
+    decision = kernel(raw) @ dual_coef + intercept
+
+For a linear kernel the support vectors collapse into a single weight
+vector. The decision value is computed once and both the label and the
+Platt-scaled probability are derived from it. Because inputs are binary,
+a row can also be given as the list of its active feature indices, which
+only touches those rows of ``weights``.
+"""
+import math
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+SUPPORTED_KERNELS = ("linear", "rbf", "poly", "sigmoid")
+
+# Same constant as libsvm's svm_predict_probability
+MIN_PROBABILITY = 1e-7
+
+
+class CompiledSVM:
+    """Self-contained evaluator over binary feature vectors"""
+
+    def __init__(self, kernel: str, weights: np.ndarray, offsets: np.ndarray,
+                 dual_coef: np.ndarray, intercept: float, classes: Sequence[int],
+                 features: List[str], gamma: float = 1.0, coef0: float = 0.0,
+                 degree: int = 3, prob_a: float = None, prob_b: float = None):
+        self.kernel = kernel
+        self.weights = np.ascontiguousarray(weights, dtype=float)  # (n_features, n_columns)
+        self.offsets = np.asarray(offsets, dtype=float)            # (n_columns,)
+        self.dual_coef = np.asarray(dual_coef, dtype=float)        # (n_columns,)
+        self.intercept = float(intercept)
+        self.classes = np.asarray(classes)
+        self.features = list(features)
+        self.feature_index: Dict[str, int] = {f: i for i, f in enumerate(self.features)}
+        self.gamma = float(gamma)
+        self.coef0 = float(coef0)
+        self.degree = int(degree)
+        self.prob_a = prob_a
+        self.prob_b = prob_b
+
+    @property
+    def has_probability(self) -> bool:
+        return self.prob_a is not None
+
+    def _apply_kernel(self, raw: np.ndarray) -> np.ndarray:
+        if self.kernel == "linear":
+            return raw
+        if self.kernel == "rbf":
+            return np.exp(-self.gamma * raw)
+        if self.kernel == "poly":
+            return raw ** self.degree
+        return np.tanh(raw)
+
+    def decision_matrix(self, feature_matrix: np.ndarray) -> np.ndarray:
+        """Decision values for an (n x N) binary feature matrix"""
+        raw = np.asarray(feature_matrix, dtype=float) @ self.weights + self.offsets
+        return self._apply_kernel(raw) @ self.dual_coef + self.intercept
+
+    def decision_indices(self, active: Sequence[int]) -> float:
+        """Decision value for one input given as its active feature indices"""
+        raw = self.offsets + self.weights[list(active)].sum(axis=0)
+        return float(self._apply_kernel(raw) @ self.dual_coef + self.intercept)
+
+    def probability(self, decision: np.ndarray) -> np.ndarray:
+        """Probability of the positive class, matching SVC.predict_proba"""
+        if not self.has_probability:
+            return decision
+        return _platt_probability(decision, self.prob_a, self.prob_b)
+
+    def predict_matrix(self, feature_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        decision = self.decision_matrix(feature_matrix)
+        return self.classes[(decision > 0).astype(int)], self.probability(decision)
+
+    def label(self, decision: float) -> int:
+        return int(self.classes[int(decision > 0)])
+
+    def probability_scalar(self, decision: float) -> float:
+        if not self.has_probability:
+            return decision
+        return _platt_probability_scalar(decision, self.prob_a, self.prob_b)
+
+    def predict_indices(self, active: Sequence[int]) -> Tuple[int, float]:
+        decision = self.decision_indices(active)
+        return self.label(decision), self.probability_scalar(decision)
+
+
+def _platt_probability(decision: np.ndarray, prob_a: float, prob_b: float) -> np.ndarray:
+    """Replicates libsvm's binary probability estimate for sklearn's decision values.
+
+    libsvm's decision value has the opposite sign to sklearn's, and sklearn's
+    bundled libsvm couples the two pairwise estimates with the iterative
+    multiclass_probability solver even for two classes, stopping at
+    eps = 0.005 / k. The loop below follows it step for step so the results
+    agree to floating point precision rather than to within ``eps``.
+    """
+    decision = np.asarray(decision, dtype=float)
+    f_apb = -decision * prob_a + prob_b
+    with np.errstate(over="ignore"):
+        r = np.where(f_apb >= 0,
+                     np.exp(-f_apb) / (1.0 + np.exp(-f_apb)),
+                     1.0 / (1.0 + np.exp(f_apb)))
+    r = np.clip(r, MIN_PROBABILITY, 1 - MIN_PROBABILITY)  # P(classes[0])
+
+    k = 2
+    eps = 0.005 / k
+    q00, q11, q01 = (1 - r) ** 2, r ** 2, -(1 - r) * r
+    p0 = np.full_like(r, 1.0 / k)
+    p1 = np.full_like(r, 1.0 / k)
+    active = np.ones(r.shape, dtype=bool)
+
+    for _ in range(max(100, k)):
+        qp0 = q00 * p0 + q01 * p1
+        qp1 = q01 * p0 + q11 * p1
+        pqp = p0 * qp0 + p1 * qp1
+        active &= np.maximum(np.abs(qp0 - pqp), np.abs(qp1 - pqp)) >= eps
+        if not active.any():
+            break
+        # Coordinate updates for t = 0 then t = 1, only on rows still iterating
+        diff = np.where(active, (-qp0 + pqp) / q00, 0.0)
+        p0 = p0 + diff
+        pqp = (pqp + diff * (diff * q00 + 2 * qp0)) / (1 + diff) / (1 + diff)
+        qp0, qp1 = (qp0 + diff * q00) / (1 + diff), (qp1 + diff * q01) / (1 + diff)
+        p0, p1 = p0 / (1 + diff), p1 / (1 + diff)
+
+        diff = np.where(active, (-qp1 + pqp) / q11, 0.0)
+        p1 = p1 + diff
+        p0, p1 = p0 / (1 + diff), p1 / (1 + diff)
+
+    return p1
+
+
+def _platt_probability_scalar(decision: float, prob_a: float, prob_b: float) -> float:
+    """Single-value version of _platt_probability without NumPy call overhead"""
+    f_apb = -decision * prob_a + prob_b
+    if f_apb >= 0:
+        r = math.exp(-f_apb) / (1.0 + math.exp(-f_apb))
+    else:
+        r = 1.0 / (1.0 + math.exp(f_apb))
+    r = min(max(r, MIN_PROBABILITY), 1 - MIN_PROBABILITY)
+
+    k = 2
+    eps = 0.005 / k
+    q00, q11, q01 = (1 - r) ** 2, r ** 2, -(1 - r) * r
+    p0 = p1 = 1.0 / k
+    for _ in range(max(100, k)):
+        qp0 = q00 * p0 + q01 * p1
+        qp1 = q01 * p0 + q11 * p1
+        pqp = p0 * qp0 + p1 * qp1
+        if max(abs(qp0 - pqp), abs(qp1 - pqp)) < eps:
+            break
+        diff = (-qp0 + pqp) / q00
+        p0 += diff
+        pqp = (pqp + diff * (diff * q00 + 2 * qp0)) / (1 + diff) / (1 + diff)
+        qp0, qp1 = (qp0 + diff * q00) / (1 + diff), (qp1 + diff * q01) / (1 + diff)
+        p0, p1 = p0 / (1 + diff), p1 / (1 + diff)
+
+        diff = (-qp1 + pqp) / q11
+        p1 += diff
+        p0, p1 = p0 / (1 + diff), p1 / (1 + diff)
+    return p1
+
+
+def compile_svm(model, scaler, features: List[str]) -> CompiledSVM:
+    """Fold a fitted StandardScaler and binary SVC into a CompiledSVM"""
+    if not hasattr(model, "support_vectors_") or not hasattr(model, "kernel"):
+        raise ValueError(f"Only kernel SVC models can be compiled, got {type(model).__name__}")
+    kernel = model.kernel
+    if kernel not in SUPPORTED_KERNELS:
+        raise ValueError(f"Unsupported kernel for compilation: {kernel!r}")
+    if len(model.classes_) != 2:
+        raise ValueError(f"Only binary models can be compiled, got {len(model.classes_)} classes")
+
+    n_features = len(features)
+    mean = scaler.mean_ if getattr(scaler, "with_mean", True) and scaler.mean_ is not None else np.zeros(n_features)
+    scale = scaler.scale_ if getattr(scaler, "with_std", True) and scaler.scale_ is not None else np.ones(n_features)
+    support_vectors = np.asarray(model.support_vectors_, dtype=float)
+    dual_coef = np.asarray(model.dual_coef_, dtype=float)[0]
+    intercept = float(model.intercept_[0])
+    gamma = float(getattr(model, "_gamma", 1.0))
+
+    if kernel == "linear":
+        # <(x - mean) / scale, w> + b  ==  x @ (w / scale) + (b - mean @ (w / scale))
+        w = (dual_coef @ support_vectors) / scale
+        weights, offsets = w[:, None], np.array([intercept - mean @ w])
+        dual_coef, intercept = np.ones(1), 0.0
+    elif kernel == "rbf":
+        # ||(x - mean) / scale - sv||^2 with x binary (x_j^2 == x_j) is linear in x
+        centred = mean / scale + support_vectors
+        weights = ((1 - 2 * (mean + scale * support_vectors)) / scale ** 2).T
+        offsets = (centred ** 2).sum(axis=1)
+    else:
+        # gamma * <(x - mean) / scale, sv> + coef0
+        weights = (gamma * support_vectors / scale).T
+        offsets = model.coef0 - gamma * support_vectors @ (mean / scale)
+
+    prob_a = prob_b = None
+    if getattr(model, "probability", False) and len(getattr(model, "probA_", ())) == 1:
+        prob_a, prob_b = float(model.probA_[0]), float(model.probB_[0])
+
+    return CompiledSVM(kernel, weights, offsets, dual_coef, intercept, model.classes_, features,
+                       gamma=gamma, coef0=model.coef0, degree=model.degree,
+                       prob_a=prob_a, prob_b=prob_b)
+
+
+def verify_compiled_svm(compiled: CompiledSVM, model, scaler, n_samples: int = 1024,
+                        atol: float = 1e-8, seed: int = 0) -> None:
+    """Raise ValueError unless the evaluator reproduces sklearn on random binary inputs"""
+    n_features = len(compiled.features)
+    rng = np.random.default_rng(seed)
+    samples = rng.integers(0, 2, size=(n_samples, n_features)).astype(float)
+    samples[0], samples[-1] = 0, 1
+
+    scaled = scaler.transform(samples)
+    expected_decision = model.decision_function(scaled)
+    expected_pred = model.predict(scaled)
+    expected_proba = (model.predict_proba(scaled)[:, 1]
+                      if hasattr(model, "predict_proba") and compiled.has_probability
+                      else expected_decision)
+
+    decision = compiled.decision_matrix(samples)
+    pred, proba = compiled.predict_matrix(samples)
+    sparse = [compiled.predict_indices(np.flatnonzero(row)) for row in samples[:64]]
+    sparse_proba = np.array([p for _, p in sparse])
+
+    errors = {
+        "decision": np.abs(decision - expected_decision).max(),
+        "sparse probability": np.abs(sparse_proba - expected_proba[:64]).max(),
+        "probability": np.abs(proba - expected_proba).max(),
+    }
+    for name, error in errors.items():
+        if error > atol:
+            raise ValueError(f"Compiled model {name} differs from sklearn by {error:.3g} (tolerance {atol})")
+    if not np.array_equal(pred, expected_pred):
+        raise ValueError("Compiled model predictions differ from sklearn")
+
+
+def compile_model_artifacts(model, scaler, features: List[str]) -> CompiledSVM:
+    """Compile the loaded artifacts and check the result against sklearn"""
+    compiled = compile_svm(model, scaler, features)
+    verify_compiled_svm(compiled, model, scaler)
+    return compiled
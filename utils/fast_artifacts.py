@@ -0,0 +1,137 @@
+"""Single-file, memory-mappable model artifact format.
+
+Loading the three joblib pickles imports sklearn and unpickles the estimators
+in every worker. This format stores the compiled evaluator
+(``utils.compiled_model``) instead, with the scaler already folded in:
+
+    magic (8 bytes) | format version, header length (2 x uint32 LE)
+    | JSON header, padded to 64 bytes | raw little-endian arrays, 64-byte aligned
+
+The header records the feature order, the kernel parameters, the byte layout
+of each array, the fingerprint of the pickles it was exported from and a
+SHA-256 checksum of the array section. Arrays are read as views on one
+read-only memory map, so workers on the same host share the same pages.
+
+The file is a build output and is not committed. Export it with:
+
+    python -m utils.fast_artifacts [--model-dir models/versions/<version>]
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+from typing import Optional, Tuple
+
+import numpy as np
+
+from utils.compiled_model import CompiledSVM
+from utils.helpers import MODELS_DIR
+
+logger = logging.getLogger(__name__)
+
+FAST_ARTIFACT_FILE = "svm_model.endodx"
+FAST_ARTIFACT_PATH = os.path.join(MODELS_DIR, FAST_ARTIFACT_FILE)
+
+MAGIC = b"ENDODX\x00\x01"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<II")
+
+
+def _padding(length: int) -> int:
+    return -length % ALIGNMENT
+
+
+def export_fast_artifacts(compiled: CompiledSVM, fingerprint: str, path: str = FAST_ARTIFACT_PATH) -> None:
+    """Write a compiled model to the fast-start format"""
+    arrays = {
+        "weights": compiled.weights,
+        "offsets": compiled.offsets,
+        "dual_coef": compiled.dual_coef,
+        "classes": compiled.classes.astype("<i8"),
+    }
+    layout, chunks, offset = {}, [], 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+        data = array.tobytes()
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        chunks.append(data + b"\x00" * _padding(len(data)))
+        offset += len(data) + _padding(len(data))
+    payload = b"".join(chunks)
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "fingerprint": fingerprint,
+        "features": compiled.features,
+        "kernel": compiled.kernel,
+        "intercept": compiled.intercept,
+        "gamma": compiled.gamma,
+        "coef0": compiled.coef0,
+        "degree": compiled.degree,
+        "prob_a": compiled.prob_a,
+        "prob_b": compiled.prob_b,
+        "arrays": layout,
+        "sha256": hashlib.sha256(payload).hexdigest(),
+    }
+    header_bytes = json.dumps(header).encode()
+    # JSON allows trailing whitespace, so pad the header until the arrays start aligned
+    header_bytes += b" " * _padding(len(MAGIC) + _PREAMBLE.size + len(header_bytes))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_PREAMBLE.pack(FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def load_fast_artifacts(path: str = FAST_ARTIFACT_PATH, expected_fingerprint: Optional[str] = None,
+                        verify_checksum: bool = True) -> Tuple[CompiledSVM, str]:
+    """Memory-map a fast-start file, returning the evaluator and its source fingerprint"""
+    raw = np.memmap(path, dtype=np.uint8, mode="r")
+    if bytes(raw[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"{path} is not an EndoDx artifact file")
+    version, header_length = _PREAMBLE.unpack(bytes(raw[len(MAGIC):len(MAGIC) + _PREAMBLE.size]))
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format version {version} (expected {FORMAT_VERSION})")
+
+    data_start = len(MAGIC) + _PREAMBLE.size + header_length
+    header = json.loads(bytes(raw[len(MAGIC) + _PREAMBLE.size:data_start]))
+    if expected_fingerprint is not None and header["fingerprint"] != expected_fingerprint:
+        raise ValueError("exported from different model artifacts")
+
+    payload = raw[data_start:]
+    if verify_checksum and hashlib.sha256(payload).hexdigest() != header["sha256"]:
+        raise ValueError(f"Checksum mismatch in {path}")
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        start = spec["offset"]
+        arrays[name] = payload[start:start + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+
+    compiled = CompiledSVM(
+        header["kernel"], arrays["weights"], arrays["offsets"], arrays["dual_coef"],
+        header["intercept"], arrays["classes"], header["features"],
+        gamma=header["gamma"], coef0=header["coef0"], degree=header["degree"],
+        prob_a=header["prob_a"], prob_b=header["prob_b"]
+    )
+    return compiled, header["fingerprint"]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from utils.helpers import MODELS_DIR, artifact_fingerprint, artifact_paths, load_compiled_model
+
+    parser = argparse.ArgumentParser(description="Export the compiled model as a fast-start artifact file")
+    parser.add_argument("--model-dir", default=MODELS_DIR, help="directory holding the model pickles")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    path = os.path.join(args.model_dir, FAST_ARTIFACT_FILE)
+    export_fast_artifacts(load_compiled_model(args.model_dir), artifact_fingerprint(artifact_paths(args.model_dir)), path)
+    logger.info(f"Wrote {path}")
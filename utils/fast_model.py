@@ -0,0 +1,385 @@
+"""Distilled surrogate of the served model for approximate "fast" scoring.
+
+The surrogate is fitted offline to mimic the exact model over the binary
+symptom space:
+
+    decision ~= intercept + x @ weights [+ sum of pair_weights[i, j] over active pairs i < j]
+    probability = interpolation of the exact Platt mapping on a fixed decision grid
+
+Its cost depends only on the number of selected symptoms, not on the number
+of support vectors or the iterative probability solver. Build it, together
+with a fidelity report against the exact model, with:
+
+    python -m utils.fast_model [--model-dir models/versions/<version>] [--pairs]
+
+The report records the maximum probability error, and from it the width of
+the band around the 0.4 / 0.7 risk thresholds (and around the decision
+boundary) inside which the API rescores a row exactly. Outside that band the
+surrogate's error is too small to change the risk level or the label.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.compiled_model import compile_model_artifacts
+from utils.helpers import (
+    HIGH_RISK_THRESHOLD, MODELS_DIR, MODERATE_RISK_THRESHOLD, artifact_fingerprint, artifact_paths,
+    bitmasks_to_matrix, load_model_artifacts
+)
+
+logger = logging.getLogger(__name__)
+
+FAST_MODEL_FILE = "svm_fast.npz"
+FAST_MODEL_META_FILE = "svm_fast.json"
+
+RISK_THRESHOLDS = (MODERATE_RISK_THRESHOLD, HIGH_RISK_THRESHOLD)
+
+# The band is never narrower than this, so float32 noise can't flip a level
+MIN_MARGIN = 1e-4
+
+
+class FastModel:
+    """Approximate evaluator; rows it is unsure about are flagged for exact rescoring"""
+
+    def __init__(self, weights: np.ndarray, intercept: float, grid: np.ndarray, grid_probability: np.ndarray,
+                 classes: Sequence[int], features: List[str], fingerprint: str,
+                 probability_margin: float, decision_margin: float, pair_weights: Optional[np.ndarray] = None):
+        self.weights = np.asarray(weights, dtype=float)
+        self.intercept = float(intercept)
+        self.grid = np.asarray(grid, dtype=float)
+        self.grid_probability = np.asarray(grid_probability, dtype=float)
+        self.classes = np.asarray(classes)
+        self.features = list(features)
+        self.fingerprint = fingerprint
+        self.probability_margin = float(probability_margin)
+        self.decision_margin = float(decision_margin)
+        self.pair_weights = None if pair_weights is None else np.asarray(pair_weights, dtype=float)
+        self.fast_rows = 0
+        self.fallback_rows = 0
+        # Python-level copies for the single-row path, where NumPy call overhead dominates
+        self._weights = self.weights.tolist()
+        self._pairs = None if self.pair_weights is None else self.pair_weights.tolist()
+        self._grid_start = float(self.grid[0])
+        self._grid_step = float(self.grid[1] - self.grid[0])
+        self._grid_probability = self.grid_probability.tolist()
+
+    def decision_matrix(self, feature_matrix: np.ndarray) -> np.ndarray:
+        feature_matrix = np.asarray(feature_matrix, dtype=float)
+        decision = feature_matrix @ self.weights + self.intercept
+        if self.pair_weights is not None:
+            # pair_weights is strictly upper triangular, so each active pair counts once
+            decision += np.einsum("ij,jk,ik->i", feature_matrix, self.pair_weights, feature_matrix)
+        return decision
+
+    def decision_indices(self, active: Sequence[int]) -> float:
+        weights = self._weights
+        decision = self.intercept
+        for i in active:
+            decision += weights[i]
+        if self._pairs is not None:
+            active = sorted(active)
+            for n, i in enumerate(active):
+                row = self._pairs[i]
+                for j in active[n + 1:]:
+                    decision += row[j]
+        return decision
+
+    def probability(self, decision: np.ndarray) -> np.ndarray:
+        return np.interp(decision, self.grid, self.grid_probability)
+
+    def probability_scalar(self, decision: float) -> float:
+        position = (decision - self._grid_start) / self._grid_step
+        last = len(self._grid_probability) - 1
+        if position <= 0:
+            return self._grid_probability[0]
+        if position >= last:
+            return self._grid_probability[last]
+        i = int(position)
+        low = self._grid_probability[i]
+        return low + (position - i) * (self._grid_probability[i + 1] - low)
+
+    def uncertain(self, decision: np.ndarray, probability: np.ndarray) -> np.ndarray:
+        """Rows close enough to a risk threshold or the label boundary to need exact scoring"""
+        near = np.abs(decision) <= self.decision_margin
+        for threshold in RISK_THRESHOLDS:
+            near |= np.abs(probability - threshold) <= self.probability_margin
+        return near
+
+    def predict_matrix(self, feature_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Labels, probabilities and the mask of rows that should be rescored exactly"""
+        decision = self.decision_matrix(feature_matrix)
+        probability = self.probability(decision)
+        uncertain = self.uncertain(decision, probability)
+        n_uncertain = int(uncertain.sum())
+        self.fallback_rows += n_uncertain
+        self.fast_rows += len(decision) - n_uncertain
+        return self.classes[(decision > 0).astype(int)], probability, uncertain
+
+    def predict_indices(self, active: Sequence[int]) -> Optional[Tuple[int, float]]:
+        """(label, probability) for one row, or None if it should be scored exactly"""
+        decision = self.decision_indices(active)
+        probability = self.probability_scalar(decision)
+        if abs(decision) <= self.decision_margin or any(
+                abs(probability - threshold) <= self.probability_margin for threshold in RISK_THRESHOLDS):
+            self.fallback_rows += 1
+            return None
+        self.fast_rows += 1
+        return int(self.classes[int(decision > 0)]), probability
+
+    def stats(self) -> Dict[str, object]:
+        rows = self.fast_rows + self.fallback_rows
+        return {
+            "fast_rows": self.fast_rows,
+            "fallback_rows": self.fallback_rows,
+            "fallback_rate": self.fallback_rows / rows if rows else 0.0,
+            "probability_margin": self.probability_margin,
+            "decision_margin": self.decision_margin,
+        }
+
+
+def _design_chunks(feature_matrix: np.ndarray, pairs: bool):
+    """Columns [x, x_i * x_j for i < j, 1] of the least-squares problem"""
+    n, n_features = feature_matrix.shape
+    columns = [feature_matrix]
+    if pairs:
+        upper_i, upper_j = np.triu_indices(n_features, k=1)
+        columns.append(feature_matrix[:, upper_i] * feature_matrix[:, upper_j])
+    columns.append(np.ones((n, 1)))
+    return np.hstack(columns)
+
+
+def sample_symptom_space(n: int, n_features: int, seed: int) -> np.ndarray:
+    """Random binary rows with densities spread over [0, 1], plus every 0-, 1- and 2-symptom row"""
+    rng = np.random.default_rng(seed)
+    density = rng.random((n, 1))
+    rows = (rng.random((n, n_features)) < density).astype(float)
+    small = [np.zeros(n_features)]
+    eye = np.eye(n_features)
+    small += list(eye)
+    small += [eye[i] + eye[j] for i in range(n_features) for j in range(i + 1, n_features)]
+    return np.vstack([np.array(small), rows])
+
+
+class _Teacher:
+    """The exact model's decision values and probabilities (compiled if possible, else sklearn)"""
+
+    def __init__(self, model, scaler, features):
+        try:
+            self.compiled = compile_model_artifacts(model, scaler, features)
+        except Exception as e:
+            logger.warning(f"Distilling from sklearn, model could not be compiled: {str(e)}")
+            self.compiled = None
+        self.model = model
+        self.scaler = scaler
+        self.classes = model.classes_
+
+    def decision(self, feature_matrix: np.ndarray) -> np.ndarray:
+        if self.compiled is not None:
+            return self.compiled.decision_matrix(feature_matrix)
+        return self.model.decision_function(self.scaler.transform(feature_matrix))
+
+    def predict(self, feature_matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self.compiled is not None:
+            decision = self.compiled.decision_matrix(feature_matrix)
+            return decision, self.classes[(decision > 0).astype(int)], self.compiled.probability(decision)
+        scaled = self.scaler.transform(feature_matrix)
+        return (self.model.decision_function(scaled), self.model.predict(scaled),
+                self.model.predict_proba(scaled)[:, 1])
+
+
+def distill(model, scaler, features: List[str], fingerprint: str, pairs: bool = False,
+            n_samples: int = 200000, grid_size: int = 4097, ridge: float = 1e-8,
+            chunk_size: int = 1 << 16, seed: int = 0) -> FastModel:
+    """Fit the surrogate to the exact model's decision values over sampled symptom vectors"""
+    teacher = _Teacher(model, scaler, features)
+    n_features = len(features)
+    samples = sample_symptom_space(n_samples, n_features, seed)
+
+    # Normal equations accumulated per chunk, so the pairwise design never exists in full
+    gram = rhs = None
+    decision_range = [np.inf, -np.inf]
+    for start in range(0, len(samples), chunk_size):
+        chunk = samples[start:start + chunk_size]
+        target = teacher.decision(chunk)
+        design = _design_chunks(chunk, pairs)
+        gram = design.T @ design if gram is None else gram + design.T @ design
+        rhs = design.T @ target if rhs is None else rhs + design.T @ target
+        decision_range = [min(decision_range[0], target.min()), max(decision_range[1], target.max())]
+    coef = np.linalg.solve(gram + ridge * np.eye(len(gram)), rhs)
+
+    weights, intercept = coef[:n_features], coef[-1]
+    pair_weights = None
+    if pairs:
+        pair_weights = np.zeros((n_features, n_features))
+        pair_weights[np.triu_indices(n_features, k=1)] = coef[n_features:-1]
+
+    # Exact probabilities on a uniform grid a little wider than the decision values seen
+    low, high = decision_range
+    pad = 0.1 * (high - low) + 1.0
+    grid = np.linspace(low - pad, high + pad, grid_size)
+    if teacher.compiled is not None and teacher.compiled.has_probability:
+        grid_probability = teacher.compiled.probability(grid)
+    else:
+        decision, _, probability = teacher.predict(samples)
+        order = np.argsort(decision)
+        grid_probability = np.interp(grid, decision[order], probability[order])
+
+    return FastModel(weights, intercept, grid, grid_probability, teacher.classes, features, fingerprint,
+                     probability_margin=MIN_MARGIN, decision_margin=MIN_MARGIN, pair_weights=pair_weights)
+
+
+def _risk_codes(probability: np.ndarray) -> np.ndarray:
+    """0 / 1 / 2 for low / moderate / high, with the same >= comparisons as risk_level_for"""
+    return (probability >= MODERATE_RISK_THRESHOLD).astype(np.int8) + (probability >= HIGH_RISK_THRESHOLD)
+
+
+def fidelity_report(fast: FastModel, model, scaler, n_samples: int = 1000000, exhaustive: bool = False,
+                    safety: float = 1.5, chunk_size: int = 1 << 18, seed: int = 1) -> Dict[str, object]:
+    """Compare the surrogate with the exact model and set its fallback margins from the worst error seen.
+
+    The margins are ``safety`` times the largest probability and decision
+    errors, so on the evaluated inputs the fallback makes risk levels and
+    labels agree exactly. Per row only a few float32/bool summaries are
+    kept (about 14 bytes), so ``exhaustive`` works up to a few ten million
+    combinations.
+    """
+    teacher = _Teacher(model, scaler, fast.features)
+    n_features = len(fast.features)
+    if exhaustive:
+        chunks = (bitmasks_to_matrix(np.arange(start, min(start + chunk_size, 1 << n_features)), n_features)
+                  for start in range(0, 1 << n_features, chunk_size))
+    else:
+        samples = sample_symptom_space(n_samples, n_features, seed)
+        chunks = (samples[start:start + chunk_size] for start in range(0, len(samples), chunk_size))
+
+    parts = []
+    max_decision_error = 0.0
+    for chunk in chunks:
+        exact_decision, exact_label, exact_probability = teacher.predict(chunk)
+        decision = fast.decision_matrix(chunk)
+        probability = fast.probability(decision)
+        max_decision_error = max(max_decision_error, float(np.abs(decision - exact_decision).max()))
+        threshold_distance = np.min([np.abs(probability - t) for t in RISK_THRESHOLDS], axis=0)
+        parts.append((
+            np.abs(probability - exact_probability).astype(np.float32),
+            np.abs(decision).astype(np.float32),
+            threshold_distance.astype(np.float32),
+            _risk_codes(probability) == _risk_codes(exact_probability),
+            fast.classes[(decision > 0).astype(int)] == exact_label,
+        ))
+    probability_error, boundary_distance, threshold_distance, level_agrees, label_agrees = (
+        np.concatenate(p) for p in zip(*parts))
+
+    max_probability_error = float(probability_error.max())
+    fast.probability_margin = max(MIN_MARGIN, safety * max_probability_error)
+    fast.decision_margin = max(MIN_MARGIN, safety * max_decision_error)
+    fallback = (boundary_distance <= fast.decision_margin) | (threshold_distance <= fast.probability_margin)
+    served_error = np.where(fallback, 0.0, probability_error)
+
+    return {
+        "rows": int(len(probability_error)),
+        "exhaustive": exhaustive,
+        "max_probability_error": max_probability_error,
+        "mean_probability_error": float(probability_error.mean()),
+        "p99_probability_error": float(np.quantile(probability_error, 0.99)),
+        "max_decision_error": max_decision_error,
+        "risk_level_agreement": float(level_agrees.mean()),
+        "label_agreement": float(label_agrees.mean()),
+        "probability_margin": fast.probability_margin,
+        "decision_margin": fast.decision_margin,
+        "fallback_rate": float(fallback.mean()),
+        "risk_level_agreement_with_fallback": float((level_agrees | fallback).mean()),
+        "label_agreement_with_fallback": float((label_agrees | fallback).mean()),
+        "max_probability_error_with_fallback": float(served_error.max()),
+    }
+
+
+def benchmark(fast: FastModel, compiled, n_rows: int = 1000, seed: int = 2) -> Dict[str, float]:
+    """Per-row microseconds of exact and fast scoring, single rows and one batch"""
+    rows = sample_symptom_space(n_rows, len(fast.features), seed)[-n_rows:]
+    actives = [np.flatnonzero(row).tolist() for row in rows]
+    timings = {}
+    for name, single, batch in (
+        ("exact", compiled.predict_indices, compiled.predict_matrix),
+        ("fast", fast.predict_indices, fast.predict_matrix),
+    ):
+        started = time.perf_counter()
+        for active in actives:
+            single(active)
+        timings[f"{name}_single_us"] = (time.perf_counter() - started) / n_rows * 1e6
+        started = time.perf_counter()
+        batch(rows)
+        timings[f"{name}_batch_us_per_row"] = (time.perf_counter() - started) / n_rows * 1e6
+    return timings
+
+
+def save_fast_model(fast: FastModel, report: Dict[str, object], path: str, meta_path: str) -> None:
+    arrays = {
+        "weights": fast.weights,
+        "intercept": np.array(fast.intercept),
+        "grid": fast.grid,
+        "grid_probability": fast.grid_probability,
+        "classes": fast.classes,
+    }
+    if fast.pair_weights is not None:
+        arrays["pair_weights"] = fast.pair_weights
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    # The metadata is written last so a half-written model is never picked up
+    with open(meta_path, "w") as f:
+        json.dump({
+            "fingerprint": fast.fingerprint,
+            "features": fast.features,
+            "probability_margin": fast.probability_margin,
+            "decision_margin": fast.decision_margin,
+            "report": report,
+        }, f, indent=2)
+
+
+def load_fast_model(fingerprint: str, features: List[str], path: str, meta_path: str) -> Optional[FastModel]:
+    """Load the surrogate, or return None if it is missing or was distilled from other artifacts"""
+    if not (os.path.exists(path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get("fingerprint") != fingerprint or meta.get("features") != list(features):
+        logger.warning(f"Ignoring {path}: it was distilled from different model artifacts")
+        return None
+    with np.load(path) as arrays:
+        return FastModel(arrays["weights"], float(arrays["intercept"]), arrays["grid"], arrays["grid_probability"],
+                         arrays["classes"], features, fingerprint,
+                         probability_margin=meta["probability_margin"], decision_margin=meta["decision_margin"],
+                         pair_weights=arrays["pair_weights"] if "pair_weights" in arrays else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distil a fast approximate model and report its fidelity")
+    parser.add_argument("--model-dir", default=MODELS_DIR, help="directory holding the model pickles")
+    parser.add_argument("--pairs", action="store_true", help="add pairwise symptom interaction terms")
+    parser.add_argument("--samples", type=int, default=200000, help="training rows sampled from the symptom space")
+    parser.add_argument("--eval-samples", type=int, default=1000000, help="held-out rows for the fidelity report")
+    parser.add_argument("--exhaustive", action="store_true", help="evaluate on every symptom combination")
+    parser.add_argument("--safety", type=float, default=1.5, help="fallback margin as a multiple of the worst error")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    model, scaler, features = load_model_artifacts(args.model_dir)
+    fingerprint = artifact_fingerprint(artifact_paths(args.model_dir))
+    started = time.perf_counter()
+    fast = distill(model, scaler, features, fingerprint, pairs=args.pairs, n_samples=args.samples)
+    logger.info(f"Distilled in {time.perf_counter() - started:.1f}s")
+    report = fidelity_report(fast, model, scaler, n_samples=args.eval_samples, exhaustive=args.exhaustive,
+                             safety=args.safety)
+    try:
+        report["timing"] = benchmark(fast, compile_model_artifacts(model, scaler, features))
+    except Exception as e:
+        logger.warning(f"Skipping timing, model could not be compiled: {str(e)}")
+    save_fast_model(fast, report, os.path.join(args.model_dir, FAST_MODEL_FILE),
+                    os.path.join(args.model_dir, FAST_MODEL_META_FILE))
+    print(json.dumps(report, indent=2))
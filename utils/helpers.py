@@ -1,6 +1,9 @@
+import hashlib
 import joblib
+import os
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Sequence, Tuple
+from utils.compiled_model import CompiledSVM, compile_model_artifacts
 
 # Symptom mapping (user-facing → internal feature names)
 symptom_mapping = {
@@ -31,58 +34,250 @@ symptom_mapping = {
     "Loss of appetite": "loss_of_appetite"
 }
 
-def load_model_artifacts():
-    model = joblib.load("models/svm_model.pkl")          
-    scaler = joblib.load("models/svm_scaler.pkl")       
-    features = joblib.load("models/svm_features.pkl")
+# Stable wire IDs: a symptom's position in symptom_mapping. Only ever append to the mapping,
+# so existing IDs keep their meaning for clients that send IDs or ID bitmasks.
+SYMPTOM_IDS = {name: i for i, name in enumerate(symptom_mapping)}
+
+# Symptoms grouped by severity, in the order the app shows them
+SYMPTOM_GROUPS = {
+    "Common symptoms you may notice but often consider low impact": (
+        "Headaches",
+        "Nausea",
+        "Loss of appetite",
+        "Malaise/sickness",
+        "Decreased energy/exhaustion",
+        "Chronic fatigue"
+    ),
+    "Noticeable symptoms that are worth paying attention to": (
+        "Menstrual pain (Dysmenorrhea)",
+        "Painful period cramps",
+        "Painful ovulation",
+        "Chronic pain",
+        "Pelvic (or related) Pains",
+        "IBS-like symptoms",
+        "Abdominal cramps during intercourse",
+        "Cysts (unspecified)",
+        "Fever",
+        "Bowel pain"
+    ),
+    "Symptoms that are more serious and shouldn't be ignored": (
+        "Painful bowel movements",
+        "Infertility",
+        "Fertility issues",
+        "Severe pain",
+        "Ovarian cysts",
+        "Painful urination",
+        "Bleeding",
+        "Abnormal uterine bleeding",
+        "Irregular or missed periods"
+    )
+}
+
+# Probability cut-offs for the "high" and "moderate" risk levels
+HIGH_RISK_THRESHOLD = 0.7
+MODERATE_RISK_THRESHOLD = 0.4
+
+MODELS_DIR = "models"
+MODEL_FILE = "svm_model.pkl"
+SCALER_FILE = "svm_scaler.pkl"
+FEATURES_FILE = "svm_features.pkl"
+MODEL_PATH = os.path.join(MODELS_DIR, MODEL_FILE)
+SCALER_PATH = os.path.join(MODELS_DIR, SCALER_FILE)
+FEATURES_PATH = os.path.join(MODELS_DIR, FEATURES_FILE)
+ARTIFACT_PATHS = (MODEL_PATH, SCALER_PATH, FEATURES_PATH)
+
+def artifact_paths(model_dir: str = MODELS_DIR) -> Tuple[str, str, str]:
+    """Paths of the model, scaler and feature pickles in one artifact directory"""
+    return tuple(os.path.join(model_dir, name) for name in (MODEL_FILE, SCALER_FILE, FEATURES_FILE))
+
+def load_model_artifacts(model_dir: str = MODELS_DIR):
+    model_path, scaler_path, features_path = artifact_paths(model_dir)
+    model = joblib.load(model_path)
+    scaler = joblib.load(scaler_path)
+    features = joblib.load(features_path)
     return model, scaler, features
 
 
+def load_compiled_model(model_dir: str = MODELS_DIR) -> CompiledSVM:
+    """Load the artifacts and fold them into a NumPy evaluator verified against sklearn"""
+    model, scaler, features = load_model_artifacts(model_dir)
+    return compile_model_artifacts(model, scaler, features)
+
+
+def artifact_fingerprint(paths: Sequence[str] = ARTIFACT_PATHS) -> str:
+    """Return a SHA-256 digest identifying the exact bytes of the model artifacts"""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
 def map_symptoms_to_vector(user_symptoms: List[str], features: List[str]) -> np.ndarray:
     """Convert user symptoms into a feature vector (1 x N) in correct order"""
     selected = {symptom_mapping[s] for s in user_symptoms if s in symptom_mapping}
     return np.array([[1 if f in selected else 0 for f in features]], dtype=float)
 
 
+def symptoms_to_indices(user_symptoms: List[str], feature_index: Dict[str, int]) -> List[int]:
+    """Convert user symptoms into the sorted indices of their active features"""
+    selected = {symptom_mapping[s] for s in user_symptoms if s in symptom_mapping}
+    return sorted(feature_index[f] for f in selected if f in feature_index)
+
+
+def bitmasks_to_matrix(bitmasks: np.ndarray, n_features: int) -> np.ndarray:
+    """Expand integer bitmasks into a feature matrix (n x N), the inverse of SymptomCodec's encoding"""
+    bits = np.arange(n_features, dtype=np.int64)
+    return ((np.asarray(bitmasks, dtype=np.int64)[:, None] >> bits) & 1).astype(float)
+
+
+class SymptomCodec:
+    """Decodes wire-format symptoms into feature-order bitmasks for one feature list.
+
+    Clients send display names, stable IDs (``SYMPTOM_IDS``) or one integer
+    with bit ``id`` set per symptom. Each decode returns the feature bitmask
+    used by the model, cache and prediction table, together with the inputs
+    that matched no known symptom. Registered symptoms that the loaded model
+    doesn't use are accepted and contribute no bits.
+    """
+
+    def __init__(self, features: List[str]):
+        feature_index = {f: i for i, f in enumerate(features)}
+        self.n_features = len(features)
+        self.n_ids = len(SYMPTOM_IDS)
+        self.name_bits = {name: 1 << feature_index[f] if f in feature_index else 0
+                          for name, f in symptom_mapping.items()}
+        self.id_bits = [self.name_bits[name] for name in symptom_mapping]
+        # One 256-entry table per byte of an ID bitmask, so decoding is a few lookups
+        n_bytes = max(1, (self.n_ids + 7) // 8)
+        self.byte_tables = np.zeros((n_bytes, 256), dtype=np.int64)
+        for byte in range(n_bytes):
+            for value in range(256):
+                self.byte_tables[byte, value] = sum(
+                    self.id_bits[8 * byte + bit] for bit in range(8)
+                    if value >> bit & 1 and 8 * byte + bit < self.n_ids
+                )
+        self.valid_id_mask = (1 << self.n_ids) - 1
+
+    def from_names(self, names: List[str]) -> Tuple[int, List[str]]:
+        bitmask, unknown = 0, []
+        for name in names:
+            bits = self.name_bits.get(name)
+            if bits is None:
+                unknown.append(name)
+            else:
+                bitmask |= bits
+        return bitmask, unknown
+
+    def from_ids(self, ids: List[int]) -> Tuple[int, List[int]]:
+        bitmask, unknown = 0, []
+        for symptom_id in ids:
+            if 0 <= symptom_id < self.n_ids:
+                bitmask |= self.id_bits[symptom_id]
+            else:
+                unknown.append(symptom_id)
+        return bitmask, unknown
+
+    def from_id_bitmask(self, id_bitmask: int) -> Tuple[int, List[int]]:
+        if id_bitmask < 0:
+            raise ValueError("bitmask must not be negative")
+        extra = id_bitmask & ~self.valid_id_mask
+        unknown = [i for i in range(extra.bit_length()) if extra >> i & 1]
+        bitmask = 0
+        for byte in range(self.byte_tables.shape[0]):
+            bitmask |= int(self.byte_tables[byte, id_bitmask >> (8 * byte) & 0xFF])
+        return bitmask, unknown
+
+    def from_id_bitmasks(self, id_bitmasks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized ``from_id_bitmask`` for uint64 arrays; also returns a per-row unknown-bit flag"""
+        id_bitmasks = np.asarray(id_bitmasks, dtype="<u8")
+        as_bytes = id_bitmasks.view(np.uint8).reshape(-1, 8)
+        bitmasks = np.zeros(len(id_bitmasks), dtype=np.int64)
+        for byte in range(self.byte_tables.shape[0]):
+            bitmasks |= self.byte_tables[byte, as_bytes[:, byte]]
+        has_unknown = (id_bitmasks & np.uint64(~self.valid_id_mask & 0xFFFFFFFFFFFFFFFF)) != 0
+        return bitmasks, has_unknown
+
+    def indices(self, bitmask: int) -> List[int]:
+        """Sorted feature indices set in a feature bitmask"""
+        return [i for i in range(bitmask.bit_length()) if bitmask >> i & 1]
+
+
+def map_symptom_lists_to_matrix(symptom_lists: List[List[str]], features: List[str]) -> np.ndarray:
+    """Convert many symptom lists into a feature matrix (n x N) in correct order"""
+    index = {f: i for i, f in enumerate(features)}
+    matrix = np.zeros((len(symptom_lists), len(features)), dtype=float)
+    for row, user_symptoms in enumerate(symptom_lists):
+        for s in user_symptoms:
+            col = index.get(symptom_mapping.get(s))
+            if col is not None:
+                matrix[row, col] = 1
+    return matrix
+
+
+def feature_display_names(features: List[str]) -> List[str]:
+    """User-facing name of each feature, in feature order (the feature name if it has none)"""
+    display = {internal: name for name, internal in symptom_mapping.items()}
+    return [display.get(f, f) for f in features]
+
+
+def single_toggle_matrix(vector: np.ndarray) -> np.ndarray:
+    """Stack a (1 x N) vector with the N vectors that differ from it in exactly one feature.
+
+    Row 0 is the input; row i + 1 has feature i flipped.
+    """
+    row = vector.reshape(1, -1)
+    return np.vstack([row, np.logical_xor(row, np.eye(row.shape[1])).astype(row.dtype)])
+
+
+def risk_level_for(probability: float) -> str:
+    if probability >= HIGH_RISK_THRESHOLD:
+        return "high"
+    elif probability >= MODERATE_RISK_THRESHOLD:
+        return "moderate"
+    return "low"
+
+
+def prediction_message(probability: float) -> str:
+    return f"Based on your symptoms, there is a {probability:.1%} likelihood of endometriosis association."
+
+
+# Built once at import; get_educational_resources returns these shared dicts, so treat them as read-only
+EDUCATIONAL_RESOURCES = {
+    "high_risk": {
+        "title": "Based on your symptoms, you may be at higher risk for endometriosis",
+        "links": [
+            {"name": "Endometriosis Association", "url": "https://www.endometriosisassn.org/"},
+            {"name": "EndoFound - Endometriosis Foundation of America", "url": "https://www.endofound.org/"},
+            {"name": "ACOG - Endometriosis Information", "url": "https://www.acog.org/womens-health/faqs/endometriosis"},
+            {"name": "FPA Sri Lanka - End Silence Endometriosis", "url": "https://www.fpasrilanka.org/en/content/end-silence-endometriosis"},
+            {"name": "ACE 2025 - Asian Congress on Endometriosis", "url": "https://ace2025colombo.lk/"}
+        ],
+        "recommendation": "We recommend consulting with a healthcare provider who specializes in endometriosis for a comprehensive evaluation."
+    },
+    "moderate_risk": {
+        "title": "Some of your symptoms may be associated with endometriosis",
+        "links": [
+            {"name": "Endometriosis UK", "url": "https://www.endometriosis-uk.org/"},
+            {"name": "Mayo Clinic - Endometriosis Overview", "url": "https://www.mayoclinic.org/diseases-conditions/endometriosis/symptoms-causes/syc-20354656"},
+            {"name": "FPA Sri Lanka - End Silence Endometriosis", "url": "https://www.fpasrilanka.org/en/content/end-silence-endometriosis"},
+            {"name": "ACE 2025 - Asian Congress on Endometriosis", "url": "https://ace2025colombo.lk/"}
+        ],
+        "recommendation": "Consider discussing these symptoms with your healthcare provider to determine if further evaluation is needed."
+    },
+    "low_risk": {
+        "title": "Your symptoms show minimal association with endometriosis",
+        "links": [
+            {"name": "Women's Health.gov - Endometriosis", "url": "https://www.womenshealth.gov/a-z-topics/endometriosis"},
+            {"name": "General Women's Health Resources", "url": "https://www.healthywomen.org/"},
+            {"name": "FPA Sri Lanka - End Silence Endometriosis", "url": "https://www.fpasrilanka.org/en/content/end-silence-endometriosis"},
+            {"name": "ACE 2025 - Asian Congress on Endometriosis", "url": "https://ace2025colombo.lk/"}
+        ],
+        "recommendation": "If you're experiencing persistent symptoms, it's always a good idea to consult with a healthcare provider."
+    }
+}
+
+
 def get_educational_resources(probability: float) -> Dict[str, List[str]]:
     """Return appropriate educational resources based on prediction probability"""
-    resources = {
-        "high_risk": {
-            "title": "Based on your symptoms, you may be at higher risk for endometriosis",
-            "links": [
-                {"name": "Endometriosis Association", "url": "https://www.endometriosisassn.org/"},
-                {"name": "EndoFound - Endometriosis Foundation of America", "url": "https://www.endofound.org/"},
-                {"name": "ACOG - Endometriosis Information", "url": "https://www.acog.org/womens-health/faqs/endometriosis"},
-                {"name": "FPA Sri Lanka - End Silence Endometriosis", "url": "https://www.fpasrilanka.org/en/content/end-silence-endometriosis"},
-                {"name": "ACE 2025 - Asian Congress on Endometriosis", "url": "https://ace2025colombo.lk/"}
-            ],
-            "recommendation": "We recommend consulting with a healthcare provider who specializes in endometriosis for a comprehensive evaluation."
-        },
-        "moderate_risk": {
-            "title": "Some of your symptoms may be associated with endometriosis",
-            "links": [
-                {"name": "Endometriosis UK", "url": "https://www.endometriosis-uk.org/"},
-                {"name": "Mayo Clinic - Endometriosis Overview", "url": "https://www.mayoclinic.org/diseases-conditions/endometriosis/symptoms-causes/syc-20354656"},
-                {"name": "FPA Sri Lanka - End Silence Endometriosis", "url": "https://www.fpasrilanka.org/en/content/end-silence-endometriosis"},
-                {"name": "ACE 2025 - Asian Congress on Endometriosis", "url": "https://ace2025colombo.lk/"}
-            ],
-            "recommendation": "Consider discussing these symptoms with your healthcare provider to determine if further evaluation is needed."
-        },
-        "low_risk": {
-            "title": "Your symptoms show minimal association with endometriosis",
-            "links": [
-                {"name": "Women's Health.gov - Endometriosis", "url": "https://www.womenshealth.gov/a-z-topics/endometriosis"},
-                {"name": "General Women's Health Resources", "url": "https://www.healthywomen.org/"},
-                {"name": "FPA Sri Lanka - End Silence Endometriosis", "url": "https://www.fpasrilanka.org/en/content/end-silence-endometriosis"},
-                {"name": "ACE 2025 - Asian Congress on Endometriosis", "url": "https://ace2025colombo.lk/"}
-            ],
-            "recommendation": "If you're experiencing persistent symptoms, it's always a good idea to consult with a healthcare provider."
-        }
-    }
-    
-    if probability >= 0.7:
-        return resources["high_risk"]
-    elif probability >= 0.4:
-        return resources["moderate_risk"]
-    else:
-        return resources["low_risk"]
+    return EDUCATIONAL_RESOURCES[f"{risk_level_for(probability)}_risk"]
@@ -0,0 +1,125 @@
+"""HTTP-level caching and compression of prediction responses.
+
+A ``/predict`` result depends only on the feature bitmask (the canonical,
+order-independent symptom set), the model artifacts that scored it, and
+whether fast scoring applied. ``HttpCachePolicy.etag`` combines these into a
+strong entity tag:
+
+    "v<RESPONSE_FORMAT>-<fingerprint[:16]>-<exact|fast>-<feature bitmask, hex>"
+
+Requests that name the same symptoms in any order or format get the same tag.
+A request with no symptoms at all is tagged ``none``, since it gets a fixed
+answer rather than the model's score for an empty vector.
+When a new model version is swapped in, every tag changes. Unknown inputs,
+which the body echoes back, add a short hash of their own. Bump
+``RESPONSE_FORMAT`` whenever the wording or shape of a prediction response
+changes, so tags issued by older builds stop matching.
+
+``GET /predict/bitmask/{bitmask}`` is the cacheable form of ``/predict``. A
+request whose ``If-None-Match`` holds the current tag gets ``304`` after
+decoding the bitmask, without any scoring. Its responses carry ``Cache-Control:
+public, max-age=<max_age>``, so a reverse proxy can answer repeats itself
+(``POST /predict`` sends the ETag alone, so proxies don't store it). A
+``max_age`` of 0 sends ``no-cache`` instead: caches may store the response
+but must revalidate it every time.
+
+Batch responses of at least ``compress_min_bytes`` are gzipped for clients
+that send ``Accept-Encoding: gzip``. Small single predictions are never
+compressed, because the CPU cost would outweigh the bytes saved.
+"""
+import gzip
+import threading
+import zlib
+from typing import Dict, Optional, Sequence, Tuple
+
+# Part of every ETag; bump when prediction responses change for the same model and symptoms
+RESPONSE_FORMAT = 1
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches ``etag`` (weak comparison, as RFC 9110 requires for it)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether gzip is acceptable per an Accept-Encoding header (ignoring q-values other than 0)"""
+    if not accept_encoding:
+        return False
+    for coding in accept_encoding.lower().split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip() in ("gzip", "*"):
+            q = params.strip()
+            return not (q.startswith("q=") and float(q[2:] or 0) == 0)
+    return False
+
+
+class HttpCachePolicy:
+    def __init__(self, max_age: int = 300, compress_min_bytes: int = 4096, compress_level: int = 1):
+        self.max_age = max_age
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_level = compress_level
+        self.cache_control = f"public, max-age={max_age}" if max_age > 0 else "no-cache"
+
+        self.tagged = 0
+        self.not_modified = 0
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def etag(self, fingerprint: Optional[str], bitmask: Optional[int], fast: bool = False,
+             unknown: Sequence = ()) -> Optional[str]:
+        """Entity tag for a single prediction (``bitmask`` None: no symptoms given); None without a fingerprint"""
+        if not fingerprint:
+            return None
+        symptoms = "none" if bitmask is None else f"{bitmask:x}"
+        tag = f"v{RESPONSE_FORMAT}-{fingerprint[:16]}-{'fast' if fast else 'exact'}-{symptoms}"
+        if unknown:
+            tag += f"-{zlib.crc32(repr(list(unknown)).encode()):08x}"
+        self.tagged += 1
+        return f'"{tag}"'
+
+    def headers(self, etag: Optional[str]) -> Dict[str, str]:
+        if etag is None:
+            return {}
+        return {"ETag": etag, "Cache-Control": self.cache_control}
+
+    def count_not_modified(self) -> None:
+        self.not_modified += 1
+
+    def compress(self, body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Dict[str, str]]:
+        """``body`` gzipped if it is large enough and the client accepts it, with the headers to send"""
+        if self.compress_min_bytes <= 0:
+            return body, {}
+        if len(body) < self.compress_min_bytes or not accepts_gzip(accept_encoding):
+            return body, {"Vary": "Accept-Encoding"}
+        compressed = gzip.compress(body, compresslevel=self.compress_level, mtime=0)
+        with self._lock:
+            self.compressed += 1
+            self.bytes_in += len(body)
+            self.bytes_out += len(compressed)
+        return compressed, {"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "max_age": self.max_age,
+            "cache_control": self.cache_control,
+            "etags_issued": self.tagged,
+            "not_modified": self.not_modified,
+            "compress_min_bytes": self.compress_min_bytes,
+            "compressed_responses": self.compressed,
+            "compressed_bytes_in": self.bytes_in,
+            "compressed_bytes_out": self.bytes_out,
+            "compression_ratio": self.bytes_out / self.bytes_in if self.bytes_in else None,
+        }
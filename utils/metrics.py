@@ -0,0 +1,228 @@
+"""Low-overhead in-process metrics exposed in Prometheus text format.
+
+Histograms are fixed-bucket counters updated with one ``bisect`` per
+observation. Request handlers time their stages with a ``StageTimer``: each
+``mark(stage)`` records the time since the previous mark. The ASGI
+middleware records when a request arrived (so the handler can time request
+parsing) and when the response starts (so serialization after the handler
+returns is timed too).
+
+Set ``ENDODX_METRICS=0`` to turn instrumentation off; ``request_timer`` then
+returns a timer whose marks do nothing and the middleware passes requests
+straight through. Metrics are per process, so in pre-fork mode each worker
+reports its own.
+"""
+import bisect
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+ENABLED = os.getenv("ENDODX_METRICS", "1") != "0"
+
+LATENCY_BUCKETS = (
+    0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+_RECEIVED_AT = "endodx_received_at"
+_HANDLER_DONE_AT = "endodx_handler_done_at"
+_ENDPOINT = "endodx_endpoint"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bucket bound containing quantile q (inf if it falls past the last bucket)"""
+        if not self.count:
+            return 0.0
+        target, running = q * self.count, 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            running += count
+            if running >= target:
+                return bound
+        return float("inf")
+
+    def render(self, name: str, labels: Sequence[Tuple[str, str]] = ()) -> List[str]:
+        lines, running = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            lines.append(f"{name}_bucket{_format_labels(tuple(labels) + (('le', repr(bound)),))} {running}")
+        lines.append(f"{name}_bucket{_format_labels(tuple(labels) + (('le', '+Inf'),))} {self.count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{_format_labels(labels)} {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.stage_latency: Dict[Tuple[str, str], Histogram] = {}
+        self.request_latency: Dict[str, Histogram] = {}
+        self.predictions: Dict[Tuple[str, str], int] = {}
+        self.errors: Dict[str, int] = {}
+        self.info: Dict[str, str] = {}
+        self.collectors: List[Callable[[], Iterable[str]]] = []
+        self.overhead_per_mark = 0.0
+        self._lock = threading.Lock()
+
+    def observe_stage(self, endpoint: str, stage: str, seconds: float) -> None:
+        histogram = self.stage_latency.get((endpoint, stage))
+        if histogram is None:
+            with self._lock:
+                histogram = self.stage_latency.setdefault((endpoint, stage), Histogram())
+        histogram.observe(seconds)
+
+    def observe_request(self, endpoint: str, seconds: float) -> None:
+        histogram = self.request_latency.get(endpoint)
+        if histogram is None:
+            with self._lock:
+                histogram = self.request_latency.setdefault(endpoint, Histogram())
+        histogram.observe(seconds)
+
+    def count_prediction(self, endpoint: str, risk_level: str, n: int = 1) -> None:
+        key = (endpoint, risk_level)
+        self.predictions[key] = self.predictions.get(key, 0) + n
+
+    def count_error(self, endpoint: str) -> None:
+        self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def render(self) -> str:
+        lines = [
+            "# HELP endodx_model_info Loaded model artifacts",
+            "# TYPE endodx_model_info gauge",
+            f"endodx_model_info{_format_labels(tuple(sorted(self.info.items())))} 1",
+            "# HELP endodx_metrics_enabled Whether hot-path instrumentation is on",
+            "# TYPE endodx_metrics_enabled gauge",
+            f"endodx_metrics_enabled {int(ENABLED)}",
+            "# HELP endodx_instrumentation_overhead_seconds Measured cost of one stage mark",
+            "# TYPE endodx_instrumentation_overhead_seconds gauge",
+            f"endodx_instrumentation_overhead_seconds {self.overhead_per_mark}",
+            "# HELP endodx_stage_latency_seconds Time spent in each stage of a prediction request",
+            "# TYPE endodx_stage_latency_seconds histogram",
+        ]
+        for (endpoint, stage), histogram in sorted(self.stage_latency.items()):
+            lines += histogram.render("endodx_stage_latency_seconds", (("endpoint", endpoint), ("stage", stage)))
+        lines += [
+            "# HELP endodx_request_latency_seconds End-to-end request latency inside the server",
+            "# TYPE endodx_request_latency_seconds histogram",
+        ]
+        for endpoint, histogram in sorted(self.request_latency.items()):
+            lines += histogram.render("endodx_request_latency_seconds", (("endpoint", endpoint),))
+        lines += [
+            "# HELP endodx_predictions_total Predictions returned, by risk level",
+            "# TYPE endodx_predictions_total counter",
+        ]
+        for (endpoint, risk_level), count in sorted(self.predictions.items()):
+            lines.append(f"endodx_predictions_total{_format_labels((('endpoint', endpoint), ('risk_level', risk_level)))} {count}")
+        lines += [
+            "# HELP endodx_prediction_errors_total Requests that failed with a server error",
+            "# TYPE endodx_prediction_errors_total counter",
+        ]
+        for endpoint, count in sorted(self.errors.items()):
+            lines.append(f"endodx_prediction_errors_total{_format_labels((('endpoint', endpoint),))} {count}")
+        for collector in self.collectors:
+            lines += list(collector())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class StageTimer:
+    """Records the time between consecutive marks as per-stage latencies"""
+
+    __slots__ = ("endpoint", "scope", "last")
+
+    def __init__(self, endpoint: str, scope: dict, start: float):
+        self.endpoint = endpoint
+        self.scope = scope
+        self.last = start
+
+    def mark(self, stage: str) -> None:
+        now = time.perf_counter()
+        registry.observe_stage(self.endpoint, stage, now - self.last)
+        self.last = now
+
+    def finish(self) -> None:
+        """Called when the handler returns; serialization is timed from here"""
+        self.scope[_HANDLER_DONE_AT] = time.perf_counter()
+
+
+class _NullTimer:
+    def mark(self, stage: str) -> None:
+        pass
+
+    def finish(self) -> None:
+        pass
+
+
+# Stage timer that records nothing, for scoring done outside a request
+NULL_TIMER = _NullTimer()
+
+
+def request_timer(scope: dict, endpoint: str):
+    """Start timing a request's stages, recording request parsing as the first one"""
+    if not ENABLED:
+        return NULL_TIMER
+    scope[_ENDPOINT] = endpoint
+    timer = StageTimer(endpoint, scope, scope.get(_RECEIVED_AT, time.perf_counter()))
+    timer.mark("parse")
+    return timer
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timestamping requests and timing response serialization"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not ENABLED or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        received_at = time.perf_counter()
+        scope[_RECEIVED_AT] = received_at
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                endpoint = scope.get(_ENDPOINT)
+                if endpoint is not None:
+                    now = time.perf_counter()
+                    handler_done = scope.get(_HANDLER_DONE_AT)
+                    if handler_done is not None:
+                        registry.observe_stage(endpoint, "serialize", now - handler_done)
+                    registry.observe_request(endpoint, now - received_at)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def measure_overhead(iterations: int = 20000) -> float:
+    """Time StageTimer.mark against a scratch registry entry and record the per-mark cost"""
+    timer = StageTimer("_calibration", {}, time.perf_counter())
+    start = time.perf_counter()
+    for _ in range(iterations):
+        timer.mark("_calibration")
+    registry.overhead_per_mark = (time.perf_counter() - start) / iterations
+    del registry.stage_latency[("_calibration", "_calibration")]
+    return registry.overhead_per_mark
@@ -0,0 +1,139 @@
+"""In-process request coalescing for concurrent /predict traffic.
+
+Concurrent callers ``await batcher.submit(item)``. A single worker task takes
+the first queued item, keeps collecting until either ``max_batch_size`` items
+are queued or ``max_wait_ms`` has passed since that first item arrived, and
+then scores the whole batch in one call on a worker thread so the event loop
+stays free. Each caller's future is resolved with its own result.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+SHUTTING_DOWN = "Prediction service is shutting down"
+
+
+class BatchingStats:
+    """Running totals for batch sizes and queueing delay"""
+
+    def __init__(self, max_batch_size: int):
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.max_batch_seen = 0
+        self.queue_delay_total = 0.0
+        self.queue_delay_max = 0.0
+        # Power-of-two buckets: batch sizes 1, 2, 3-4, 5-8, ...
+        self.size_buckets: List[int] = [0] * (max(max_batch_size - 1, 1).bit_length() + 1)
+
+    def record(self, batch_size: int, queue_delays: Sequence[float]) -> None:
+        self.batches += 1
+        self.items += batch_size
+        self.max_batch_seen = max(self.max_batch_seen, batch_size)
+        self.queue_delay_total += sum(queue_delays)
+        self.queue_delay_max = max(self.queue_delay_max, max(queue_delays))
+        self.size_buckets[(batch_size - 1).bit_length()] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "errors": self.errors,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_seen,
+            "batch_size_histogram": {f"<={1 << i}": count for i, count in enumerate(self.size_buckets)},
+            "mean_queue_delay_ms": 1000 * self.queue_delay_total / self.items if self.items else 0.0,
+            "max_queue_delay_ms": 1000 * self.queue_delay_max,
+        }
+
+
+class MicroBatcher:
+    """Coalesces concurrent submissions into batched calls of ``score_batch``"""
+
+    def __init__(self, score_batch: Callable[[List[Any]], Sequence[Any]],
+                 max_batch_size: int = 64, max_wait_ms: float = 2.0):
+        self.score_batch = score_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = BatchingStats(max_batch_size)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError(SHUTTING_DOWN))
+
+    async def submit(self, item: Any) -> Any:
+        if self._worker is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self, batch: list) -> None:
+        """Fill ``batch`` in place, so entries taken off the queue stay visible if the worker is cancelled"""
+        batch.append(await self._queue.get())
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Anything that arrived while we were waking up rides along for free
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        batch: list = []
+        try:
+            while True:
+                batch = []
+                await self._collect(batch)
+                # Callers that gave up (client disconnects) don't need scoring
+                batch = [entry for entry in batch if not entry[1].done()]
+                if not batch:
+                    continue
+
+                dispatched = time.perf_counter()
+                self.stats.record(len(batch), [dispatched - enqueued for _, _, enqueued in batch])
+                items = [item for item, _, _ in batch]
+                try:
+                    results = await loop.run_in_executor(None, self.score_batch, items)
+                except Exception as e:
+                    self.stats.errors += 1
+                    logger.error(f"Batch scoring error: {str(e)}")
+                    for _, future, _ in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                for (_, future, _), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+        except asyncio.CancelledError:
+            # Entries already off the queue (being collected or scored) are out of stop()'s reach
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError(SHUTTING_DOWN))
+            raise
@@ -0,0 +1,451 @@
+"""Versioned model artifacts with background loading, warm-up and atomic swaps.
+
+Artifact versions live under the model directory (``ENDODX_MODEL_DIR``,
+default ``models``):
+
+    models/svm_model.pkl, svm_scaler.pkl, svm_features.pkl   version "base"
+    models/versions/<version>/svm_model.pkl, ...               version <version>
+    models/ACTIVE                                              optional pin
+
+Each version directory may also hold its own fast-start file
+(``python -m utils.fast_artifacts --model-dir ...``), prediction table and
+distilled fast model.
+The served version is the one named in ``ACTIVE`` if that file exists.
+Otherwise it is the version whose pickles were modified most recently, so
+deploying a retrained model means copying a new directory into
+``models/versions/`` (stage it under a dot-name and rename it into place).
+
+A watcher thread polls the directory. When the wanted version or its
+artifacts change, the watcher loads the version on its own thread, validates
+it, warms it up with synthetic requests and then replaces ``active`` with
+a single assignment. Requests take one reference to ``active`` and use it
+throughout, so they never mix two versions and are never blocked by a
+reload. A rollback writes ``ACTIVE``, so in pre-fork mode every worker's
+watcher converges on the same version.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.compiled_model import CompiledSVM, compile_model_artifacts
+from utils.fast_artifacts import FAST_ARTIFACT_FILE, load_fast_artifacts
+from utils.fast_model import FAST_MODEL_FILE, FAST_MODEL_META_FILE, FastModel, load_fast_model
+from utils.helpers import (
+    MODELS_DIR, SymptomCodec, artifact_fingerprint, artifact_paths, bitmasks_to_matrix, feature_display_names,
+    load_model_artifacts, symptom_mapping
+)
+from utils.prediction_table import TABLE_FILE, TABLE_META_FILE, PredictionTable, load_prediction_table
+
+logger = logging.getLogger(__name__)
+
+BASE_VERSION = "base"
+VERSIONS_DIR = "versions"
+ACTIVE_FILE = "ACTIVE"
+
+
+class ModelBundle:
+    """One loaded artifact version and everything derived from it"""
+
+    def __init__(self, version: str, path: str, fingerprint: str, artifact_format: str, features: List[str],
+                 model=None, scaler=None, compiled: Optional[CompiledSVM] = None,
+                 prediction_table: Optional[PredictionTable] = None, fast_model: Optional[FastModel] = None):
+        self.version = version
+        self.path = path
+        self.fingerprint = fingerprint
+        self.artifact_format = artifact_format
+        self.features = features
+        self.model = model
+        self.scaler = scaler
+        self.compiled = compiled
+        self.prediction_table = prediction_table
+        self.fast_model = fast_model
+        self.codec = SymptomCodec(features)
+        self.feature_names = feature_display_names(features)
+        self.loaded_at = time.time()
+
+    @property
+    def scorer(self) -> str:
+        if self.prediction_table is not None:
+            return "table"
+        return "compiled" if self.compiled is not None else "sklearn"
+
+    def score_matrix(self, feature_matrix: np.ndarray, fast: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Score an (n x N) feature matrix with one scaler pass and one model pass.
+
+        With ``fast``, the distilled model scores the rows (unless the exact
+        table is available) and only rows near a risk threshold or the
+        decision boundary are rescored exactly.
+        """
+        if fast and self.fast_model is not None and self.prediction_table is None:
+            preds, probas, uncertain = self.fast_model.predict_matrix(feature_matrix)
+            if uncertain.any():
+                preds[uncertain], probas[uncertain] = self.score_matrix(feature_matrix[uncertain])
+            return preds, probas
+        if self.prediction_table is not None:
+            bitmasks = feature_matrix.astype(np.int64) @ (1 << np.arange(len(self.features), dtype=np.int64))
+            return self.prediction_table.lookup_many(bitmasks)
+        if self.compiled is not None:
+            return self.compiled.predict_matrix(feature_matrix)
+
+        scaled = self.scaler.transform(feature_matrix)
+        preds = self.model.predict(scaled)
+        probas = (self.model.predict_proba(scaled)[:, 1]
+                  if hasattr(self.model, "predict_proba")
+                  else self.model.decision_function(scaled))
+        return preds, probas
+
+    def describe(self) -> Dict[str, object]:
+        return {
+            "version": self.version,
+            "fingerprint": self.fingerprint,
+            "artifact_format": self.artifact_format,
+            "scorer": self.scorer,
+            "fast_model": self.fast_model is not None,
+            "n_features": len(self.features),
+            "loaded_at": self.loaded_at,
+        }
+
+
+def load_bundle(version: str, path: str, use_fast_artifacts: bool = True,
+                use_prediction_table: bool = True, use_fast_model: bool = True) -> ModelBundle:
+    """Load one version directory: fast-start file if it matches the pickles, else joblib plus compilation"""
+    pickles = artifact_paths(path)
+    fingerprint = artifact_fingerprint(pickles) if all(os.path.exists(p) for p in pickles) else None
+    model = scaler = compiled = None
+    artifact_format = None
+
+    fast_path = os.path.join(path, FAST_ARTIFACT_FILE)
+    if use_fast_artifacts and os.path.exists(fast_path):
+        try:
+            # Only trust the file if it was exported from the pickles sitting next to it
+            compiled, fingerprint = load_fast_artifacts(fast_path, expected_fingerprint=fingerprint)
+            features = compiled.features
+            artifact_format = "fast-start"
+        except ValueError as e:
+            logger.warning(f"Ignoring {fast_path}: {str(e)}")
+    if compiled is None:
+        model, scaler, features = load_model_artifacts(path)
+        artifact_format = "joblib"
+        # Fused NumPy evaluator; sklearn stays as the fallback if compilation or verification fails
+        try:
+            compiled = compile_model_artifacts(model, scaler, features)
+        except Exception as e:
+            logger.warning(f"Failed to compile model {version}, using sklearn: {str(e)}")
+
+    prediction_table = None
+    if use_prediction_table:
+        try:
+            prediction_table = load_prediction_table(fingerprint, features, os.path.join(path, TABLE_FILE),
+                                                     os.path.join(path, TABLE_META_FILE))
+        except Exception as e:
+            logger.warning(f"Failed to load prediction table for {version}, using live model: {str(e)}")
+
+    fast_model = None
+    if use_fast_model:
+        try:
+            fast_model = load_fast_model(fingerprint, features, os.path.join(path, FAST_MODEL_FILE),
+                                         os.path.join(path, FAST_MODEL_META_FILE))
+        except Exception as e:
+            logger.warning(f"Failed to load fast model for {version}, fast mode will score exactly: {str(e)}")
+
+    return ModelBundle(version, path, fingerprint, artifact_format, list(features), model, scaler,
+                       compiled, prediction_table, fast_model)
+
+
+def validate_bundle(bundle: ModelBundle, n_probe: int = 256, seed: int = 0) -> None:
+    """Raise ValueError unless the bundle scores random inputs sanely"""
+    known = set(symptom_mapping.values())
+    if not any(f in known for f in bundle.features):
+        raise ValueError("none of the model's features is a known symptom")
+    unknown = [f for f in bundle.features if f not in known]
+    if unknown:
+        logger.warning(f"Model {bundle.version} has features with no symptom mapping: {unknown}")
+
+    rng = np.random.default_rng(seed)
+    matrix = (rng.random((n_probe, len(bundle.features))) < 0.3).astype(float)
+    preds, probas = bundle.score_matrix(matrix)
+    probas = np.asarray(probas, dtype=float)
+    if len(preds) != n_probe or len(probas) != n_probe:
+        raise ValueError("model returned the wrong number of predictions")
+    if not np.all(np.isfinite(probas)) or probas.min() < 0 or probas.max() > 1:
+        raise ValueError("model returned probabilities outside [0, 1]")
+    if not set(np.unique(preds).tolist()) <= {0, 1}:
+        raise ValueError(f"model returned unexpected classes {np.unique(preds).tolist()}")
+
+
+def warm_up(bundle: ModelBundle, n_requests: int = 200, seed: int = 1) -> float:
+    """Run synthetic single and batch requests through every scoring path; returns seconds taken"""
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    n_features = len(bundle.features)
+    bitmasks = rng.integers(1, 1 << n_features, size=n_requests, dtype=np.int64)
+    for bitmask in bitmasks:
+        bitmask = int(bitmask)
+        if bundle.prediction_table is not None:
+            bundle.prediction_table.lookup(bitmask)
+        if bundle.compiled is not None:
+            bundle.compiled.predict_indices(bundle.codec.indices(bitmask))
+        if bundle.fast_model is not None:
+            bundle.fast_model.predict_indices(bundle.codec.indices(bitmask))
+    bundle.score_matrix(bitmasks_to_matrix(bitmasks, n_features))
+    if bundle.fast_model is not None:
+        bundle.score_matrix(bitmasks_to_matrix(bitmasks, n_features), fast=True)
+        # Warm-up traffic shouldn't show up in the fallback rate
+        bundle.fast_model.fast_rows = bundle.fast_model.fallback_rows = 0
+    return time.perf_counter() - started
+
+
+class ModelRegistry:
+    def __init__(self, model_dir: str = MODELS_DIR, poll_interval: float = 5.0, history: int = 3,
+                 use_fast_artifacts: bool = True, use_prediction_table: bool = True,
+                 use_fast_model: bool = True, warm_up_requests: int = 200):
+        self.model_dir = model_dir
+        self.poll_interval = poll_interval
+        self.use_fast_artifacts = use_fast_artifacts
+        self.use_prediction_table = use_prediction_table
+        self.use_fast_model = use_fast_model
+        self.warm_up_requests = warm_up_requests
+        self.active: Optional[ModelBundle] = None
+        # Recently replaced bundles, kept loaded so rolling back to them is instant
+        self.history: "deque[ModelBundle]" = deque(maxlen=history)
+        self.listeners: List[Callable[[ModelBundle], None]] = []
+        self.swaps = 0
+        self.last_error: Optional[str] = None
+        self._failed: Dict[str, str] = {}
+        self._signatures: Dict[str, Tuple] = {}
+        self._load_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    # Discovery
+
+    def versions(self) -> Dict[str, str]:
+        """Map every version with a complete set of pickles (or a fast-start file) to its directory"""
+        found = {}
+        candidates = [(BASE_VERSION, self.model_dir)]
+        versions_dir = os.path.join(self.model_dir, VERSIONS_DIR)
+        if os.path.isdir(versions_dir):
+            # Dot-directories are skipped so a version can be staged there and renamed into place
+            candidates += [(name, os.path.join(versions_dir, name)) for name in sorted(os.listdir(versions_dir))
+                           if not name.startswith(".")]
+        for version, path in candidates:
+            if (all(os.path.exists(p) for p in artifact_paths(path))
+                    or os.path.exists(os.path.join(path, FAST_ARTIFACT_FILE))):
+                found[version] = path
+        return found
+
+    def _signature(self, path: str) -> Tuple:
+        files = artifact_paths(path) + tuple(
+            os.path.join(path, name) for name in (FAST_ARTIFACT_FILE, TABLE_META_FILE, FAST_MODEL_META_FILE))
+        signature = []
+        for f in files:
+            try:
+                st = os.stat(f)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def pinned_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.model_dir, ACTIVE_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def wanted_version(self) -> Optional[str]:
+        """The pinned version if there is one, else the most recently modified"""
+        versions = self.versions()
+        pinned = self.pinned_version()
+        if pinned is not None:
+            if pinned in versions:
+                return pinned
+            logger.warning(f"{ACTIVE_FILE} names unknown model version {pinned!r}; ignoring it")
+        if not versions:
+            return None
+
+        def modified(version):
+            times = [os.path.getmtime(p) for p in artifact_paths(versions[version]) if os.path.exists(p)]
+            return max(times, default=0.0), version
+        return max(versions, key=modified)
+
+    # Loading and swapping
+
+    def load(self, version: str) -> ModelBundle:
+        """Load, validate and warm up a version without making it active"""
+        path = self.versions().get(version)
+        if path is None:
+            raise KeyError(f"Unknown model version {version!r}")
+        started = time.perf_counter()
+        bundle = load_bundle(version, path, self.use_fast_artifacts, self.use_prediction_table,
+                             self.use_fast_model)
+        validate_bundle(bundle)
+        warm_seconds = warm_up(bundle, self.warm_up_requests)
+        logger.info(f"Loaded model {version} ({bundle.artifact_format}, {bundle.scorer}) in "
+                    f"{(time.perf_counter() - started) * 1000:.1f} ms, warm-up {warm_seconds * 1000:.1f} ms")
+        return bundle
+
+    def activate(self, version: str, persist: bool = False) -> ModelBundle:
+        """Make a version active, reusing a loaded bundle when its artifacts are unchanged"""
+        with self._load_lock:
+            path = self.versions().get(version)
+            if path is None:
+                raise KeyError(f"Unknown model version {version!r}")
+            signature = self._signature(path)
+            bundle = None
+            for candidate in ([self.active] if self.active else []) + list(self.history):
+                if candidate.version == version and self._signatures.get(version) == signature:
+                    bundle = candidate
+                    break
+            if bundle is None:
+                bundle = self.load(version)
+                self._signatures[version] = signature
+            if persist:
+                self._write_pin(version)
+            self._swap(bundle)
+            return bundle
+
+    def _swap(self, bundle: ModelBundle) -> None:
+        previous = self.active
+        if previous is bundle:
+            return
+        if bundle in self.history:
+            self.history.remove(bundle)
+        if previous is not None:
+            self.history.appendleft(previous)
+        self.active = bundle
+        self.swaps += 1
+        self.last_error = None
+        if previous is not None:
+            logger.info(f"Now serving model {bundle.version} (was {previous.version})")
+        for listener in self.listeners:
+            listener(bundle)
+
+    def _write_pin(self, version: str) -> None:
+        path = os.path.join(self.model_dir, ACTIVE_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(version + "\n")
+        os.replace(tmp_path, path)
+
+    def rollback(self, version: Optional[str] = None) -> ModelBundle:
+        """Serve ``version`` (default: the previously active one) and pin it for all workers"""
+        if version is None:
+            current = self.active.version if self.active else None
+            previous = [bundle.version for bundle in self.history if bundle.version != current]
+            if not previous:
+                raise KeyError("No previous model version to roll back to")
+            version = previous[0]
+        return self.activate(version, persist=True)
+
+    def unpin(self) -> None:
+        """Remove the pin so the most recently modified version is served again"""
+        try:
+            os.remove(os.path.join(self.model_dir, ACTIVE_FILE))
+        except FileNotFoundError:
+            pass
+
+    def check(self) -> Optional[ModelBundle]:
+        """Swap in the wanted version if it differs from the active one; returns the new bundle if swapped"""
+        version = self.wanted_version()
+        if version is None:
+            return None
+        signature = self._signature(self.versions()[version])
+        if (self.active is not None and self.active.version == version
+                and self._signatures.get(version) == signature):
+            return None
+        failure_key = f"{version}:{signature}"
+        if failure_key in self._failed:
+            return None
+        try:
+            return self.activate(version)
+        except Exception as e:
+            self._failed[failure_key] = str(e)
+            self.last_error = f"{version}: {str(e)}"
+            logger.error(f"Failed to load model {version}, keeping {self.active.version if self.active else None}: "
+                         f"{str(e)}")
+            return None
+
+    def load_initial(self) -> ModelBundle:
+        """Synchronously activate the wanted version, falling back to the others if it fails"""
+        wanted = self.wanted_version()
+        if wanted is None:
+            raise FileNotFoundError(f"No model artifacts found in {self.model_dir}")
+        candidates = [wanted] + [v for v in self.versions() if v != wanted]
+        errors = []
+        for version in candidates:
+            try:
+                return self.activate(version)
+            except Exception as e:
+                errors.append(f"{version}: {str(e)}")
+                logger.error(f"Failed to load model {version}: {str(e)}")
+        raise RuntimeError("No loadable model version: " + "; ".join(errors))
+
+    # Watcher
+
+    def start_watcher(self) -> None:
+        if self.poll_interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="model-registry-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self) -> None:
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+            self._watcher = None
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Model watcher error: {str(e)}")
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "active": self.active.describe() if self.active else None,
+            "pinned": self.pinned_version(),
+            "available": sorted(self.versions()),
+            "loaded_history": [bundle.describe() for bundle in self.history],
+            "swaps": self.swaps,
+            "last_error": self.last_error,
+            "poll_interval": self.poll_interval,
+        }
+
+
+MODEL_VERSION_HEADER = b"x-model-version"
+_MODEL_VERSION = "endodx_model_version"
+
+
+def mark_serving_version(scope: dict, bundle: ModelBundle) -> None:
+    """Record which version served a request so the middleware can report it"""
+    scope[_MODEL_VERSION] = bundle.version
+
+
+class ModelVersionMiddleware:
+    """Pure ASGI middleware adding an X-Model-Version header to responses served by a model"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                version = scope.get(_MODEL_VERSION)
+                if version is not None:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (MODEL_VERSION_HEADER, version.encode("latin-1"))
+                    ]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,66 @@
+"""Bounded LRU cache of predictions keyed by symptom bitmask.
+
+The bitmask (``utils.helpers.SymptomCodec``) is order-independent and
+ignores unknown symptoms, so every request that the model sees as the same
+input shares one entry. Entries belong to one set of model artifacts: a
+lookup made with a different artifact fingerprint clears the cache first.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class PredictionCache:
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.fingerprint: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[int, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_fingerprint(self, fingerprint: str) -> None:
+        if fingerprint != self.fingerprint:
+            if self.fingerprint is not None:
+                self.invalidations += 1
+            self._entries.clear()
+            self.fingerprint = fingerprint
+
+    def get(self, fingerprint: str, bitmask: int) -> Optional[Tuple[int, float]]:
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            value = self._entries.get(bitmask)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(bitmask)
+            self.hits += 1
+            return value
+
+    def put(self, fingerprint: str, bitmask: int, value: Tuple[int, float]) -> None:
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            self._entries[bitmask] = value
+            self._entries.move_to_end(bitmask)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "fingerprint": self.fingerprint,
+        }
@@ -0,0 +1,133 @@
+"""Precomputed prediction table over every symptom bitmask.
+
+Every request is one of 2^len(features) binary vectors, so the whole input
+space can be scored offline and served with a single indexed read. Row i of
+the table holds the prediction for the bitmask i (see
+``utils.helpers.SymptomCodec``).
+
+Build it with:
+
+    python -m utils.prediction_table [--model-dir models/versions/<version>]
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from utils.compiled_model import compile_model_artifacts
+from utils.helpers import MODELS_DIR, artifact_fingerprint, artifact_paths, bitmasks_to_matrix, load_model_artifacts
+
+logger = logging.getLogger(__name__)
+
+TABLE_FILE = "svm_table.npy"
+TABLE_META_FILE = "svm_table.json"
+TABLE_PATH = os.path.join(MODELS_DIR, TABLE_FILE)
+TABLE_META_PATH = os.path.join(MODELS_DIR, TABLE_META_FILE)
+
+# 2^28 rows x 5 bytes is already ~1.3 GB; beyond this the table stops being worth it
+MAX_TABLE_FEATURES = 28
+
+TABLE_DTYPE = np.dtype([("probability", "<f4"), ("prediction", "u1")])
+
+
+class PredictionTable:
+    """Memory-mapped lookup of (prediction, probability) by symptom bitmask"""
+
+    def __init__(self, rows: np.ndarray, fingerprint: str):
+        self.rows = rows
+        self.fingerprint = fingerprint
+
+    def lookup(self, bitmask: int) -> Tuple[int, float]:
+        row = self.rows[bitmask]
+        return int(row["prediction"]), float(row["probability"])
+
+    def lookup_many(self, bitmasks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rows = self.rows[bitmasks]
+        return rows["prediction"].astype(int), rows["probability"].astype(float)
+
+
+def build_prediction_table(model, scaler, features: List[str], fingerprint: str,
+                           path: str = TABLE_PATH, meta_path: str = TABLE_META_PATH,
+                           chunk_size: int = 1 << 20) -> None:
+    """Score every symptom combination in chunks and write the table to disk"""
+    n_features = len(features)
+    if n_features > MAX_TABLE_FEATURES:
+        raise ValueError(f"Too many features for a prediction table: {n_features} (maximum {MAX_TABLE_FEATURES})")
+    # The table is served in place of the svm_* artifacts, which are always a kernel SVC
+    if not hasattr(model, "support_vectors_"):
+        raise ValueError(f"A prediction table requires a kernel SVC model, got {type(model).__name__}")
+
+    try:
+        compiled = compile_model_artifacts(model, scaler, features)
+    except ValueError as e:
+        logger.warning(f"Scoring with sklearn, model could not be compiled: {str(e)}")
+        compiled = None
+
+    n_rows = 1 << n_features
+    tmp_path = path + ".tmp"
+    rows = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=TABLE_DTYPE, shape=(n_rows,))
+
+    start_time = time.perf_counter()
+    for start in range(0, n_rows, chunk_size):
+        stop = min(start + chunk_size, n_rows)
+        chunk = bitmasks_to_matrix(np.arange(start, stop), n_features)
+        if compiled is not None:
+            preds, probas = compiled.predict_matrix(chunk)
+        else:
+            scaled = scaler.transform(chunk)
+            preds = model.predict(scaled)
+            probas = (model.predict_proba(scaled)[:, 1]
+                      if hasattr(model, "predict_proba")
+                      else model.decision_function(scaled))
+        rows["prediction"][start:stop] = preds
+        rows["probability"][start:stop] = probas
+        logger.info(f"Scored {stop}/{n_rows} combinations")
+
+    rows.flush()
+    del rows
+    os.replace(tmp_path, path)
+
+    # The metadata is written last so a half-built table is never picked up
+    with open(meta_path, "w") as f:
+        json.dump({"fingerprint": fingerprint, "features": list(features), "rows": n_rows}, f)
+    logger.info(f"Wrote {n_rows} rows to {path} in {time.perf_counter() - start_time:.1f}s")
+
+
+def load_prediction_table(fingerprint: str, features: List[str],
+                          path: str = TABLE_PATH, meta_path: str = TABLE_META_PATH) -> Optional[PredictionTable]:
+    """Map the table into memory, or return None if it is missing or stale"""
+    if not (os.path.exists(path) and os.path.exists(meta_path)):
+        return None
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get("fingerprint") != fingerprint or meta.get("features") != list(features):
+        logger.warning(f"Ignoring {path}: it was built from different model artifacts")
+        return None
+
+    rows = np.load(path, mmap_mode="r")
+    if rows.dtype != TABLE_DTYPE or rows.shape != (1 << len(features),):
+        logger.warning(f"Ignoring {path}: unexpected layout {rows.dtype} {rows.shape}")
+        return None
+    return PredictionTable(rows, fingerprint)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute predictions for every symptom combination")
+    parser.add_argument("--chunk-size", type=int, default=1 << 20)
+    parser.add_argument("--model-dir", default=MODELS_DIR, help="directory holding the model pickles")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    model, scaler, features = load_model_artifacts(args.model_dir)
+    try:
+        build_prediction_table(model, scaler, features, artifact_fingerprint(artifact_paths(args.model_dir)),
+                               path=os.path.join(args.model_dir, TABLE_FILE),
+                               meta_path=os.path.join(args.model_dir, TABLE_META_FILE),
+                               chunk_size=args.chunk_size)
+    except ValueError as e:
+        parser.exit(1, f"error: {str(e)}\n")
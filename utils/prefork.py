@@ -0,0 +1,171 @@
+"""Pre-fork multi-process serving for the FastAPI app.
+
+The parent process imports the app (and so loads the model artifacts), binds
+the listening socket and then forks the workers. Each worker runs its own
+uvicorn server on the inherited socket, and the model pages stay shared
+copy-on-write with the parent instead of being loaded once per worker.
+
+The parent restarts workers that exit, whether they crashed or retired after
+``max_requests``. On SIGHUP it recycles them one at a time, waiting for each
+replacement to be ready, or to have failed its self-check, first. On
+SIGTERM/SIGINT it stops them all gracefully. Worker state lives in a small
+shared-memory board so any worker can report all of them from ``/health``.
+"""
+import logging
+import mmap
+import os
+import signal
+import socket
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# "unready": started but failing its readiness self-check (utils/readiness.py)
+WORKER_STATES = ("empty", "starting", "ready", "stopping", "unready")
+_STATUS_DTYPE = np.dtype([("pid", "<i8"), ("state", "<i4"), ("generation", "<i4"), ("started", "<f8")])
+
+
+class WorkerStatusBoard:
+    """Per-worker status slots in anonymous shared memory, created before forking"""
+
+    def __init__(self, n_workers: int):
+        self._buffer = mmap.mmap(-1, n_workers * _STATUS_DTYPE.itemsize)
+        self.slots = np.frombuffer(self._buffer, dtype=_STATUS_DTYPE)
+
+    def set(self, slot: int, state: str, pid: Optional[int] = None) -> None:
+        if pid is not None:
+            self.slots[slot]["pid"] = pid
+            self.slots[slot]["generation"] += 1
+            self.slots[slot]["started"] = time.time()
+        self.slots[slot]["state"] = WORKER_STATES.index(state)
+
+    def state(self, slot: int) -> str:
+        return WORKER_STATES[self.slots[slot]["state"]]
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "worker": slot,
+                "pid": int(row["pid"]),
+                "state": WORKER_STATES[row["state"]],
+                "ready": WORKER_STATES[row["state"]] == "ready",
+                "generation": int(row["generation"]),
+                "uptime_s": round(time.time() - row["started"], 1) if row["pid"] else 0.0,
+            }
+            for slot, row in enumerate(self.slots)
+        ]
+
+
+# Set in each forked worker; None when running as a single process
+status_board: Optional[WorkerStatusBoard] = None
+worker_slot: Optional[int] = None
+
+
+def mark_worker(state: str) -> None:
+    """Record this worker's state on the shared board (no-op outside pre-fork mode)"""
+    if status_board is not None and worker_slot is not None:
+        status_board.set(worker_slot, state)
+
+
+def worker_health() -> Optional[Dict[str, Any]]:
+    if status_board is None:
+        return None
+    return {"worker": worker_slot, "workers": status_board.snapshot()}
+
+
+def _bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, slot: int, max_requests: Optional[int],
+                graceful_timeout: int) -> None:
+    import uvicorn
+
+    global worker_slot
+    worker_slot = slot
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(sig, signal.SIG_DFL)
+
+    config = uvicorn.Config(app, limit_max_requests=max_requests,
+                            timeout_graceful_shutdown=graceful_timeout)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(app, host: str = "0.0.0.0", port: int = 8000, workers: int = 2,
+          max_requests: Optional[int] = None, graceful_timeout: int = 30, backlog: int = 2048) -> None:
+    """Fork ``workers`` uvicorn servers sharing one socket and supervise them"""
+    global status_board
+
+    sock = _bind_socket(host, port, backlog)
+    status_board = WorkerStatusBoard(workers)
+    children: Dict[int, int] = {}  # pid -> slot
+    stopping = False
+    recycle_queue: List[int] = []
+
+    def spawn(slot: int) -> None:
+        status_board.set(slot, "starting", pid=0)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(app, sock, slot, max_requests, graceful_timeout)
+            finally:
+                os._exit(0)
+        status_board.slots[slot]["pid"] = pid
+        children[pid] = slot
+
+    def handle_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    def handle_reload(signum, frame):
+        logger.info("Recycling workers")
+        recycle_queue[:] = sorted(children.values())
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    signal.signal(signal.SIGHUP, handle_reload)
+
+    for slot in range(workers):
+        spawn(slot)
+    logger.info(f"Serving on {host}:{port} with {workers} workers (parent pid {os.getpid()})")
+
+    recycling: Optional[int] = None
+    while children:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid:
+            slot = children.pop(pid)
+            status_board.set(slot, "empty")
+            if not stopping:
+                code = os.waitstatus_to_exitcode(status)
+                if code != 0:
+                    logger.warning(f"Worker {slot} (pid {pid}) exited with code {code}, restarting")
+                elif slot != recycling:
+                    logger.info(f"Worker {slot} (pid {pid}) retired, restarting")
+                spawn(slot)
+            continue
+
+        # Roll through the queue one worker at a time, keeping the rest serving. A replacement that
+        # failed its self-check won't become ready by itself, so don't hold the rest of the queue for it
+        if recycling is not None and status_board.state(recycling) in ("ready", "unready"):
+            if status_board.state(recycling) == "unready":
+                logger.warning(f"Worker {recycling} came back unready, recycling the next one anyway")
+            recycling = None
+        if recycling is None and recycle_queue and not stopping:
+            recycling = recycle_queue.pop(0)
+            victim = next(pid for pid, slot in children.items() if slot == recycling)
+            status_board.set(recycling, "stopping")
+            os.kill(victim, signal.SIGTERM)
+        time.sleep(0.1)
+
+    sock.close()
+    logger.info("All workers stopped")
@@ -0,0 +1,370 @@
+"""On-demand sampled profiling of the live API.
+
+Off unless ``ENDODX_PROFILING=1``. When off, no middleware or background task
+is installed, so requests pay nothing. When on, an admin opens a profiling
+window of a few seconds or minutes. While it is open, a random ``fraction``
+of ``/predict*`` requests run under cProfile. With ``trace_memory``,
+tracemalloc also records allocations for the whole window. When the window
+closes, each worker writes its results to the profile directory:
+
+    <window>-<pid>.pstats   cProfile stats of the sampled requests (if any)
+    <window>-<pid>.json     sample counts and the tracemalloc hot spots
+
+``merged_stats`` and ``report`` combine every worker's files for a window.
+
+Workers coordinate through ``window.json`` in the same directory. The worker
+that handles a start or stop call applies it at once. The others pick it up
+within ``poll_interval`` seconds, and every worker closes the window by
+itself when its time is up. Results from workers sharing the directory are
+therefore merged, whichever worker served the admin calls.
+
+The profiler is enabled only while the sampled request's own coroutine is
+running. Other requests interleaved on the event loop are not counted
+against it, and neither is work the handler hands to the thread pool.
+tracemalloc, by contrast, slows every allocation in the process while it
+runs, so keep memory windows short.
+"""
+import asyncio
+import cProfile
+import glob
+import json
+import logging
+import os
+import pstats
+import random
+import tempfile
+import time
+import tracemalloc
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+WINDOW_FILE = "window.json"
+KEEP_WINDOWS = 10
+SORT_KEYS = ("cumulative", "tottime", "calls")
+
+
+class _Profiled:
+    """Awaitable that drives a coroutine, enabling ``profile`` only while the coroutine itself runs"""
+
+    def __init__(self, coro, profile: cProfile.Profile):
+        self.coro = coro
+        self.profile = profile
+
+    def __await__(self):
+        value, error = None, None
+        while True:
+            self.profile.enable()
+            try:
+                if error is not None:
+                    yielded = self.coro.throw(error)
+                else:
+                    yielded = self.coro.send(value)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                self.profile.disable()
+            try:
+                value, error = (yield yielded), None
+            except BaseException as e:
+                value, error = None, e
+
+
+class Profiler:
+    def __init__(self, directory: str, poll_interval: float = 1.0, max_seconds: float = 300.0,
+                 trace_frames: int = 10, top: int = 30):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.max_seconds = max_seconds
+        self.trace_frames = trace_frames
+        self.top = top
+
+        self.window: Optional[Dict[str, Any]] = None
+        self.sampled = 0
+        self.unsampled = 0
+        self._profile: Optional[cProfile.Profile] = None
+        self._memory_baseline: Optional[tracemalloc.Snapshot] = None
+        self._window_mtime: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def window_path(self) -> str:
+        return os.path.join(self.directory, WINDOW_FILE)
+
+    # Request path
+
+    def wrap(self, coro):
+        """``coro`` unchanged, or wrapped to run under the window's profiler if this request is sampled"""
+        window = self.window
+        if window is None:
+            return coro
+        if time.time() >= window["until"] or random.random() >= window["fraction"]:
+            self.unsampled += 1
+            return coro
+        self.sampled += 1
+        return _Profiled(coro, self._profile)
+
+    # Window control
+
+    def start_window(self, seconds: float, fraction: float = 0.1, trace_memory: bool = False) -> Dict[str, Any]:
+        if not 0 < seconds <= self.max_seconds:
+            raise ValueError(f"seconds must be between 0 and {self.max_seconds:g}")
+        if not 0 < fraction <= 1:
+            raise ValueError("fraction must be above 0 and at most 1")
+        now = time.time()
+        current = self.window or self._read_window()
+        if current is not None and current["until"] > now:
+            raise ValueError(f"Profiling window {current['id']} is still open")
+        window = {
+            "id": f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(now))}-{uuid.uuid4().hex[:6]}",
+            "started": now,
+            "until": now + seconds,
+            "fraction": fraction,
+            "trace_memory": trace_memory,
+        }
+        self._prune()
+        self._write_window(window)
+        self._open(window)
+        return window
+
+    def stop_window(self) -> Optional[Dict[str, Any]]:
+        """Close the open window early, in every worker"""
+        window = self.window or self._read_window()
+        if window is None or window["until"] <= time.time():
+            return None
+        window = {**window, "until": time.time()}
+        self._write_window(window)
+        self.sync()
+        return window
+
+    def sync(self) -> None:
+        """Follow window.json: open a window another worker started, close ours when it ends"""
+        if self.window is not None and time.time() >= self.window["until"]:
+            self._close()
+        try:
+            mtime = os.stat(self.window_path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._window_mtime:
+            return
+        self._window_mtime = mtime
+        window = self._read_window()
+        if window is None:
+            return
+        if self.window is not None and self.window["id"] == window["id"]:
+            self.window["until"] = window["until"]
+            if time.time() >= window["until"]:
+                self._close()
+        elif self.window is None and time.time() < window["until"] and not self._has_results(window["id"]):
+            self._open(window)
+
+    def _open(self, window: Dict[str, Any]) -> None:
+        self.window = dict(window)
+        self.sampled = self.unsampled = 0
+        self._profile = cProfile.Profile()
+        if window["trace_memory"] and not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+            self._memory_baseline = tracemalloc.take_snapshot()
+        logger.info(f"Profiling window {window['id']} open for {window['until'] - time.time():.0f}s, "
+                    f"sampling {window['fraction']:.0%} of requests")
+
+    def _close(self) -> None:
+        window, profile = self.window, self._profile
+        self.window, self._profile = None, None
+        prefix = os.path.join(self.directory, f"{window['id']}-{os.getpid()}")
+        result = {
+            "window": window,
+            "pid": os.getpid(),
+            "closed": time.time(),
+            "sampled": self.sampled,
+            "unsampled": self.unsampled,
+            "memory": self._memory_report(),
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if self.sampled:
+                profile.dump_stats(prefix + ".pstats")
+            with open(prefix + ".json", "w") as f:
+                json.dump(result, f)
+        except OSError as e:
+            logger.error(f"Failed to write profiling results for window {window['id']}: {str(e)}")
+        logger.info(f"Profiling window {window['id']} closed, {self.sampled} requests sampled")
+
+    def _memory_report(self) -> Optional[Dict[str, Any]]:
+        if self._memory_baseline is None:
+            return None
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"))
+        snapshot = snapshot.filter_traces(ignore)
+        growth = snapshot.compare_to(self._memory_baseline.filter_traces(ignore), "lineno")
+        self._memory_baseline = None
+        return {
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "top_sizes": [_stat_entry(stat) for stat in snapshot.statistics("lineno")[:self.top]],
+            "top_growth": [_stat_entry(stat) for stat in growth[:self.top] if stat.size_diff > 0],
+        }
+
+    def _write_window(self, window: Dict[str, Any]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        staging = f"{self.window_path}.{os.getpid()}.tmp"
+        with open(staging, "w") as f:
+            json.dump(window, f)
+        os.replace(staging, self.window_path)
+
+    def _read_window(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.window_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _has_results(self, window_id: str) -> bool:
+        return os.path.exists(os.path.join(self.directory, f"{window_id}-{os.getpid()}.json"))
+
+    def _prune(self) -> None:
+        for window_id in self.windows()[:-KEEP_WINDOWS + 1]:
+            for path in glob.glob(os.path.join(self.directory, f"{window_id}-*")):
+                os.remove(path)
+
+    # Background sync
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.window is not None:
+            self._close()
+
+    async def _run(self) -> None:
+        # Runs on the event loop, so windows never open or close in the middle of a profiled step
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Profiler sync error: {str(e)}")
+
+    # Results
+
+    def windows(self) -> List[str]:
+        """IDs of windows with results on disk, oldest first"""
+        ids = {os.path.basename(path).rsplit("-", 1)[0] for path in glob.glob(os.path.join(self.directory, "*-*.json"))}
+        return sorted(ids)
+
+    def _resolve(self, window_id: Optional[str]) -> str:
+        windows = self.windows()
+        if window_id is None:
+            if not windows:
+                raise KeyError("No profiling results yet")
+            return windows[-1]
+        if window_id not in windows:
+            raise KeyError(f"No profiling results for window {window_id!r}")
+        return window_id
+
+    def worker_results(self, window_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        window_id = self._resolve(window_id)
+        results = []
+        for path in sorted(glob.glob(os.path.join(self.directory, f"{window_id}-*.json"))):
+            with open(path) as f:
+                results.append(json.load(f))
+        return results
+
+    def merged_stats(self, window_id: Optional[str] = None) -> Optional[pstats.Stats]:
+        """All workers' cProfile stats for a window, or None if no request was sampled"""
+        paths = sorted(glob.glob(os.path.join(self.directory, f"{self._resolve(window_id)}-*.pstats")))
+        return pstats.Stats(*paths) if paths else None
+
+    def pstats_bytes(self, window_id: Optional[str] = None) -> Optional[bytes]:
+        """Merged stats in the marshal format ``pstats``/``snakeviz`` load"""
+        stats = self.merged_stats(window_id)
+        if stats is None:
+            return None
+        with tempfile.NamedTemporaryFile(suffix=".pstats") as f:
+            stats.dump_stats(f.name)
+            return f.read()
+
+    def report(self, window_id: Optional[str] = None, top: Optional[int] = None,
+               sort: str = "cumulative") -> Dict[str, Any]:
+        """Sample counts, hottest functions and memory hot spots across workers, as JSON"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {SORT_KEYS}")
+        top = top or self.top
+        window_id = self._resolve(window_id)
+        workers = self.worker_results(window_id)
+        stats = self.merged_stats(window_id)
+        functions = []
+        if stats is not None:
+            field = {"cumulative": 3, "tottime": 2, "calls": 1}[sort]
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][field], reverse=True)[:top]
+            functions = [
+                {"function": f"{filename}:{line}({name})", "calls": calls, "primitive_calls": primitive,
+                 "tottime": tottime, "cumtime": cumtime, "percall_ms": 1000 * cumtime / calls if calls else 0.0}
+                for (filename, line, name), (primitive, calls, tottime, cumtime, _) in rows
+            ]
+        return {
+            "window": workers[0]["window"] if workers else {"id": window_id},
+            "workers": [{key: w[key] for key in ("pid", "sampled", "unsampled", "closed")} for w in workers],
+            "sampled": sum(w["sampled"] for w in workers),
+            "total_seconds": stats.total_tt if stats is not None else 0.0,
+            "functions": functions,
+            "memory": _merge_memory([w["memory"] for w in workers if w.get("memory")], top),
+        }
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": True,
+            "directory": self.directory,
+            "window": self.window,
+            "sampled": self.sampled,
+            "unsampled": self.unsampled,
+            "max_seconds": self.max_seconds,
+            "results": self.windows(),
+        }
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware running sampled requests under the profiler"""
+
+    def __init__(self, app, profiler: Profiler, paths: Sequence[str] = ("/predict",)):
+        self.app = app
+        self.profiler = profiler
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope, receive, send):
+        if self.profiler.window is None or scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            return await self.app(scope, receive, send)
+        await self.profiler.wrap(self.app(scope, receive, send))
+
+
+def _stat_entry(stat) -> Dict[str, Any]:
+    frame = stat.traceback[0]
+    entry = {"location": f"{frame.filename}:{frame.lineno}", "size": stat.size, "count": stat.count}
+    if isinstance(stat, tracemalloc.StatisticDiff):
+        entry.update(size_diff=stat.size_diff, count_diff=stat.count_diff)
+    return entry
+
+
+def _merge_memory(reports: List[Dict[str, Any]], top: int) -> Optional[Dict[str, Any]]:
+    """Sum tracemalloc hot spots across workers by source line"""
+    if not reports:
+        return None
+    merged = {"traced_bytes": sum(r["traced_bytes"] for r in reports),
+              "peak_bytes": max(r["peak_bytes"] for r in reports)}
+    for key, order in (("top_sizes", "size"), ("top_growth", "size_diff")):
+        totals: Dict[str, Dict[str, Any]] = {}
+        for report in reports:
+            for entry in report[key]:
+                total = totals.setdefault(entry["location"], {"location": entry["location"]})
+                for field, value in entry.items():
+                    if field != "location":
+                        total[field] = total.get(field, 0) + value
+        merged[key] = sorted(totals.values(), key=lambda e: e[order], reverse=True)[:top]
+    return merged
@@ -0,0 +1,175 @@
+"""Startup self-check behind the readiness probe.
+
+Loading the artifacts is not enough to serve quickly: the first calls into
+sklearn, NumPy and pydantic still pay one-off costs. Before a worker reports
+ready, ``SelfCheck.run``:
+
+1. warms up by pushing ``warm_up_rows`` synthetic symptom vectors through
+   the scaler and model, in one batch and row by row
+2. times ``single_requests`` synthetic single requests and ``batches``
+   batches of ``batch_size`` rows through the API's own scoring code
+3. compares the measured p99s with the budgets. A budget of 0 is not
+   enforced, but the latency is still measured and reported
+
+A worker whose latencies exceed a budget stays unready and re-runs the check
+every ``recheck_interval`` seconds, so a transient slowdown at startup (a
+noisy neighbour, a cold page cache) doesn't keep it out of rotation forever.
+Such a worker may already be accepting connections, so the model and batch
+work runs in the default executor, and the event loop is released between
+single requests. A recheck then doesn't stall the requests it is serving.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from utils.helpers import bitmasks_to_matrix
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+SingleFn = Callable[[Any, int], Awaitable[object]]
+BatchFn = Callable[[Any, np.ndarray], object]
+
+
+def _latency_summary(seconds: List[float]) -> Dict[str, float]:
+    ms = np.asarray(seconds) * 1000
+    return {
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "samples": len(ms),
+    }
+
+
+class SelfCheck:
+    def __init__(self, single_p99_budget_ms: float = 0.0, batch_p99_budget_ms: float = 0.0,
+                 warm_up_rows: int = 1000, single_requests: int = 500, batch_size: int = 100, batches: int = 20,
+                 recheck_interval: float = 30.0, seed: int = 7):
+        self.single_p99_budget_ms = single_p99_budget_ms
+        self.batch_p99_budget_ms = batch_p99_budget_ms
+        self.warm_up_rows = warm_up_rows
+        self.single_requests = single_requests
+        self.batch_size = batch_size
+        self.batches = batches
+        self.recheck_interval = recheck_interval
+        self.seed = seed
+
+        self.state = STARTING
+        self.checked_at: Optional[float] = None
+        self.runs = 0
+        self.failures: List[str] = []
+        self.results: Dict[str, Any] = {}
+        self._recheck: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    async def run(self, bundle, score_single: SingleFn, score_batch: BatchFn) -> bool:
+        """Warm up and benchmark ``bundle``; returns whether the worker is ready"""
+        self.state = WARMING
+        self.runs += 1
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        rng = np.random.default_rng(self.seed + self.runs)
+        n_features = len(bundle.features)
+
+        bitmasks = rng.integers(1, 1 << n_features, size=self.warm_up_rows, dtype=np.int64)
+        await loop.run_in_executor(None, self._warm_up_model, bundle, bitmasks, score_batch)
+        for bitmask in bitmasks[:min(100, len(bitmasks))].tolist():
+            await score_single(bundle, bitmask)
+            await asyncio.sleep(0)
+        warm_up_seconds = time.perf_counter() - started
+
+        single = []
+        for bitmask in rng.integers(1, 1 << n_features, size=self.single_requests, dtype=np.int64).tolist():
+            t = time.perf_counter()
+            await score_single(bundle, bitmask)
+            single.append(time.perf_counter() - t)
+            await asyncio.sleep(0)
+        batch_rows = [rng.integers(1, 1 << n_features, size=self.batch_size, dtype=np.int64)
+                      for _ in range(self.batches)]
+        batch = await loop.run_in_executor(None, self._time_batches, bundle, batch_rows, score_batch)
+
+        self.results = {
+            "model_version": bundle.version,
+            "scorer": bundle.scorer,
+            "warm_up_ms": warm_up_seconds * 1000,
+            "single": _latency_summary(single),
+            "batch": {**_latency_summary(batch), "batch_size": self.batch_size},
+        }
+        self.failures = []
+        for name, budget in (("single", self.single_p99_budget_ms), ("batch", self.batch_p99_budget_ms)):
+            p99 = self.results[name]["p99_ms"]
+            if budget > 0 and p99 > budget:
+                self.failures.append(f"{name} p99 {p99:.2f} ms exceeds budget {budget:g} ms")
+        self.checked_at = time.time()
+        self.state = FAILED if self.failures else READY
+        return self.ready
+
+    @staticmethod
+    def _warm_up_model(bundle, bitmasks: np.ndarray, score_batch: BatchFn) -> None:
+        """The sklearn pipeline itself, whatever scorer the bundle serves with, then the batch path"""
+        feature_matrix = bitmasks_to_matrix(bitmasks, len(bundle.features))
+        if bundle.scaler is not None and bundle.model is not None:
+            scaled = bundle.scaler.transform(feature_matrix)
+            bundle.model.predict(scaled)
+            if hasattr(bundle.model, "predict_proba"):
+                bundle.model.predict_proba(scaled)
+            for row in feature_matrix[:20]:
+                bundle.model.predict(bundle.scaler.transform(row.reshape(1, -1)))
+        score_batch(bundle, bitmasks)
+
+    @staticmethod
+    def _time_batches(bundle, batch_rows: List[np.ndarray], score_batch: BatchFn) -> List[float]:
+        seconds = []
+        for rows in batch_rows:
+            t = time.perf_counter()
+            score_batch(bundle, rows)
+            seconds.append(time.perf_counter() - t)
+        return seconds
+
+    def start_rechecks(self, bundle_fn: Callable[[], Any], score_single: SingleFn, score_batch: BatchFn,
+                       on_ready: Optional[Callable[[], None]] = None) -> None:
+        """While failed, re-run the check every ``recheck_interval`` seconds until it passes"""
+        if self.ready or self.recheck_interval <= 0 or self._recheck is not None:
+            return
+
+        async def recheck():
+            while not self.ready:
+                await asyncio.sleep(self.recheck_interval)
+                try:
+                    if await self.run(bundle_fn(), score_single, score_batch):
+                        logger.info(f"Self-check passed on retry {self.runs - 1}")
+                        if on_ready is not None:
+                            on_ready()
+                except Exception as e:
+                    self.state = FAILED
+                    self.failures = [f"self-check error: {str(e)}"]
+                    logger.error(f"Self-check error: {str(e)}")
+            self._recheck = None
+
+        self._recheck = asyncio.get_running_loop().create_task(recheck())
+
+    def stop(self) -> None:
+        if self._recheck is not None:
+            self._recheck.cancel()
+            self._recheck = None
+
+    def payload(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "state": self.state,
+            "checked_at": self.checked_at,
+            "runs": self.runs,
+            "failures": self.failures,
+            "budgets_ms": {"single_p99": self.single_p99_budget_ms, "batch_p99": self.batch_p99_budget_ms},
+            **self.results,
+        }
@@ -0,0 +1,390 @@
+"""Offline retraining and evaluation on a local symptom CSV.
+
+    python -m utils.retrain data.csv --target endometriosis --jobs 4
+    python -m utils.retrain data.csv --models svm logreg rf mlp xgboost --output models/versions/2024-06
+
+Each input column is one symptom (0/1). Headers may be the app's display
+names or the feature names (``"Pelvic (or related) Pains"`` -> ``pelvic_pain``);
+other columns are snake_cased and dropped unless they are the target. The pipeline follows the study's methodology:
+
+1. load: read and binarise the CSV, keeping the symptoms the app can ask for
+2. search: per model, a grid search over feature selection (chi-square or
+   RFE with a model-specific ranker, several k) and hyperparameters,
+   scored by stratified 5-fold CV
+3. evaluate: nested CV (the whole search repeated inside each outer fold)
+   reporting F1, AUC, MCC, specificity and accuracy
+4. export: refit the exported model with probabilities and write
+   ``svm_model.pkl``, ``svm_scaler.pkl`` and ``svm_features.pkl`` (the
+   layout ``load_model_artifacts`` reads) plus ``report.json``. Only the SVC
+   is exported, since the compiled scorer, fast-start file and prediction
+   table all assume one; ``--export best`` picks the best exportable model
+   and the other models are compared in the report only
+
+CV folds and grid points run across ``--jobs`` processes. Feature rankings
+are computed once per training fold and cached in ``--cache-dir``
+(``joblib.Memory``), so every k and hyperparameter on a fold shares one
+ranking, and a rerun on the same data and folds skips the RFE fits. The output directory is
+written under a dot-name and renamed into place, so the model registry never
+sees a half-written version. Wall-clock time per stage goes into the report.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_selection import RFE, SelectorMixin, chi2
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import make_scorer, matthews_corrcoef, recall_score
+from sklearn.model_selection import GridSearchCV, StratifiedKFold, cross_validate
+from sklearn.neural_network import MLPClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC, LinearSVC
+
+from utils.helpers import artifact_fingerprint, artifact_paths, symptom_mapping
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = ".retrain_cache"
+REPORT_FILE = "report.json"
+
+SELECTORS = ("chi2", "rfe")
+
+SCORING = {
+    "f1": "f1",
+    "auc": "roc_auc",
+    "mcc": make_scorer(matthews_corrcoef),
+    "specificity": make_scorer(recall_score, pos_label=0),
+    "accuracy": "accuracy",
+}
+
+DEFAULT_K = (10, 15, 20, "all")
+
+
+class StageTimer:
+    """Wall-clock seconds per named pipeline stage"""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        logger.info(f"Stage {name}...")
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - started
+            logger.info(f"Stage {name} took {self.seconds[name]:.1f}s")
+
+
+def _normalise(name: str) -> str:
+    return "_".join(re.sub(r"[^0-9a-zA-Z\s_]", " ", str(name)).lower().split())
+
+
+# Display names and feature names both map to the feature, whatever their punctuation and case
+_KNOWN_COLUMNS = {**{_normalise(display): feature for display, feature in symptom_mapping.items()},
+                  **{_normalise(feature): feature for feature in symptom_mapping.values()}}
+
+
+def normalise_column(name: str) -> str:
+    """Feature name for a CSV header: ``"Pelvic (or related) Pains"`` -> ``pelvic_pain``, otherwise snake_case"""
+    normalised = _normalise(name)
+    return _KNOWN_COLUMNS.get(normalised, normalised)
+
+
+def load_dataset(path: str, target: str, known_only: bool = True,
+                 drop: Tuple[str, ...] = ()) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Read a CSV into a binary feature matrix, 0/1 labels and feature names"""
+    frame = pd.read_csv(path)
+    frame.columns = [normalise_column(c) for c in frame.columns]
+    target = normalise_column(target)
+    if target not in frame.columns:
+        raise ValueError(f"Target column {target!r} not found; columns are {list(frame.columns)}")
+
+    labels = frame.pop(target)
+    if labels.dtype == object:
+        labels = labels.astype(str).str.strip().str.lower().map({"1": 1, "yes": 1, "true": 1, "positive": 1,
+                                                                 "0": 0, "no": 0, "false": 0, "negative": 0})
+    if labels.isna().any() or not set(labels.unique()) <= {0, 1}:
+        raise ValueError(f"Target column {target!r} must be binary (0/1 or yes/no)")
+
+    frame = frame.drop(columns=[normalise_column(c) for c in drop if normalise_column(c) in frame.columns])
+    if known_only:
+        known = set(symptom_mapping.values())
+        unknown = [c for c in frame.columns if c not in known]
+        if unknown:
+            logger.warning(f"Dropping {len(unknown)} columns the app can't ask about: {unknown}")
+        frame = frame[[c for c in frame.columns if c in known]]
+    if frame.shape[1] == 0:
+        raise ValueError("No feature columns left to train on")
+
+    values = frame.apply(pd.to_numeric, errors="coerce").fillna(0)
+    if not values.isin([0, 1]).all().all():
+        logger.warning("Non-binary feature values found; treating every value > 0 as present")
+    return (values.to_numpy() > 0).astype(float), labels.to_numpy().astype(int), list(frame.columns)
+
+
+# Models whose fitted estimator is an SVC, the only kind the svm_* artifact tooling handles
+EXPORTABLE_MODELS = ("svm",)
+
+
+def candidate_models(names: List[str], seed: int) -> Dict[str, Tuple[object, Dict[str, list], Optional[object]]]:
+    """(estimator, hyperparameter grid, RFE ranker or None) per requested model"""
+    candidates = {
+        "svm": (SVC(random_state=seed),
+                {"C": [0.1, 0.3, 1.0, 3.0, 10.0], "kernel": ["linear", "rbf"]},
+                LinearSVC(dual=False, random_state=seed)),
+        "logreg": (LogisticRegression(max_iter=1000, random_state=seed),
+                   {"C": [0.1, 1.0, 10.0]},
+                   LogisticRegression(max_iter=1000, random_state=seed)),
+        "rf": (RandomForestClassifier(random_state=seed),
+               {"n_estimators": [200], "max_depth": [None, 8], "min_samples_leaf": [1, 3]},
+               RandomForestClassifier(n_estimators=100, random_state=seed)),
+        "mlp": (MLPClassifier(max_iter=1000, early_stopping=True, random_state=seed),
+                {"hidden_layer_sizes": [(32,), (64, 32)], "alpha": [1e-4, 1e-2]},
+                None),
+    }
+    if "xgboost" in names:
+        try:
+            from xgboost import XGBClassifier
+            candidates["xgboost"] = (
+                XGBClassifier(eval_metric="logloss", random_state=seed, n_jobs=1),
+                {"n_estimators": [200], "max_depth": [3, 5], "learning_rate": [0.05, 0.2]},
+                XGBClassifier(eval_metric="logloss", random_state=seed, n_jobs=1),
+            )
+        except ImportError:
+            logger.warning("xgboost is not installed; skipping it")
+    unknown = [n for n in names if n not in candidates and n != "xgboost"]
+    if unknown:
+        raise ValueError(f"Unknown models {unknown}; choose from svm, logreg, rf, mlp, xgboost")
+    return {n: candidates[n] for n in names if n in candidates}
+
+
+def rank_features(method: str, ranker, X: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Feature indices, best first, by chi-square score or by RFE elimination order"""
+    if method == "chi2":
+        scores = np.nan_to_num(chi2(X, y)[0], nan=-1.0)
+        return np.argsort(-scores, kind="stable")
+    # Eliminating down to one feature gives the full order; its top k is exactly what RFE(k) keeps
+    ranking = RFE(clone(ranker), n_features_to_select=1).fit(X, y).ranking_
+    return np.argsort(ranking, kind="stable")
+
+
+_rankers: Dict[Optional[str], object] = {}
+
+
+def _cached_rank_features(cache_dir: Optional[str]):
+    ranker = _rankers.get(cache_dir)
+    if ranker is None:
+        ranker = _rankers[cache_dir] = joblib.Memory(cache_dir, verbose=0).cache(rank_features)
+    return ranker
+
+
+class RankedSelector(SelectorMixin, BaseEstimator):
+    """Keeps the ``k`` best-ranked features
+
+    The ranking depends only on the training rows, so it is computed once per
+    CV fold and shared by every k and model hyperparameter tried on that fold.
+    With ``cache_dir`` set, rankings are also stored on disk for later runs.
+    """
+
+    def __init__(self, method: str = "chi2", k: int = 10, ranker=None, cache_dir: Optional[str] = None):
+        self.method = method
+        self.k = k
+        self.ranker = ranker
+        self.cache_dir = cache_dir
+
+    def fit(self, X, y):
+        if self.method not in SELECTORS:
+            raise ValueError(f"Unknown selection method {self.method!r}; choose from {SELECTORS}")
+        self.ranking_ = _cached_rank_features(self.cache_dir)(self.method, self.ranker, np.asarray(X), np.asarray(y))
+        self.n_features_in_ = len(self.ranking_)
+        return self
+
+    def _get_support_mask(self):
+        mask = np.zeros(len(self.ranking_), dtype=bool)
+        mask[self.ranking_[:self.k]] = True
+        return mask
+
+
+def build_search(estimator, grid: Dict[str, list], ranker, n_features: int, k_values, cv, jobs: int,
+                 cache_dir: Optional[str], refit: str) -> GridSearchCV:
+    """Grid search over selection method x k x model hyperparameters for one model type"""
+    pipeline = Pipeline([("select", RankedSelector(ranker=ranker, cache_dir=cache_dir)),
+                         ("scaler", StandardScaler()), ("model", estimator)])
+    ks = sorted({n_features if k == "all" else min(int(k), n_features) for k in k_values})
+    model_grid = {f"model__{name}": values for name, values in grid.items()}
+    param_grid = [{"select__method": ["chi2"], "select__k": ks, **model_grid}]
+    rfe_ks = [k for k in ks if k < n_features]
+    if ranker is not None and rfe_ks:
+        param_grid.append({"select__method": ["rfe"], "select__k": rfe_ks, **model_grid})
+    return GridSearchCV(pipeline, param_grid, scoring=SCORING, refit=refit, cv=cv, n_jobs=jobs)
+
+
+def _summary(scores: Dict[str, np.ndarray]) -> Dict[str, Dict[str, float]]:
+    return {metric: {"mean": float(np.mean(scores[f"test_{metric}"])), "std": float(np.std(scores[f"test_{metric}"]))}
+            for metric in SCORING}
+
+
+def _describe_params(params: Dict[str, object]) -> Dict[str, object]:
+    return {name: value if isinstance(value, (int, float, str, bool, type(None))) else str(value)
+            for name, value in params.items()}
+
+
+def selected_features(pipeline: Pipeline, features: List[str]) -> List[str]:
+    mask = pipeline.named_steps["select"].get_support()
+    return [f for f, keep in zip(features, mask) if keep]
+
+
+def write_artifacts(pipeline: Pipeline, features: List[str], output: str, report: Dict[str, object]) -> None:
+    """Write the pickles load_model_artifacts reads, plus the report, then rename into place"""
+    parent, name = os.path.split(os.path.normpath(output))
+    staging = os.path.join(parent, f".{name}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    model_path, scaler_path, features_path = artifact_paths(staging)
+    joblib.dump(pipeline.named_steps["model"], model_path)
+    joblib.dump(pipeline.named_steps["scaler"], scaler_path)
+    joblib.dump(selected_features(pipeline, features), features_path)
+    report["fingerprint"] = artifact_fingerprint(artifact_paths(staging))
+    with open(os.path.join(staging, REPORT_FILE), "w") as f:
+        json.dump(report, f, indent=2)
+    if os.path.exists(output):
+        shutil.rmtree(output)
+    os.replace(staging, output)
+
+
+def retrain(data: str, target: str, output: str, models: List[str], jobs: int = -1, folds: int = 5,
+            k_values=DEFAULT_K, refit: str = "f1", export: str = "svm", cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+            nested: bool = True, drop: Tuple[str, ...] = (), seed: int = 42) -> Dict[str, object]:
+    if export != "best" and export not in EXPORTABLE_MODELS:
+        raise ValueError(f"Cannot export {export!r}: only {list(EXPORTABLE_MODELS)} produce svm_* artifacts")
+    if export != "best" and export not in models:
+        raise ValueError(f"Cannot export {export!r}: it is not among the models to train ({models})")
+    if export == "best" and not set(models) & set(EXPORTABLE_MODELS):
+        raise ValueError(f"Cannot export: none of {models} is exportable ({list(EXPORTABLE_MODELS)})")
+    if not cache_dir:
+        # Rankings are still shared within this run, just not kept for the next one
+        with tempfile.TemporaryDirectory(prefix="endodx-retrain-") as scratch:
+            return retrain(data, target, output, models, jobs=jobs, folds=folds, k_values=k_values, refit=refit,
+                           export=export, cache_dir=scratch, nested=nested, drop=drop, seed=seed)
+    timer = StageTimer()
+    with timer.stage("load"):
+        X, y, features = load_dataset(data, target, drop=drop)
+    logger.info(f"{len(y)} rows, {len(features)} features, {y.mean():.1%} positive")
+
+    inner_cv = StratifiedKFold(folds, shuffle=True, random_state=seed)
+    outer_cv = StratifiedKFold(folds, shuffle=True, random_state=seed + 1)
+    results, searches = {}, {}
+    for name, (estimator, grid, ranker) in candidate_models(models, seed).items():
+        search = build_search(estimator, grid, ranker, len(features), k_values, inner_cv, jobs, cache_dir, refit)
+        with timer.stage(f"search_{name}"):
+            search.fit(X, y)
+        searches[name] = search
+        results[name] = {
+            "best_params": _describe_params(search.best_params_),
+            "search_cv": {metric: float(search.cv_results_[f"mean_test_{metric}"][search.best_index_])
+                          for metric in SCORING},
+            "features": selected_features(search.best_estimator_, features),
+        }
+        if nested:
+            # The search runs again inside every outer fold, so these scores are not tuned on their own test data
+            inner = clone(search).set_params(n_jobs=1)
+            with timer.stage(f"evaluate_{name}"):
+                scores = cross_validate(inner, X, y, cv=outer_cv, scoring=SCORING, n_jobs=jobs)
+            results[name]["nested_cv"] = _summary(scores)
+        summary = results[name].get("nested_cv", {m: {"mean": v} for m, v in results[name]["search_cv"].items()})
+        logger.info(f"{name}: " + "  ".join(f"{m}={s['mean']:.4f}" for m, s in summary.items()))
+
+    score_key = "nested_cv" if nested else "search_cv"
+
+    def headline(name):
+        value = results[name][score_key][refit]
+        return value["mean"] if isinstance(value, dict) else value
+    if export == "best":
+        exported = max((name for name in results if name in EXPORTABLE_MODELS), key=headline)
+        top = max(results, key=headline)
+        if top != exported:
+            logger.warning(f"{top} scored best but only {list(EXPORTABLE_MODELS)} can be exported; exporting {exported}")
+    else:
+        exported = export
+    if exported not in searches:
+        raise ValueError(f"Cannot export {exported!r}: it was not trained (models: {list(searches)})")
+
+    with timer.stage("export"):
+        # Probability calibration is only needed for serving, so it is left out of the search
+        best = searches[exported].best_estimator_
+        if isinstance(best.named_steps["model"], SVC):
+            best = clone(best).set_params(model__probability=True).fit(X, y)
+        report = {
+            "data": os.path.abspath(data),
+            "rows": int(len(y)),
+            "positive_rate": float(y.mean()),
+            "features": features,
+            "folds": folds,
+            "refit_metric": refit,
+            "exported_model": exported,
+            "models": results,
+        }
+        write_artifacts(best, features, output, report)
+    report["timings"] = timer.seconds
+    with open(os.path.join(output, REPORT_FILE), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def print_report(report: Dict[str, object]) -> None:
+    metrics = list(SCORING)
+    print(f"{'model':<10}" + "".join(f"{m:>18}" for m in metrics))
+    for name, result in report["models"].items():
+        scores = result.get("nested_cv")
+        if scores is not None:
+            cells = [f"{scores[m]['mean']:.4f} ± {scores[m]['std']:.4f}" for m in metrics]
+        else:
+            cells = [f"{result['search_cv'][m]:.4f}" for m in metrics]
+        marker = " *" if name == report["exported_model"] else ""
+        print(f"{name + marker:<10}" + "".join(f"{c:>18}" for c in cells))
+    print("\nStage timings: " + ", ".join(f"{k} {v:.1f}s" for k, v in report["timings"].items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrain and evaluate the EndoDx models on a symptom CSV")
+    parser.add_argument("data", help="CSV with one 0/1 column per symptom and a target column")
+    parser.add_argument("--target", default="endometriosis", help="name of the 0/1 or yes/no label column")
+    parser.add_argument("--drop", nargs="*", default=[], help="extra columns to ignore, e.g. an id column")
+    parser.add_argument("--output", default=os.path.join("models", "versions", time.strftime("%Y%m%d-%H%M%S")),
+                        help="version directory to write the artifacts to")
+    parser.add_argument("--models", nargs="+", default=["svm", "logreg", "rf", "mlp"],
+                        help="models to compare: svm logreg rf mlp xgboost")
+    parser.add_argument("--export", default="svm", choices=list(EXPORTABLE_MODELS) + ["best"],
+                        help="model to export, or 'best' for the top-scoring exportable model")
+    parser.add_argument("--refit-metric", default="f1", choices=list(SCORING))
+    parser.add_argument("--k", nargs="+", default=[str(k) for k in DEFAULT_K],
+                        help="numbers of features to try, or 'all'")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--jobs", type=int, default=-1, help="worker processes (-1 for all cores)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="feature-ranking cache kept between runs ('' for this run only)")
+    parser.add_argument("--no-nested", action="store_true", help="skip the nested CV evaluation")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    k_values = [k if k == "all" else int(k) for k in args.k]
+    report = retrain(args.data, args.target, args.output, args.models, jobs=args.jobs, folds=args.folds,
+                     k_values=k_values, refit=args.refit_metric, export=args.export,
+                     cache_dir=args.cache_dir or None, nested=not args.no_nested, drop=tuple(args.drop),
+                     seed=args.seed)
+    print_report(report)
+    print(f"\nWrote {args.output}")
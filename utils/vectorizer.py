@@ -0,0 +1,141 @@
+"""Vectorized conversion of many symptom lists into model inputs.
+
+``map_symptoms_to_vector`` builds a set and scans every feature for each
+input, returning a dense float64 row. At cohort scale that per-row Python
+work and the 200 bytes per row of dense float64 dominate. A
+``SymptomVectorizer`` is built once per feature list and converts a whole
+batch of lists at once. It flattens the names and maps them to column
+numbers in a single pass, then does all per-row work in NumPy. Input is
+processed in blocks of ``chunk_rows`` lists, so temporary arrays stay small
+however large the batch. The output is one of:
+
+- ``to_bitmasks``: one packed uint32 (up to 32 features) or uint64 (up to 64)
+  per row, with bit i set when ``features[i]`` is present. This is the same
+  encoding as ``utils.helpers.SymptomCodec``, so the results can go straight
+  to the prediction cache or table.
+- ``to_csr``: a ``scipy.sparse.csr_matrix`` of uint8 ones, about 2 bytes per
+  present symptom.
+- ``to_dense``: the float64 matrix the scorers take, for batches small
+  enough to hold densely.
+
+``iter_dense`` expands bitmasks or a CSR matrix to float64 in fixed-size
+chunks, so only one chunk is ever dense:
+
+    vectorizer = vectorizer_for(features)
+    masks = vectorizer.to_bitmasks(symptom_lists)
+    preds, probas = score_chunks(compiled.predict_matrix, vectorizer.iter_dense(masks))
+
+Names that aren't in ``symptom_mapping`` or not used by the model are
+ignored, as in ``map_symptoms_to_vector``.
+"""
+from functools import lru_cache
+from itertools import chain, repeat
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from scipy import sparse
+
+from utils.helpers import symptom_mapping
+
+DEFAULT_CHUNK_ROWS = 65536
+
+ScoreFn = Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]
+
+
+class SymptomVectorizer:
+    def __init__(self, features: Sequence[str], chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        if len(features) > 64:
+            raise ValueError(f"Bitmasks hold at most 64 features, got {len(features)}")
+        self.features = list(features)
+        self.n_features = len(self.features)
+        self.chunk_rows = chunk_rows
+        self.mask_dtype = np.dtype(np.uint32 if self.n_features <= 32 else np.uint64)
+        feature_index = {f: i for i, f in enumerate(self.features)}
+        # Display name -> column; names the model doesn't use are simply absent
+        self.columns = {name: feature_index[f] for name, f in symptom_mapping.items() if f in feature_index}
+        self.bits = np.left_shift(np.ones(1, dtype=self.mask_dtype),
+                                  np.arange(self.n_features, dtype=self.mask_dtype))
+
+    def _coordinates(self, symptom_lists: Sequence[Sequence[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Row and column of every recognised name, in input order (duplicates kept)"""
+        lengths = np.fromiter(map(len, symptom_lists), dtype=np.int32, count=len(symptom_lists))
+        columns = np.fromiter(map(self.columns.get, chain.from_iterable(symptom_lists), repeat(-1)),
+                              dtype=np.int8, count=int(lengths.sum()))
+        rows = np.repeat(np.arange(len(symptom_lists), dtype=np.int32), lengths)
+        known = columns >= 0
+        return rows[known], columns[known]
+
+    def _chunks(self, symptom_lists: Sequence[Sequence[str]]) -> Iterator[Tuple[int, np.ndarray, np.ndarray]]:
+        """(first row, rows, columns) per block of ``chunk_rows`` lists, bounding the temporary arrays"""
+        for start in range(0, len(symptom_lists), self.chunk_rows):
+            rows, columns = self._coordinates(symptom_lists[start:start + self.chunk_rows])
+            yield start, rows, columns
+
+    def to_bitmasks(self, symptom_lists: Sequence[Sequence[str]]) -> np.ndarray:
+        """One packed feature bitmask per list"""
+        masks = np.zeros(len(symptom_lists), dtype=self.mask_dtype)
+        for start, rows, columns in self._chunks(symptom_lists):
+            np.bitwise_or.at(masks, rows + start, self.bits[columns])
+        return masks
+
+    def to_csr(self, symptom_lists: Sequence[Sequence[str]]) -> sparse.csr_matrix:
+        """Sparse (n x N) indicator matrix; repeated names count once"""
+        counts = np.zeros(len(symptom_lists), dtype=np.int64)
+        indices = []
+        for start, rows, columns in self._chunks(symptom_lists):
+            cells = np.unique(rows.astype(np.int64) * self.n_features + columns)
+            counts[start:start + self.chunk_rows] = np.bincount(cells // self.n_features,
+                                                                minlength=min(self.chunk_rows,
+                                                                              len(symptom_lists) - start))
+            indices.append((cells % self.n_features).astype(np.int32))
+        indptr = np.zeros(len(symptom_lists) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+        return sparse.csr_matrix((np.ones(len(indices), dtype=np.uint8), indices, indptr),
+                                 shape=(len(symptom_lists), self.n_features))
+
+    def to_dense(self, symptom_lists: Sequence[Sequence[str]]) -> np.ndarray:
+        """Dense float64 (n x N) feature matrix, same as ``map_symptom_lists_to_matrix``"""
+        matrix = np.zeros((len(symptom_lists), self.n_features))
+        for start, rows, columns in self._chunks(symptom_lists):
+            matrix[rows + start, columns] = 1.0
+        return matrix
+
+    def expand_bitmasks(self, masks: np.ndarray) -> np.ndarray:
+        """Dense float64 rows of packed bitmasks"""
+        masks = np.asarray(masks, dtype=self.mask_dtype)
+        return ((masks[:, None] & self.bits) != 0).astype(float)
+
+    def iter_dense(self, packed: Union[np.ndarray, sparse.spmatrix],
+                   chunk_rows: Optional[int] = None) -> Iterator[np.ndarray]:
+        """Expand bitmasks or a CSR matrix into float64 matrices of at most ``chunk_rows`` rows"""
+        chunk_rows = chunk_rows or self.chunk_rows
+        for start in range(0, packed.shape[0], chunk_rows):
+            chunk = packed[start:start + chunk_rows]
+            if sparse.issparse(chunk):
+                yield chunk.toarray().astype(float)
+            else:
+                yield self.expand_bitmasks(chunk)
+
+
+@lru_cache(maxsize=8)
+def _cached_vectorizer(features: Tuple[str, ...]) -> SymptomVectorizer:
+    return SymptomVectorizer(features)
+
+
+def vectorizer_for(features: Sequence[str]) -> SymptomVectorizer:
+    """Shared vectorizer for a feature list, built on first use"""
+    return _cached_vectorizer(tuple(features))
+
+
+def score_chunks(score_fn: ScoreFn, chunks: Iterable[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Run ``score_fn`` over dense chunks and concatenate predictions and probabilities"""
+    preds: List[np.ndarray] = []
+    probas: List[np.ndarray] = []
+    for chunk in chunks:
+        p, q = score_fn(chunk)
+        preds.append(np.asarray(p))
+        probas.append(np.asarray(q))
+    if not preds:
+        return np.zeros(0, dtype=int), np.zeros(0)
+    return np.concatenate(preds), np.concatenate(probas)